@@ -0,0 +1,292 @@
+"""Filters and streaming exports of the admin listings.
+
+The listing pages and their exports build their WHERE clauses from the same
+query-string filters. An export runs one select with yield_per, so rows
+come from a server-side cursor EXPORT_YIELD_PER at a time and memory stays
+flat however many rows match:
+
+- CSV is written as the rows arrive and sent in chunks, so the download
+  starts with the first rows;
+- XLSX is written by openpyxl in write-only mode (rows go to a temporary
+  file, not memory) and streamed once the workbook is closed, since a ZIP
+  file is only complete at its end.
+
+Case exports use the column names of the case import, so an exported file
+can be imported again. Text starting with a formula character is prefixed
+with an apostrophe so spreadsheets show it instead of evaluating it.
+"""
+import csv
+import io
+import tempfile
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import or_, select
+from sqlalchemy.orm import aliased
+
+from models import Appointment, Case, Court, LawyerProfile, User
+
+EXPORT_YIELD_PER = 1000
+CSV_CHUNK_ROWS = 500
+XLSX_CHUNK_BYTES = 64 * 1024
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+# Spreadsheets run cells starting with these as formulas
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def case_filters(search='', status='', case_type=''):
+    criteria = []
+    if search:
+        criteria.append(or_(Case.title.contains(search),
+                            Case.case_number.contains(search),
+                            Case.description.contains(search)))
+    if status:
+        criteria.append(Case.status == status)
+    if case_type:
+        criteria.append(Case.case_type == case_type)
+    return criteria
+
+
+def user_filters(search='', role='', status=''):
+    criteria = []
+    if search:
+        criteria.append(or_(User.first_name.contains(search),
+                            User.last_name.contains(search),
+                            User.username.contains(search),
+                            User.email.contains(search)))
+    if role:
+        criteria.append(User.role == role)
+    if status == 'active':
+        criteria.append(User.is_active == True)
+    elif status == 'inactive':
+        criteria.append(User.is_active == False)
+    return criteria
+
+
+def lawyer_filters(search='', verified='', specialization=''):
+    """Criteria on users joined to lawyer_profiles"""
+    criteria = [User.role == 'lawyer']
+    if search:
+        criteria.append(or_(User.first_name.contains(search),
+                            User.last_name.contains(search),
+                            LawyerProfile.license_number.contains(search),
+                            LawyerProfile.law_firm.contains(search)))
+    if verified == 'verified':
+        criteria.append(LawyerProfile.is_verified == True)
+    elif verified == 'unverified':
+        criteria.append(LawyerProfile.is_verified == False)
+    if specialization:
+        criteria.append(LawyerProfile.specialization == specialization)
+    return criteria
+
+
+def appointment_filters(search='', status='', appointment_type='', court_id=None, day=None):
+    """day is a date; court_id matches appointments of the court's cases"""
+    criteria = []
+    if search:
+        criteria.append(or_(Appointment.title.contains(search),
+                            Appointment.description.contains(search),
+                            Appointment.location.contains(search)))
+    if status:
+        criteria.append(Appointment.status == status)
+    if appointment_type:
+        criteria.append(Appointment.appointment_type == appointment_type)
+    if court_id:
+        criteria.append(Appointment.case_id.in_(select(Case.id).where(Case.court_id == court_id)))
+    if day:
+        start = datetime.combine(day, time.min)
+        criteria.append(Appointment.start_datetime >= start)
+        criteria.append(Appointment.start_datetime < start + timedelta(days=1))
+    return criteria
+
+
+def _parse_day(value):
+    try:
+        return date.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+
+# Query-string arguments each listing filters on
+LISTING_FILTER_ARGS = {
+    'cases': ('search', 'status', 'type'),
+    'users': ('search', 'role', 'status'),
+    'lawyers': ('search', 'verified', 'specialization'),
+    'appointments': ('search', 'status', 'type', 'court', 'date'),
+}
+
+
+def has_listing_filters(listing, args):
+    return any(args.get(name) for name in LISTING_FILTER_ARGS[listing])
+
+
+def listing_filters(listing, args):
+    """The criteria of an admin listing from its query-string filters"""
+    if listing == 'cases':
+        return case_filters(args.get('search', ''), args.get('status', ''), args.get('type', ''))
+    if listing == 'users':
+        return user_filters(args.get('search', ''), args.get('role', ''), args.get('status', ''))
+    if listing == 'lawyers':
+        return lawyer_filters(args.get('search', ''), args.get('verified', ''), args.get('specialization', ''))
+    return appointment_filters(args.get('search', ''), args.get('status', ''), args.get('type', ''),
+                               args.get('court', type=int), _parse_day(args.get('date')))
+
+
+def _cases_export(criteria):
+    lawyer, client = aliased(User), aliased(User)
+    columns = [
+        ('رقم القضية', Case.case_number),
+        ('عنوان القضية', Case.title),
+        ('الوصف', Case.description),
+        ('نوع القضية', Case.case_type),
+        ('الحالة', Case.status),
+        ('الأولوية', Case.priority),
+        ('المحامي', lawyer.username),
+        ('العميل', client.username),
+        ('المحكمة', Court.name),
+        ('تاريخ رفع القضية', Case.filed_date),
+        ('تاريخ الجلسة القادمة', Case.next_hearing_date),
+        ('تاريخ الإغلاق', Case.closed_date),
+        ('تاريخ الإنشاء', Case.created_at),
+    ]
+    statement = (select(*(column for _, column in columns))
+                 .join(lawyer, Case.lawyer_id == lawyer.id)
+                 .join(client, Case.client_id == client.id)
+                 .outerjoin(Court, Case.court_id == Court.id)
+                 .where(*criteria).order_by(Case.created_at.desc()))
+    return columns, statement
+
+
+def _users_export(criteria):
+    columns = [
+        ('المعرف', User.id),
+        ('اسم المستخدم', User.username),
+        ('البريد الإلكتروني', User.email),
+        ('الاسم الأول', User.first_name),
+        ('اسم العائلة', User.last_name),
+        ('الهاتف', User.phone),
+        ('الدور', User.role),
+        ('نشط', User.is_active),
+        ('تاريخ التسجيل', User.created_at),
+    ]
+    statement = select(*(column for _, column in columns)).where(*criteria).order_by(User.created_at.desc())
+    return columns, statement
+
+
+def _lawyers_export(criteria):
+    columns = [
+        ('المعرف', User.id),
+        ('اسم المستخدم', User.username),
+        ('الاسم الأول', User.first_name),
+        ('اسم العائلة', User.last_name),
+        ('البريد الإلكتروني', User.email),
+        ('الهاتف', User.phone),
+        ('رقم الترخيص', LawyerProfile.license_number),
+        ('التخصص', LawyerProfile.specialization),
+        ('المحافظة', LawyerProfile.governorate),
+        ('مكتب المحاماة', LawyerProfile.law_firm),
+        ('سنوات الخبرة', LawyerProfile.experience_years),
+        ('أتعاب الاستشارة', LawyerProfile.consultation_fee),
+        ('التقييم', LawyerProfile.rating),
+        ('عدد التقييمات', LawyerProfile.total_reviews),
+        ('موثق', LawyerProfile.is_verified),
+    ]
+    statement = (select(*(column for _, column in columns))
+                 .join(LawyerProfile, LawyerProfile.user_id == User.id)
+                 .where(*criteria).order_by(User.created_at.desc()))
+    return columns, statement
+
+
+def _appointments_export(criteria):
+    columns = [
+        ('المعرف', Appointment.id),
+        ('العنوان', Appointment.title),
+        ('النوع', Appointment.appointment_type),
+        ('البداية', Appointment.start_datetime),
+        ('النهاية', Appointment.end_datetime),
+        ('الحالة', Appointment.status),
+        ('المكان', Appointment.location),
+        ('المستخدم', User.username),
+        ('رقم القضية', Case.case_number),
+    ]
+    statement = (select(*(column for _, column in columns))
+                 .join(User, Appointment.user_id == User.id)
+                 .outerjoin(Case, Appointment.case_id == Case.id)
+                 .where(*criteria).order_by(Appointment.start_datetime.desc()))
+    return columns, statement
+
+
+EXPORTS = {
+    'cases': _cases_export,
+    'users': _users_export,
+    'lawyers': _lawyers_export,
+    'appointments': _appointments_export,
+}
+
+
+def _cell_value(value):
+    """User-entered text is exported as text, never as a formula"""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (datetime, date)):
+        return value.isoformat(sep=' ') if isinstance(value, datetime) else value.isoformat()
+    return _cell_value(value)
+
+
+def csv_chunks(headers, rows):
+    """CSV text in chunks of CSV_CHUNK_ROWS rows, with a BOM so Excel reads Arabic"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(headers)
+    for count, row in enumerate(rows, 1):
+        writer.writerow([_csv_value(value) for value in row])
+        if count % CSV_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def xlsx_chunks(workbook, headers, rows):
+    """Bytes of a write-only openpyxl workbook holding the rows"""
+    sheet = workbook.create_sheet()
+    sheet.sheet_view.rightToLeft = True
+    sheet.append(headers)
+    for row in rows:
+        sheet.append([_cell_value(value) for value in row])
+    with tempfile.TemporaryFile() as f:
+        workbook.save(f)
+        f.seek(0)
+        while True:
+            chunk = f.read(XLSX_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
+
+
+def export_listing(session, listing, args, file_format):
+    """(chunks, mimetype, file name) of an admin listing export with the request's filters"""
+    workbook = None
+    if file_format == 'xlsx':
+        try:
+            from openpyxl import Workbook
+        except ImportError:
+            raise RuntimeError('تصدير ملفات XLSX يتطلب تثبيت الحزمة openpyxl')
+        workbook = Workbook(write_only=True)
+
+    columns, statement = EXPORTS[listing](listing_filters(listing, args))
+    headers = [header for header, _ in columns]
+
+    def rows():
+        yield from session.execute(statement, execution_options={'yield_per': EXPORT_YIELD_PER})
+
+    file_name = f'{listing}_{datetime.utcnow():%Y%m%d_%H%M%S}.{file_format}'
+    if workbook is not None:
+        return xlsx_chunks(workbook, headers, rows()), XLSX_MIMETYPE, file_name
+    return csv_chunks(headers, rows()), 'text/csv', file_name
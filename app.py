@@ -5,15 +5,18 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
+from replicas import RoutingSession, replica_binds
+from sqlite_profile import DEFAULT_PRAGMAS, apply_sqlite_profile
+from metrics import DEFAULT_BUCKETS
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Configure logging; slow queries and N+1 patterns are logged as warnings
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"))
 
 class Base(DeclarativeBase):
     pass
 
 # Initialize extensions
-db = SQLAlchemy(model_class=Base)
+db = SQLAlchemy(model_class=Base, session_options={"class_": RoutingSession})
 login_manager = LoginManager()
 
 def create_app():
@@ -27,19 +30,92 @@ def create_app():
         "pool_recycle": 300,
         "pool_pre_ping": True,
     }
+    # Comma-separated replica URLs; safe reads in GET requests go to them
+    app.config["SQLALCHEMY_BINDS"] = replica_binds(
+        [url.strip() for url in os.environ.get("READ_REPLICA_URLS", "").split(",") if url.strip()]
+    )
+    app.config["READ_REPLICA_MAX_LAG"] = float(os.environ.get("READ_REPLICA_MAX_LAG", 5))  # seconds
+    app.config["READ_REPLICA_LAG_CHECK_INTERVAL"] = float(os.environ.get("READ_REPLICA_LAG_CHECK_INTERVAL", 2))
+    # WAL and friends for SQLite databases; SQLITE_PROFILE=0 keeps SQLite's defaults
+    app.config["SQLITE_PRAGMAS"] = dict(DEFAULT_PRAGMAS, busy_timeout=int(os.environ.get("SQLITE_BUSY_TIMEOUT", 5000)))
+    if os.environ.get("SQLITE_PROFILE", "1") != "1":
+        app.config["SQLITE_PRAGMAS"] = {}
+    app.config["QUERY_STATS_ENABLED"] = os.environ.get("QUERY_STATS_ENABLED", "1") == "1"
+    app.config["QUERY_SLOW_THRESHOLD_MS"] = float(os.environ.get("QUERY_SLOW_THRESHOLD_MS", 200))
+    app.config["QUERY_N_PLUS_ONE_THRESHOLD"] = 5  # same SELECT this many times in one request
+    app.config["QUERY_STATS_WINDOW"] = 100  # recent requests kept per endpoint
+    app.config["QUERY_SERVER_TIMING"] = os.environ.get("QUERY_SERVER_TIMING", "0") == "1"  # Server-Timing for everyone, not just admins
+    app.config["METRICS_ENABLED"] = os.environ.get("METRICS_ENABLED", "1") == "1"
+    app.config["METRICS_FOLDER"] = os.environ.get("METRICS_FOLDER", "cache/metrics")  # shared by the workers on a host
+    app.config["METRICS_FLUSH_INTERVAL"] = 5  # seconds between writes of a worker's file
+    app.config["METRICS_BUCKETS"] = DEFAULT_BUCKETS  # latency histogram bounds, seconds
+    app.config["METRICS_TOKEN"] = os.environ.get("METRICS_TOKEN", "")  # bearer token for /metrics; empty allows admins only
+    app.config["PROFILER_FOLDER"] = os.environ.get("PROFILER_FOLDER", "cache/profiles")  # shared by the workers on a host
+    app.config["PROFILER_MODE"] = os.environ.get("PROFILER_MODE", "sample")  # sample or cprofile
+    app.config["PROFILER_SAMPLE_INTERVAL"] = 0.005  # seconds between stack samples
+    app.config["PROFILER_MAX_PROFILES"] = int(os.environ.get("PROFILER_MAX_PROFILES", 200))
+    app.config["PROFILER_SWITCH_CHECK_INTERVAL"] = 2  # seconds before a worker sees the admin switch
+    app.config["PROFILER_TOKEN_MAX_AGE"] = 3600  # seconds an X-Profile header token stays valid
+    app.config["READ_REPLICA_STICKY_SECONDS"] = int(os.environ.get("READ_REPLICA_STICKY_SECONDS", 10))  # primary reads after a write
     app.config["UPLOAD_FOLDER"] = "uploads"
     app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024  # 16MB max file size
+    app.config["MAIL_MERGE_WORKERS"] = int(os.environ.get("MAIL_MERGE_WORKERS", os.cpu_count() or 1))
+    app.config["MAIL_MERGE_CHUNK_SIZE"] = int(os.environ.get("MAIL_MERGE_CHUNK_SIZE", 200))
+    app.config["RENDER_CACHE_FOLDER"] = os.environ.get("RENDER_CACHE_FOLDER", "cache/rendered")
+    app.config["RENDER_CACHE_MEMORY_BYTES"] = int(os.environ.get("RENDER_CACHE_MEMORY_BYTES", 32 * 1024 * 1024))
+    app.config["RENDER_CACHE_DISK_BYTES"] = int(os.environ.get("RENDER_CACHE_DISK_BYTES", 512 * 1024 * 1024))
+    app.config["CASE_TIMELINE_PAGE_SIZE"] = 20
+    app.config["CASE_IMPORT_BATCH_SIZE"] = int(os.environ.get("CASE_IMPORT_BATCH_SIZE", 1000))
+    app.config["CASE_ARCHIVE_AFTER_DAYS"] = int(os.environ.get("CASE_ARCHIVE_AFTER_DAYS", 365))  # since closed_date
+    app.config["USER_DELETE_BATCH_SIZE"] = int(os.environ.get("USER_DELETE_BATCH_SIZE", 500))  # rows per transaction
+    app.config["CASE_ARCHIVE_BATCH_SIZE"] = int(os.environ.get("CASE_ARCHIVE_BATCH_SIZE", 500))  # cases per transaction
+    app.config["BULK_ACTION_BATCH_SIZE"] = int(os.environ.get("BULK_ACTION_BATCH_SIZE", 1000))  # rows per bulk action transaction
+    app.config["CASE_NUMBER_FORMAT"] = os.environ.get("CASE_NUMBER_FORMAT", "CASE-{date:%Y%m%d}-{seq:06d}")
+    app.config["CASE_NUMBER_SCOPE"] = os.environ.get("CASE_NUMBER_SCOPE", "day")  # day, year, court_day, court_year
+    app.config["CASE_NUMBER_BLOCK_SIZE"] = int(os.environ.get("CASE_NUMBER_BLOCK_SIZE", 20))
+    if app.config["CASE_NUMBER_SCOPE"] in ("court_day", "court_year") and "{court" not in app.config["CASE_NUMBER_FORMAT"]:
+        # Each court counts from 1, so numbers without the court would collide
+        raise RuntimeError(f'CASE_NUMBER_SCOPE={app.config["CASE_NUMBER_SCOPE"]} requires {{court}} in CASE_NUMBER_FORMAT')
+    app.config["COURT_GEO_CACHE_TTL"] = 300  # seconds before other workers' court edits are seen
+    app.config["COURT_KDTREE_MAX_COURTS"] = 20000
+    app.config["DIRECTORY_CACHE_PROXY_MAX_AGE"] = int(os.environ.get("DIRECTORY_CACHE_PROXY_MAX_AGE", 60))
+    app.config["DIRECTORY_CACHE_MAX_ENTRIES"] = 500
+    app.config["LAWYER_RATING_PRIOR_MEAN"] = 3.0  # ranking score of a lawyer with no reviews
+    app.config["LAWYER_RATING_PRIOR_WEIGHT"] = 5  # reviews' worth of weight given to the prior
+    app.config["LAWYER_FACET_CACHE_TTL"] = 30
+    app.config["LAWYER_RECOMMENDER_REFRESH"] = int(os.environ.get("LAWYER_RECOMMENDER_REFRESH", 600))
+    app.config["FRAGMENT_CACHE_BACKEND"] = os.environ.get("FRAGMENT_CACHE_BACKEND", "filesystem")  # filesystem, memory, null
+    app.config["FRAGMENT_CACHE_FOLDER"] = os.environ.get("FRAGMENT_CACHE_FOLDER", "cache/fragments")
+    app.config["FRAGMENT_CACHE_TIMEOUT"] = 300
+    app.config["JINJA_BYTECODE_CACHE_FOLDER"] = os.environ.get("JINJA_BYTECODE_CACHE_FOLDER", "cache/jinja")  # empty disables
+    app.config["JINJA_PRELOAD_TEMPLATES"] = os.environ.get("JINJA_PRELOAD_TEMPLATES", "1") == "1"
     
     # Proxy fix for deployment
     app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
     
     # Initialize extensions
     db.init_app(app)
+    with app.app_context():
+        for engine in db.engines.values():
+            apply_sqlite_profile(engine, app.config["SQLITE_PRAGMAS"])
     login_manager.init_app(app)
     login_manager.login_view = 'login'
     login_manager.login_message = 'يرجى تسجيل الدخول للوصول إلى هذه الصفحة'
     login_manager.login_message_category = 'info'
     
+    from fragment_cache import FragmentCacheExtension
+    from jinja_cache import create_bytecode_cache
+    app.jinja_options = dict(app.jinja_options,
+                             bytecode_cache=create_bytecode_cache(app.config["JINJA_BYTECODE_CACHE_FOLDER"]))
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    
+    from query_stats import init_query_stats
+    from metrics import init_metrics
+    from profiler import init_profiler
+    init_query_stats(app)
+    init_metrics(app)
+    init_profiler(app)
+    
     return app
 
 app = create_app()
@@ -47,7 +123,9 @@ app = create_app()
 @login_manager.user_loader
 def load_user(user_id):
     from models import User
-    return User.query.get(int(user_id))
+    user = User.query.get(int(user_id))
+    # Disabled (or pending deletion) accounts are logged out on their next request
+    return user if user and user.is_active else None
 
 # Create tables and admin user
 with app.app_context():
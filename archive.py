@@ -0,0 +1,70 @@
+"""Archival of long-closed cases.
+
+Cases closed more than CASE_ARCHIVE_AFTER_DAYS ago move, with their
+documents, appointments and updates, from the live tables to the archived_*
+tables, CASE_ARCHIVE_BATCH_SIZE cases per transaction. A batch copies the
+rows with INSERT ... SELECT and deletes the originals, so every case is
+either live or archived whatever happens to the job, and running it again
+carries on with the cases that are left. Dashboards and listings keep
+reading the smaller live tables; view_case falls back to the archive,
+read-only, and search includes archived cases when asked to.
+"""
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, func, insert, literal, select
+
+from app import db
+from jobs import create_job, save_job
+from models import (Appointment, ArchivedAppointment, ArchivedCase, ArchivedCaseUpdate, ArchivedDocument, Case,
+                    CaseUpdate, Document)
+
+CHILD_MODELS = ((Document, ArchivedDocument), (Appointment, ArchivedAppointment), (CaseUpdate, ArchivedCaseUpdate))
+
+
+def archivable_cases(cutoff):
+    """Ids of live cases closed before cutoff"""
+    # Case ids are never reused (cases is AUTOINCREMENT on SQLite), so the
+    # archive's ids stay unique
+    return select(Case.id).where(Case.status == 'closed', Case.closed_date < cutoff)
+
+
+def _copy(live, archived, where, keep_ids=True, **values):
+    """INSERT INTO archived SELECT the live rows matching where, plus fixed column values"""
+    columns = [column for column in live.__table__.columns if keep_ids or not column.primary_key]
+    source = select(*columns, *(literal(value, archived.__table__.c[name].type) for name, value in values.items()))
+    source = source.where(where).order_by(*live.__table__.primary_key.columns)
+    return insert(archived.__table__).from_select([column.name for column in columns] + list(values), source)
+
+
+def archive_batch(case_ids):
+    """Move these cases and their children to the archive in one transaction"""
+    db.session.execute(_copy(Case, ArchivedCase, Case.id.in_(case_ids), archived_at=datetime.utcnow()))
+    for live, archived in CHILD_MODELS:
+        # Children get new archive ids; only case ids appear in URLs
+        db.session.execute(_copy(live, archived, live.case_id.in_(case_ids), keep_ids=False))
+        db.session.execute(delete(live.__table__).where(live.case_id.in_(case_ids)))
+    db.session.execute(delete(Case.__table__).where(Case.id.in_(case_ids)))
+    db.session.commit()
+
+
+def run_archive(job):
+    """Archive the job's cases batch by batch, recording progress after each commit"""
+    cutoff = date.fromisoformat(job['cutoff'])
+    while True:
+        case_ids = db.session.scalars(archivable_cases(cutoff).order_by(Case.id).limit(job['batch_size'])).all()
+        if not case_ids:
+            break
+        archive_batch(case_ids)
+        job['archived'] += len(case_ids)
+        job['done'] = min(job['archived'], job['total'])
+        save_job(job)
+
+
+def create_archive_job(user_id, older_than_days=None, batch_size=None):
+    """Create a case_archive job for cases closed more than older_than_days ago; returns the job"""
+    days = older_than_days if older_than_days is not None else current_app.config['CASE_ARCHIVE_AFTER_DAYS']
+    cutoff = date.today() - timedelta(days=days)
+    total = db.session.scalar(select(func.count()).select_from(archivable_cases(cutoff).subquery()))
+    return create_job('case_archive', user_id, total=total, cutoff=cutoff.isoformat(), archived=0,
+                      batch_size=batch_size or current_app.config['CASE_ARCHIVE_BATCH_SIZE'])
@@ -0,0 +1,179 @@
+"""ASGI entry point: async handlers for the read-heavy feeds, Flask for the rest.
+
+    uvicorn asgi:application --workers 4
+
+GET requests for the JSON feeds in FEEDS are answered on an async SQLAlchemy
+session (aiosqlite or asyncpg, derived from SQLALCHEMY_DATABASE_URI) with the
+same selects and payloads as routes.py, so a slow query only parks a
+coroutine. Every other request, and any feed request that needs Flask's
+login handling, runs in the Flask app on a thread pool. The Flask session
+cookie is verified with the app's own serializer, so logins carry over.
+
+Requires the optional packages asgiref, uvicorn, sqlalchemy[asyncio] (greenlet)
+and aiosqlite or asyncpg.
+"""
+import json
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+
+from sqlalchemy import select
+
+from app import db
+from feeds import (FEED_PAGE_SIZE, calendar_select, courts_select, lawyers_select, page_payload,
+                   parse_iso_datetime, row_dict, search_selects, serialize_event, system_stats_select)
+from main import app
+from models import User
+from sqlite_profile import apply_sqlite_profile
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+except ImportError as e:
+    raise RuntimeError(f'ASGI mode needs asgiref and sqlalchemy[asyncio] ({e}): '
+                       'pip install asgiref uvicorn "sqlalchemy[asyncio]" aiosqlite')
+
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+}
+
+
+def async_database_url(url):
+    """The async-driver equivalent of a sync SQLAlchemy URL"""
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise RuntimeError(f'No async driver configured for {backend}')
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+with app.app_context():
+    # Flask-SQLAlchemy resolves relative SQLite paths against the instance folder
+    engine = create_async_engine(async_database_url(db.engine.url), pool_pre_ping=True, pool_recycle=300)
+apply_sqlite_profile(engine.sync_engine, app.config['SQLITE_PRAGMAS'])
+async_session = async_sessionmaker(engine, expire_on_commit=False)
+
+flask_application = WsgiToAsgi(app)
+session_serializer = app.session_interface.get_signing_serializer(app)
+
+
+def _query_params(scope):
+    return {key: values[0] for key, values in parse_qs(scope['query_string'].decode('latin-1')).items()}
+
+
+def _int_param(params, name, default):
+    try:
+        return int(params.get(name, default))
+    except ValueError:
+        return default
+
+
+def _session_user_id(scope):
+    """User id from the signed Flask session cookie, or None"""
+    for name, value in scope['headers']:
+        if name != b'cookie':
+            continue
+        morsel = SimpleCookie(value.decode('latin-1')).get(app.config['SESSION_COOKIE_NAME'])
+        if morsel is None:
+            return None
+        try:
+            data = session_serializer.loads(
+                morsel.value, max_age=int(app.permanent_session_lifetime.total_seconds())
+            )
+        except Exception:
+            return None
+        return data.get('_user_id')
+    return None
+
+
+async def _load_user(session, user_id):
+    row = (await session.execute(
+        select(User.id, User.role).where(User.id == int(user_id), User.is_active == True)
+    )).first()
+    return row
+
+
+async def courts_feed(session, params, user):
+    page = max(_int_param(params, 'page', 1), 1)
+    statement = courts_select(params.get('search', ''), params.get('governorate', ''),
+                              params.get('court_type', ''), page)
+    return page_payload((await session.execute(statement)).all(), page, FEED_PAGE_SIZE)
+
+
+async def lawyers_feed(session, params, user):
+    page = max(_int_param(params, 'page', 1), 1)
+    statement = lawyers_select(params.get('search', ''), params.get('specialization', ''),
+                               params.get('governorate', ''), page)
+    return page_payload((await session.execute(statement)).all(), page, FEED_PAGE_SIZE)
+
+
+async def search_feed(session, params, user):
+    selects = search_selects(params['query'], params.get('category', 'all'),
+                             user.id if user else None, user.role if user else None,
+                             include_archived=params.get('archived') == '1')
+    results = {}
+    for name, statement in selects.items():
+        results[name] = [row_dict(row) for row in await session.execute(statement)]
+    return results
+
+
+async def calendar_feed(session, params, user):
+    statement = calendar_select(user.id, user.role, parse_iso_datetime(params.get('start')),
+                                parse_iso_datetime(params.get('end')))
+    if statement is None:
+        return []
+    return [serialize_event(row) for row in await session.execute(statement)]
+
+
+async def stats_feed(session, params, user):
+    return dict((await session.execute(system_stats_select())).one()._mapping)
+
+
+# path -> (handler, applies to the request, required role: None, 'user' or 'admin')
+FEEDS = {
+    '/courts': (courts_feed, lambda params: params.get('format') == 'json', None),
+    '/lawyers': (lawyers_feed, lambda params: params.get('format') == 'json', None),
+    '/search': (search_feed, lambda params: params.get('format') == 'json' and params.get('query'), None),
+    '/calendar/events': (calendar_feed, lambda params: True, 'user'),
+    '/admin/dashboard/stats': (stats_feed, lambda params: True, 'admin'),
+}
+
+
+async def _send_json(send, payload, status=200):
+    body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await engine.dispose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+
+    feed = FEEDS.get(scope.get('path')) if scope['type'] == 'http' and scope['method'] == 'GET' else None
+    params = _query_params(scope) if feed else None
+    if feed is None or not feed[1](params):
+        return await flask_application(scope, receive, send)
+
+    handler, _, required = feed
+    async with async_session() as session:
+        user_id = _session_user_id(scope)
+        user = await _load_user(session, user_id) if user_id else None
+        if required and (user is None or (required == 'admin' and user.role != 'admin')):
+            # Login redirects, remember-me cookies and error pages stay with Flask
+            return await flask_application(scope, receive, send)
+        payload = await handler(session, params, user)
+    await _send_json(send, payload)
@@ -0,0 +1,852 @@
+"""Micro-benchmarks for performance-sensitive helpers.
+
+Usage: python benchmarks.py <name> [options]
+"""
+import argparse
+import re
+import sys
+import time
+import timeit
+from datetime import date
+
+
+def _legacy_fill_template(template_content, field_values):
+    """The original str.replace-per-field implementation, kept for comparison"""
+    for field_name, value in field_values.items():
+        placeholder = f"{{{{{field_name}}}}}"
+        template_content = template_content.replace(placeholder, str(value))
+    return template_content
+
+
+def _sample_pleading(field_count, paragraphs):
+    """Build a long Arabic pleading with field_count distinct placeholders"""
+    paragraph = ('بناءً على ما تقدم فإن المدعي يلتمس من عدالة المحكمة الموقرة '
+                 'الحكم له بطلباته الواردة في صحيفة الدعوى مع إلزام المدعى عليه بالمصاريف. ')
+    parts = []
+    for i in range(paragraphs):
+        parts.append(paragraph)
+        parts.append(f'{{{{field_{i % field_count}}}}} ')
+    values = {f'field_{i}': f'قيمة الحقل رقم {i}' for i in range(field_count)}
+    return ''.join(parts), values
+
+
+def bench_templates(args):
+    from template_engine import compile_template
+
+    content, values = _sample_pleading(args.fields, args.paragraphs)
+    compiled = compile_template(content)
+    assert compiled.render(values) == _legacy_fill_template(content, values)
+
+    legacy = timeit.Timer(lambda: _legacy_fill_template(content, values))
+    compile_once = timeit.Timer(lambda: compile_template(content))
+    render = timeit.Timer(lambda: compiled.render(values))
+
+    print(f'template: {len(content)} chars, {args.fields} fields')
+    for name, timer in (('legacy fill_template', legacy),
+                        ('compile (once per version)', compile_once),
+                        ('compiled render', render)):
+        best = min(timer.repeat(repeat=5, number=args.number)) / args.number
+        print(f'{name:<28} {best * 1e6:10.1f} us')
+
+    typed = compile_template(
+        '{{date|date}} {{amount|number}} {% if urgent %}عاجل{% endif %}'
+        '{% for p in parties %}{{p.name}}، {% endfor %}'
+    )
+    typed_values = {'date': date(2024, 1, 15), 'amount': 1250000, 'urgent': True,
+                    'parties': [{'name': 'أحمد'}, {'name': 'محمد'}]}
+    best = min(timeit.Timer(lambda: typed.render(typed_values)).repeat(5, args.number)) / args.number
+    print(f'{"typed fields render":<28} {best * 1e6:10.1f} us')
+
+
+def _allocate_case_numbers(count, threads):
+    """Worker process: allocate count numbers from several threads"""
+    from concurrent.futures import ThreadPoolExecutor
+    from app import app, db
+    from case_numbers import CaseNumberAllocator
+
+    with app.app_context():
+        allocator = CaseNumberAllocator(db.engine, block_size=app.config['CASE_NUMBER_BLOCK_SIZE'])
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            return list(pool.map(lambda _: allocator.allocate(), range(count)))
+
+
+def bench_case_numbers(args):
+    """Concurrency stress test: N processes x T threads allocating case numbers"""
+    import multiprocessing
+    import os
+    import tempfile
+    import time
+    from concurrent.futures import ProcessPoolExecutor
+
+    if 'DATABASE_URL' not in os.environ:
+        db_path = os.path.join(tempfile.mkdtemp(), 'case_numbers.db')
+        os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    import app  # noqa: F401  create tables once before the workers start
+
+    started = time.perf_counter()
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=context) as pool:
+        results = list(pool.map(_allocate_case_numbers, [args.count] * args.workers,
+                                [args.threads] * args.workers))
+    elapsed = time.perf_counter() - started
+
+    numbers = [number for result in results for number in result]
+    duplicates = len(numbers) - len(set(numbers))
+    print(f'{args.workers} workers x {args.threads} threads: {len(numbers)} numbers '
+          f'in {elapsed:.2f}s, {duplicates} collisions')
+    return 1 if duplicates else 0
+
+
+def bench_courts_knn(args):
+    """k-NN latency: KD-tree vs brute-force haversine over a synthetic court set"""
+    import random
+    from geo import KDTree, haversine_km
+
+    rng = random.Random(42)
+    # Yemen's bounding box
+    courts = [(rng.uniform(12.5, 19.0), rng.uniform(42.5, 53.5), i) for i in range(args.courts)]
+    queries = [(rng.uniform(12.5, 19.0), rng.uniform(42.5, 53.5)) for _ in range(args.queries)]
+
+    build = min(timeit.repeat(lambda: KDTree(courts), repeat=3, number=1))
+    tree = KDTree(courts)
+
+    def brute(lat, lon):
+        distances = sorted((haversine_km(lat, lon, c_lat, c_lon), i) for c_lat, c_lon, i in courts)
+        return [i for d, i in distances if args.radius is None or d <= args.radius][:args.k]
+
+    def kd(lat, lon):
+        return [i for _, i in tree.nearest(lat, lon, args.k, args.radius)]
+
+    for lat, lon in queries[:50]:
+        assert kd(lat, lon) == brute(lat, lon)
+
+    print(f'{args.courts} courts, k={args.k}, radius={args.radius} km; build {build * 1e3:.2f} ms')
+    for name, func in (('brute-force haversine', brute), ('KD-tree', kd)):
+        started = time.perf_counter()
+        for lat, lon in queries:
+            func(lat, lon)
+        per_query = (time.perf_counter() - started) / len(queries)
+        print(f'{name:<28} {per_query * 1e6:10.1f} us/query')
+
+
+def bench_recommend(args):
+    """Lawyer recommendation scoring over a synthetic feature table"""
+    import random
+    import recommendations
+    from recommendations import LawyerFeatures
+    from utils import get_case_types, get_governorates
+
+    rng = random.Random(7)
+    case_types, governorates = get_case_types(), get_governorates()
+    profiles = [{
+        'id': i, 'first_name': 'محامي', 'last_name': str(i), 'law_firm': None,
+        'specialization': rng.choice(case_types), 'governorate': rng.choice(governorates),
+        'rating': 0.0, 'total_reviews': 0, 'ranking_score': rng.uniform(1, 5), 'is_verified': rng.random() < 0.7,
+    } for i in range(args.lawyers)]
+    statuses = ['active', 'pending', 'closed', 'closed', 'appeal']
+    case_counts = [(rng.randrange(args.lawyers), rng.choice(case_types), rng.choice(statuses), rng.randint(1, 20))
+                   for _ in range(args.lawyers * 10)]
+    court_counts = [(rng.randrange(args.lawyers), rng.randrange(200), rng.randint(1, 30))
+                    for _ in range(args.lawyers * 3)]
+    queries = [{'case_type': rng.choice(case_types), 'governorate': rng.choice(governorates),
+                'court_id': rng.randrange(200)} for _ in range(args.queries)]
+
+    numpy = recommendations.np
+    modes = [('pure Python', None)] + ([('NumPy', numpy)] if numpy is not None else [])
+    results = {}
+    for name, module in modes:
+        recommendations.np = module
+        try:
+            started = time.perf_counter()
+            features = LawyerFeatures(profiles, case_counts, court_counts, case_types)
+            build = time.perf_counter() - started
+            started = time.perf_counter()
+            results[name] = [[lawyer['id'] for lawyer in features.top(args.limit, **query)] for query in queries]
+            per_query = (time.perf_counter() - started) / len(queries)
+        finally:
+            recommendations.np = numpy
+        print(f'{name:<14} build {build * 1e3:8.1f} ms   {per_query * 1e3:8.3f} ms/query')
+    if numpy is None:
+        print('NumPy is not installed; only the fallback was measured')
+    else:
+        same = sum(a == b for a, b in zip(results['pure Python'], results['NumPy']))
+        print(f'identical rankings: {same}/{len(queries)}')
+
+
+FIRST_REQUEST_ROUTES = ['/', '/courts', '/lawyers', '/cases', '/calendar', '/documents/templates',
+                        '/admin', '/admin/users', '/admin/cases', '/admin/courts', '/admin/lawyers']
+
+
+def _first_request_worker(routes, preload):
+    """Fresh process: time the first and second GET of each route as admin"""
+    import os
+    os.environ['JINJA_PRELOAD_TEMPLATES'] = '1' if preload else '0'
+    started = time.perf_counter()
+    from main import app
+    startup = time.perf_counter() - started
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    timings = {}
+    for route in routes:
+        samples = []
+        for _ in range(2):
+            started = time.perf_counter()
+            try:
+                status = client.get(route).status_code
+            except Exception as e:  # e.g. a missing error template
+                status = type(e).__name__
+            samples.append(time.perf_counter() - started)
+        timings[route] = (status, samples[0], samples[1])
+    return startup, timings
+
+
+def bench_first_request(args):
+    """First-request latency per route: cold compile vs precompiled bytecode"""
+    import multiprocessing
+    import os
+    import shutil
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor
+
+    workdir = tempfile.mkdtemp()
+    if 'DATABASE_URL' not in os.environ:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'first_request.db')}"
+    cache_folder = os.path.join(workdir, 'jinja')
+    context = multiprocessing.get_context('spawn')
+
+    def measure(folder, preload):
+        os.environ['JINJA_BYTECODE_CACHE_FOLDER'] = folder
+        # One process per run so every template starts uncompiled in memory
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            return pool.submit(_first_request_worker, args.routes, preload).result()
+
+    runs = [('no bytecode cache', measure('', False))]
+    measure(cache_folder, True)  # fills the cache, like 'flask precompile-templates'
+    runs.append(('bytecode cache', measure(cache_folder, False)))
+    runs.append(('bytecode + preload', measure(cache_folder, True)))
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{'route':<22}" + ''.join(f'{name:>22}' for name, _ in runs) + f"{'warm':>10}")
+    for route in args.routes:
+        cells = [timings[route] for _, (_, timings) in runs]
+        status = cells[0][0]
+        row = ''.join(f'{first * 1e3:19.1f} ms' for _, first, _ in cells)
+        print(f'{route:<22}{row}{cells[0][2] * 1e3:7.1f} ms' + ('' if status == 200 else f'  ({status})'))
+    print(f"{'worker startup':<22}" + ''.join(f'{startup * 1e3:19.1f} ms' for _, (startup, _) in runs))
+
+
+SERVING_ENDPOINTS = ['/courts?format=json', '/lawyers?format=json', '/search?format=json&query=%D8%B9']
+
+
+def _seed_directory(count):
+    """Courts and verified lawyers for load tests against an empty database"""
+    from app import app, db
+    from models import Court, LawyerProfile, User
+
+    with app.app_context():
+        if Court.query.count() >= count:
+            return
+        governorates = ['صنعاء', 'عدن', 'تعز', 'الحديدة']
+        for i in range(count):
+            db.session.add(Court(name=f'محكمة {i}', court_type='ابتدائية', governorate=governorates[i % 4],
+                                 city=f'مدينة {i % 50}', is_active=True))
+            user = User(username=f'lawyer{i}', email=f'lawyer{i}@example.com', first_name='عبد',
+                        last_name=f'الله {i}', role='lawyer', password_hash='-')
+            db.session.add(user)
+            db.session.flush()
+            db.session.add(LawyerProfile(user_id=user.id, license_number=f'LIC-{i}', specialization='مدني',
+                                         governorate=governorates[i % 4], is_verified=True))
+        db.session.commit()
+
+
+def _load(port, paths, concurrency, duration):
+    """Closed-loop load: concurrency keep-alive clients for duration seconds"""
+    import http.client
+    import threading
+
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    lock = threading.Lock()
+
+    def client(offset):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        local, failed, i = [], 0, offset
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                conn.request('GET', paths[i % len(paths)])
+                response = conn.getresponse()
+                response.read()
+                if response.status != 200:
+                    failed += 1
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            local.append(time.perf_counter() - started)
+            i += 1
+        conn.close()
+        with lock:
+            latencies.extend(local)
+            errors.append(failed)
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, sum(errors), time.perf_counter() - started
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return float('nan')
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def _wait_for_port(port, process, timeout=30):
+    import socket
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'server exited with {process.returncode}')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'server on port {port} did not start')
+
+
+def bench_serving(args):
+    """Requests/s and tail latency: gunicorn sync workers vs uvicorn ASGI workers"""
+    import os
+    import subprocess
+    import tempfile
+
+    if 'DATABASE_URL' not in os.environ:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'serving.db')}"
+    _seed_directory(args.seed)
+
+    servers = {
+        'gunicorn (sync)': [sys.executable, '-m', 'gunicorn', '-w', str(args.workers),
+                            '-b', f'127.0.0.1:{args.port}', 'main:app'],
+        'uvicorn (ASGI)': [sys.executable, '-m', 'uvicorn', '--workers', str(args.workers),
+                           '--port', str(args.port), '--log-level', 'warning', 'asgi:application'],
+    }
+    print(f'{args.workers} workers, {args.concurrency} clients, {args.duration}s per server')
+    print(f"{'server':<18}{'req/s':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'errors':>8}")
+    for name in args.servers:
+        process = subprocess.Popen(servers[name], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                   cwd=os.path.dirname(os.path.abspath(__file__)))
+        try:
+            _wait_for_port(args.port, process)
+            _load(args.port, args.paths, args.concurrency, 1)  # warm-up
+            latencies, errors, elapsed = _load(args.port, args.paths, args.concurrency, args.duration)
+        finally:
+            process.terminate()
+            process.wait()
+        latencies.sort()
+        print(f'{name:<18}{len(latencies) / elapsed:10.0f}'
+              + ''.join(f'{_percentile(latencies, q) * 1e3:8.1f}ms' for q in (0.5, 0.95, 0.99))
+              + f'{errors:8d}')
+
+
+def bench_metrics(args):
+    """Per-request cost of the metrics hooks and the cost of a scrape"""
+    from metrics import WorkerMetrics, merge, render_prometheus
+
+    worker = WorkerMetrics()
+    endpoints = [f'endpoint_{i}' for i in range(args.endpoints)]
+    started = time.perf_counter()
+    for i in range(args.number):
+        worker.observe(endpoints[i % len(endpoints)], 200, (i % 1000) / 1000, 0)
+    per_request = (time.perf_counter() - started) / args.number
+    print(f'observe: {per_request * 1e6:.2f} us per request')
+
+    data = {'buckets': list(worker.buckets),
+            'requests': [[endpoint, status, count] for (endpoint, status), count in worker.requests.items()],
+            'latency': worker.latency, 'uploads': {}, 'caches': {}, 'pool': {}}
+    started = time.perf_counter()
+    body = render_prometheus(merge([data] * args.workers))
+    print(f'scrape of {args.workers} workers x {args.endpoints} endpoints: '
+          f'{(time.perf_counter() - started) * 1e3:.1f} ms, {len(body) / 1024:.0f} KiB')
+
+
+# name -> (environment, whether writes go through one writer thread per worker)
+SQLITE_SETUPS = {
+    'rollback journal': ({'SQLITE_PROFILE': '0'}, False),
+    'WAL': ({'SQLITE_PROFILE': '1'}, False),
+    'WAL + writer queue': ({'SQLITE_PROFILE': '1'}, True),
+}
+
+
+class _BatchWriter:
+    """Writer thread committing queued statements in batches, one BEGIN IMMEDIATE each"""
+
+    def __init__(self, engine, batch_size=100, batch_window=0.005):
+        import queue
+        import threading
+        self.engine = engine
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self._empty = queue.Empty
+        self._queue = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, statement):
+        from concurrent.futures import Future
+        future = Future()
+        self._queue.put((statement, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.batch_window
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.perf_counter(), 0)))
+                except self._empty:
+                    break
+            try:
+                with self.engine.connect() as conn:
+                    conn.exec_driver_sql('BEGIN IMMEDIATE')
+                    for statement, _ in batch:
+                        conn.execute(statement)
+                    conn.commit()
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for _, future in batch:
+                    future.set_result(None)
+
+
+def _sqlite_prepare(env, courts):
+    import os
+    os.environ.update(env)
+    _seed_directory(courts)
+
+
+def _sqlite_worker(env, use_queue, threads, duration, write_ratio, start, results):
+    """One 'gunicorn worker': threads mixing directory reads and logged writes"""
+    import os
+    import random
+    import threading
+    os.environ.update(env)
+    from sqlalchemy import insert
+    from sqlalchemy.exc import OperationalError
+    from app import app, db
+    from feeds import courts_select
+    from models import Notification
+
+    reads, writes, errors = [], [], []
+    lock = threading.Lock()
+    with app.app_context():
+        writer = _BatchWriter(db.engine) if use_queue else None
+
+    def write(statement):
+        if writer is not None:
+            writer.submit(statement).result()
+        else:
+            db.session.execute(statement)
+            db.session.commit()
+
+    def run(seed):
+        rng = random.Random(seed)
+        local_reads, local_writes, failed = [], [], 0
+        with app.app_context():
+            deadline = time.perf_counter() + duration
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    if rng.random() < write_ratio:
+                        write(insert(Notification).values(
+                            user_id=1, title='bench', message='x', notification_type='admin_activity'
+                        ))
+                        local_writes.append(time.perf_counter() - started)
+                    else:
+                        db.session.execute(courts_select(page=rng.randint(1, 10))).all()
+                        db.session.commit()
+                        local_reads.append(time.perf_counter() - started)
+                except OperationalError:
+                    db.session.rollback()
+                    failed += 1
+            db.session.remove()
+        with lock:
+            reads.extend(local_reads)
+            writes.extend(local_writes)
+            errors.append(failed)
+
+    start.wait()
+    pool = [threading.Thread(target=run, args=(os.getpid() * 100 + n,)) for n in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    results.put((reads, writes, sum(errors)))
+
+
+def bench_sqlite_concurrency(args):
+    """Mixed reads and writes from N worker processes on one SQLite file, per SQLite setup"""
+    import multiprocessing
+    import os
+    import shutil
+    import tempfile
+
+    context = multiprocessing.get_context('spawn')
+    workdir = tempfile.mkdtemp()
+    print(f'{args.workers} workers x {args.threads} threads, {args.write_ratio:.0%} writes, {args.duration}s per setup')
+    print(f"{'setup':<20}{'ops/s':>8}{'writes/s':>10}{'read p50':>10}{'p99':>9}{'write p50':>11}{'p99':>9}{'locked':>8}")
+    for name in args.setups:
+        env, use_queue = SQLITE_SETUPS[name]
+        env = dict(env, DATABASE_URL=f"sqlite:///{os.path.join(workdir, name.replace(' ', '_'))}.db")
+        prepare = context.Process(target=_sqlite_prepare, args=(env, args.courts))
+        prepare.start()
+        prepare.join()
+
+        start, results = context.Event(), context.Queue()
+        workers = [context.Process(target=_sqlite_worker,
+                                   args=(env, use_queue, args.threads, args.duration, args.write_ratio, start,
+                                         results))
+                   for _ in range(args.workers)]
+        for worker in workers:
+            worker.start()
+        time.sleep(args.warmup)  # let every worker import the app before the clock starts
+        start.set()
+        reads, writes, errors = [], [], 0
+        for _ in workers:
+            worker_reads, worker_writes, worker_errors = results.get()
+            reads.extend(worker_reads)
+            writes.extend(worker_writes)
+            errors += worker_errors
+        for worker in workers:
+            worker.join()
+
+        reads.sort()
+        writes.sort()
+        print(f'{name:<20}{(len(reads) + len(writes)) / args.duration:8.0f}{len(writes) / args.duration:10.0f}'
+              f'{_percentile(reads, 0.5) * 1e3:8.1f}ms{_percentile(reads, 0.99) * 1e3:7.1f}ms'
+              f'{_percentile(writes, 0.5) * 1e3:9.1f}ms{_percentile(writes, 0.99) * 1e3:7.1f}ms{errors:8d}')
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+# role -> [(weight, route, path(context, rng))]; routes are reported by their template
+LOAD_SEARCH_TERMS = ['نزاع', 'عقد', 'محمد', 'صنعاء', 'الحميري', 'تعويض']
+LOAD_TRAFFIC = {
+    'anonymous': [
+        (40, '/courts', lambda ctx, rng: f'/courts?page={rng.randint(1, 3)}'),
+        (40, '/lawyers', lambda ctx, rng: f'/lawyers?page={rng.randint(1, 5)}'),
+        (20, '/search', lambda ctx, rng: f'/search?query={rng.choice(LOAD_SEARCH_TERMS)}'),
+    ],
+    'client': [
+        (25, '/client/portal', lambda ctx, rng: '/client/portal'),
+        (20, '/cases', lambda ctx, rng: '/cases'),
+        (25, '/cases/<id>', lambda ctx, rng: f"/cases/{rng.choice(ctx['case_ids'])}"),
+        (10, '/calendar/events', lambda ctx, rng: '/calendar/events'),
+        (10, '/lawyers', lambda ctx, rng: '/lawyers'),
+        (10, '/search', lambda ctx, rng: f'/search?query={rng.choice(LOAD_SEARCH_TERMS)}'),
+    ],
+    'lawyer': [
+        (10, '/', lambda ctx, rng: '/'),
+        (20, '/cases', lambda ctx, rng: f'/cases?page={rng.randint(1, 3)}'),
+        (25, '/cases/<id>', lambda ctx, rng: f"/cases/{rng.choice(ctx['case_ids'])}"),
+        (10, '/cases/<id>/timeline', lambda ctx, rng: f"/cases/{rng.choice(ctx['case_ids'])}/timeline"),
+        (15, '/calendar/events', lambda ctx, rng: '/calendar/events?start=2024-01-01T00:00:00&end=2030-01-01T00:00:00'),
+        (10, '/search', lambda ctx, rng: f'/search?query={rng.choice(LOAD_SEARCH_TERMS)}'),
+        (5, '/reports', lambda ctx, rng: '/reports'),
+        (5, '/lookup/cases', lambda ctx, rng: f'/lookup/cases?q={rng.choice(LOAD_SEARCH_TERMS)}'),
+    ],
+    'admin': [
+        (25, '/admin', lambda ctx, rng: '/admin'),
+        (25, '/admin/cases', lambda ctx, rng: f'/admin/cases?page={rng.randint(1, 50)}'),
+        (20, '/admin/users', lambda ctx, rng: '/admin/users'),
+        (15, '/admin/reports', lambda ctx, rng: '/admin/reports'),
+        (15, '/admin/dashboard/stats', lambda ctx, rng: '/admin/dashboard/stats'),
+    ],
+}
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+class _InProcessTarget:
+    """Requests through the Flask test client, without a server"""
+
+    def __init__(self):
+        from main import app
+        app.config['WTF_CSRF_ENABLED'] = False
+        self.app = app
+
+    def session(self):
+        client = self.app.test_client()
+
+        def send(method, path, data=None):
+            try:
+                response = client.open(path, method=method, data=data)
+            except Exception:
+                # What a server would answer once the error handler itself failed
+                return 500, ''
+            return response.status_code, response.headers.get('Server-Timing', '')
+        return send
+
+
+class _HttpTarget:
+    """Requests to a running server, one cookie jar per virtual user"""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def session(self):
+        import http.cookiejar
+        import urllib.error
+        import urllib.parse
+        import urllib.request
+
+        opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+        def send(method, path, data=None):
+            body = None
+            if data is not None:
+                if method == 'POST' and path == '/login':
+                    # The login form is CSRF-protected
+                    page = opener.open(self.url + path).read().decode('utf-8', 'replace')
+                    match = re.search(r'name="csrf_token"[^>]*value="([^"]+)"', page)
+                    if match:
+                        data = dict(data, csrf_token=match.group(1))
+                body = urllib.parse.urlencode(data).encode()
+            request = urllib.request.Request(self.url + urllib.parse.quote(path, safe='/?=&:'), data=body,
+                                             method=method)
+            try:
+                with opener.open(request, timeout=60) as response:
+                    response.read()
+                    return response.status, response.headers.get('Server-Timing', '')
+            except urllib.error.HTTPError as e:
+                return e.code, e.headers.get('Server-Timing', '')
+        return send
+
+
+def _load_users(roles, per_role):
+    """{role: [(username, case ids)]} of synthetic users to log in as"""
+    from sqlalchemy import select
+    from app import app, db
+    from models import Case, User
+
+    users = {}
+    with app.app_context():
+        for role in roles:
+            if role == 'anonymous':
+                users[role] = [(None, [])]
+                continue
+            if role == 'admin':
+                rows = [('admin',)]
+            else:
+                rows = db.session.execute(select(User.username).where(
+                    User.role == role, User.is_active == True, User.username.like(f'syn_{role}_%')
+                ).limit(per_role)).all()
+            users[role] = []
+            for (username,) in rows:
+                owner = {'lawyer': Case.lawyer_id, 'client': Case.client_id}.get(role)
+                case_ids = []
+                if owner is not None:
+                    user_id = db.session.scalar(select(User.id).where(User.username == username))
+                    case_ids = db.session.scalars(select(Case.id).where(owner == user_id).limit(50)).all()
+                if case_ids or owner is None:
+                    users[role].append((username, case_ids))
+            if not users[role]:
+                raise SystemExit(f'No {role} users with cases; run "flask --app main generate-data" first')
+    return users
+
+
+def _git_revision():
+    import os
+    import subprocess
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def bench_load(args):
+    """Role-weighted traffic replay with per-route latency and query counts"""
+    import json
+    import os
+    import random
+    import threading
+    from datetime import datetime
+    from synthetic_data import SYNTHETIC_PASSWORD
+
+    mix = {}
+    for part in args.mix.split(','):
+        role, weight = part.split('=')
+        mix[role] = float(weight)
+    target = _HttpTarget(args.url) if args.url else _InProcessTarget()
+    users = _load_users(mix, args.users)
+    samples = {}  # route -> [(seconds, queries or None, status)]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.warmup + args.duration
+    measure_from = time.perf_counter() + args.warmup
+
+    def virtual_user(n):
+        rng = random.Random(args.seed * 1000 + n)
+        role = rng.choices(list(mix), weights=list(mix.values()))[0]
+        username, case_ids = rng.choice(users[role])
+        send = target.session()
+        if username:
+            password = args.admin_password if role == 'admin' else SYNTHETIC_PASSWORD
+            send('POST', '/login', {'username': username, 'password': password})
+        routes = LOAD_TRAFFIC[role]
+        weights = [weight for weight, _, _ in routes]
+        context = {'case_ids': case_ids}
+        local = []
+        while time.perf_counter() < deadline:
+            _, route, path = rng.choices(routes, weights=weights)[0]
+            started = time.perf_counter()
+            status, timing = send('GET', path(context, rng))
+            if started >= measure_from:
+                match = SERVER_TIMING_QUERIES.search(timing)
+                local.append((route, time.perf_counter() - started, int(match.group(1)) if match else None, status))
+        with lock:
+            for route, seconds, queries, status in local:
+                samples.setdefault(route, []).append((seconds, queries, status))
+
+    threads = [threading.Thread(target=virtual_user, args=(n,)) for n in range(args.users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    results = {}
+    for route, route_samples in samples.items():
+        latencies = sorted(seconds for seconds, _, _ in route_samples)
+        queries = [count for _, count, _ in route_samples if count is not None]
+        results[route] = {
+            'requests': len(route_samples),
+            'errors': sum(1 for _, _, status in route_samples if status >= 400),
+            'p50_ms': _percentile(latencies, 0.5) * 1e3,
+            'p95_ms': _percentile(latencies, 0.95) * 1e3,
+            'p99_ms': _percentile(latencies, 0.99) * 1e3,
+            'queries_per_request': sum(queries) / len(queries) if queries else None,
+        }
+    report = {
+        'revision': _git_revision(),
+        'finished_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'target': args.url or 'in-process',
+        'users': args.users,
+        'duration': args.duration,
+        'mix': mix,
+        'routes': results,
+    }
+
+    previous = None
+    os.makedirs(args.results_dir, exist_ok=True)
+    if args.compare:
+        path = args.compare
+        if path == 'latest':
+            stored = sorted(name for name in os.listdir(args.results_dir) if name.endswith('.json'))
+            path = os.path.join(args.results_dir, stored[-1]) if stored else None
+        if path:
+            with open(path) as f:
+                previous = json.load(f)
+            print(f"compared with {previous['revision']} ({previous['finished_at']})")
+
+    print(f"{args.users} users, {args.duration}s, {sum(r['requests'] for r in results.values()) / args.duration:.0f} req/s"
+          f" against {report['target']} at {report['revision']}")
+    print(f"{'route':<24}{'requests':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'queries':>9}{'errors':>8}"
+          + (f"{'p95 diff':>10}" if previous else ''))
+    for route, row in sorted(results.items()):
+        queries = f"{row['queries_per_request']:9.1f}" if row['queries_per_request'] is not None else f"{'-':>9}"
+        line = (f"{route:<24}{row['requests']:9d}{row['p50_ms']:7.1f}ms{row['p95_ms']:7.1f}ms{row['p99_ms']:7.1f}ms"
+                f"{queries}{row['errors']:8d}")
+        before = previous['routes'].get(route) if previous else None
+        if before:
+            line += f"{(row['p95_ms'] / before['p95_ms'] - 1) * 100 if before['p95_ms'] else 0:+9.0f}%"
+        print(line)
+
+    name = f"{report['finished_at'].replace(':', '')}-{report['revision']}.json"
+    with open(os.path.join(args.results_dir, name), 'w') as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    print(f'saved {os.path.join(args.results_dir, name)}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    sub = parser.add_subparsers(dest='benchmark', required=True)
+
+    templates = sub.add_parser('templates', help='compiled template engine vs fill_template')
+    templates.add_argument('--fields', type=int, default=40)
+    templates.add_argument('--paragraphs', type=int, default=400)
+    templates.add_argument('--number', type=int, default=200)
+    templates.set_defaults(func=bench_templates)
+
+    case_numbers = sub.add_parser('case-numbers', help='case number allocator collision stress test')
+    case_numbers.add_argument('--workers', type=int, default=4)
+    case_numbers.add_argument('--threads', type=int, default=8)
+    case_numbers.add_argument('--count', type=int, default=2000, help='numbers per worker')
+    case_numbers.set_defaults(func=bench_case_numbers)
+
+    courts_knn = sub.add_parser('courts-knn', help='nearest-court search latency')
+    courts_knn.add_argument('--courts', type=int, default=500)
+    courts_knn.add_argument('--queries', type=int, default=2000)
+    courts_knn.add_argument('--k', type=int, default=5)
+    courts_knn.add_argument('--radius', type=float, default=None, help='km')
+    courts_knn.set_defaults(func=bench_courts_knn)
+
+    recommend = sub.add_parser('recommend', help='lawyer recommendation scoring latency')
+    recommend.add_argument('--lawyers', type=int, default=5000)
+    recommend.add_argument('--queries', type=int, default=200)
+    recommend.add_argument('--limit', type=int, default=10)
+    recommend.set_defaults(func=bench_recommend)
+
+    first_request = sub.add_parser('first-request', help='first-request latency per route after worker start')
+    first_request.add_argument('routes', nargs='*', default=FIRST_REQUEST_ROUTES)
+    first_request.set_defaults(func=bench_first_request)
+
+    serving = sub.add_parser('serving', help='load test of gunicorn sync vs uvicorn ASGI serving')
+    serving.add_argument('--workers', type=int, default=4)
+    serving.add_argument('--concurrency', type=int, default=32)
+    serving.add_argument('--duration', type=float, default=10.0, help='seconds per server')
+    serving.add_argument('--port', type=int, default=8765)
+    serving.add_argument('--seed', type=int, default=500, help='courts and lawyers to create if missing')
+    serving.add_argument('--paths', nargs='+', default=SERVING_ENDPOINTS)
+    serving.add_argument('--servers', nargs='+', default=['gunicorn (sync)', 'uvicorn (ASGI)'])
+    serving.set_defaults(func=bench_serving)
+
+    metrics = sub.add_parser('metrics', help='metrics instrumentation overhead')
+    metrics.add_argument('--number', type=int, default=500000)
+    metrics.add_argument('--endpoints', type=int, default=80)
+    metrics.add_argument('--workers', type=int, default=8)
+    metrics.set_defaults(func=bench_metrics)
+
+    sqlite_concurrency = sub.add_parser('sqlite-concurrency', help='mixed read/write load on SQLite per setup')
+    sqlite_concurrency.add_argument('--workers', type=int, default=4, help='processes')
+    sqlite_concurrency.add_argument('--threads', type=int, default=4, help='threads per process')
+    sqlite_concurrency.add_argument('--write-ratio', type=float, default=0.2)
+    sqlite_concurrency.add_argument('--duration', type=float, default=10.0, help='seconds per setup')
+    sqlite_concurrency.add_argument('--warmup', type=float, default=3.0, help='seconds for workers to start')
+    sqlite_concurrency.add_argument('--courts', type=int, default=200)
+    sqlite_concurrency.add_argument('--setups', nargs='+', default=list(SQLITE_SETUPS))
+    sqlite_concurrency.set_defaults(func=bench_sqlite_concurrency)
+
+    load = sub.add_parser('load', help='role-weighted traffic replay against generate-data output')
+    load.add_argument('--url', default=None, help='running server; default is in-process')
+    load.add_argument('--users', type=int, default=16, help='concurrent virtual users')
+    load.add_argument('--duration', type=float, default=30.0, help='seconds measured')
+    load.add_argument('--warmup', type=float, default=5.0, help='seconds before measuring')
+    load.add_argument('--mix', default='client=50,lawyer=30,anonymous=15,admin=5', help='role weights')
+    load.add_argument('--seed', type=int, default=1)
+    load.add_argument('--admin-password', default='admin123')
+    load.add_argument('--results-dir', default='load-results')
+    load.add_argument('--compare', default=None, help="earlier result file, or 'latest'")
+    load.set_defaults(func=bench_load)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
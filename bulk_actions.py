@@ -0,0 +1,139 @@
+"""Set-based bulk actions of the admin listings.
+
+An action applies to the rows an admin selected, or to every row matching
+the listing's filters. Rows are taken BULK_ACTION_BATCH_SIZE ids at a time,
+and only rows the action would still change, so a repeated or interrupted
+action picks up where it stopped. Each batch is a few UPDATE (and
+INSERT ... SELECT) statements committed together, with one audit entry:
+
+- cases: close (status, closed_date and a status_change update per case),
+  reassign to another lawyer (with the old lawyer's appointments in those
+  cases and a reassignment update per case);
+- lawyers: verify or unverify, advancing the lawyer directory's version;
+- appointments: cancel, e.g. a court's day with the court and date filters.
+
+No rows are loaded into the session. Fragment caches are invalidated by
+table from the bulk statements, and by '<table>:<id>' tag for every row a
+batch changed.
+"""
+from datetime import date, datetime
+
+from flask import current_app
+from sqlalchemy import func, insert, literal, select, update
+
+from admin_listings import listing_filters
+from app import db
+from fragment_cache import add_row_tags
+from http_cache import touch_directories
+from models import Appointment, Case, CaseUpdate, LawyerProfile, User
+from utils import log_admin_activity
+
+NO_SYNC = {'synchronize_session': False}
+
+
+def _add_case_updates(case_ids, update_type, title, description, admin_id):
+    db.session.execute(insert(CaseUpdate).from_select(
+        ['case_id', 'update_type', 'title', 'description', 'created_by', 'created_at'],
+        select(Case.id, literal(update_type), literal(title), literal(description), literal(admin_id),
+               literal(datetime.utcnow())).where(Case.id.in_(case_ids))
+    ), execution_options=NO_SYNC)
+
+
+def _close_cases(case_ids, params):
+    _add_case_updates(case_ids, 'status_change', 'إغلاق القضية', 'تم إغلاق القضية بإجراء إداري جماعي',
+                      params['admin_id'])
+    db.session.execute(update(Case).where(Case.id.in_(case_ids)).values(
+        status='closed', closed_date=func.coalesce(Case.closed_date, date.today())
+    ), execution_options=NO_SYNC)
+    add_row_tags(db.session, 'cases', case_ids)
+
+
+def _reassign_cases(case_ids, params):
+    lawyer_id = params['lawyer_id']
+    # The old lawyer's appointments in these cases follow the case
+    appointment_ids = db.session.scalars(select(Appointment.id).where(
+        Appointment.case_id.in_(case_ids),
+        Appointment.user_id == select(Case.lawyer_id).where(Case.id == Appointment.case_id).scalar_subquery()
+    )).all()
+    if appointment_ids:
+        db.session.execute(update(Appointment).where(Appointment.id.in_(appointment_ids)).values(user_id=lawyer_id),
+                           execution_options=NO_SYNC)
+        add_row_tags(db.session, 'appointments', appointment_ids)
+    _add_case_updates(case_ids, 'reassignment', 'تغيير المحامي', 'تم نقل القضية إلى محامٍ آخر بإجراء إداري جماعي',
+                      params['admin_id'])
+    db.session.execute(update(Case).where(Case.id.in_(case_ids)).values(lawyer_id=lawyer_id),
+                       execution_options=NO_SYNC)
+    add_row_tags(db.session, 'cases', case_ids)
+
+
+def _set_verified(value):
+    def apply(user_ids, params):
+        profile_ids = db.session.scalars(select(LawyerProfile.id).where(LawyerProfile.user_id.in_(user_ids))).all()
+        db.session.execute(update(LawyerProfile).where(LawyerProfile.id.in_(profile_ids)).values(
+            is_verified=value
+        ), execution_options=NO_SYNC)
+        add_row_tags(db.session, 'lawyer_profiles', profile_ids)
+        touch_directories(db.session, {'lawyers'})
+    return apply
+
+
+def _cancel_appointments(appointment_ids, params):
+    db.session.execute(update(Appointment).where(Appointment.id.in_(appointment_ids)).values(status='cancelled'),
+                       execution_options=NO_SYNC)
+    add_row_tags(db.session, 'appointments', appointment_ids)
+
+
+# listing -> action -> (audit action, rows still to change given params, apply(ids, params))
+BULK_ACTIONS = {
+    'cases': {
+        'close': ('إغلاق قضايا', lambda params: [Case.status != 'closed'], _close_cases),
+        'reassign': ('نقل قضايا', lambda params: [Case.lawyer_id != params['lawyer_id']], _reassign_cases),
+    },
+    'lawyers': {
+        'verify': ('توثيق محامين', lambda params: [func.coalesce(LawyerProfile.is_verified, False) == False],
+                   _set_verified(True)),
+        'unverify': ('إلغاء توثيق محامين', lambda params: [LawyerProfile.is_verified == True],
+                     _set_verified(False)),
+    },
+    'appointments': {
+        'cancel': ('إلغاء مواعيد', lambda params: [func.coalesce(Appointment.status, '') != 'cancelled'],
+                   _cancel_appointments),
+    },
+}
+
+
+def _next_batch(listing, criteria, batch_size):
+    if listing == 'lawyers':
+        key = User.id
+        statement = select(key).join(LawyerProfile, LawyerProfile.user_id == User.id)
+    else:
+        key = (Case if listing == 'cases' else Appointment).id
+        statement = select(key)
+    return db.session.scalars(statement.where(*criteria).order_by(key).limit(batch_size)).all()
+
+
+def run_bulk_action(listing, action, params, ids=None, filters=None):
+    """Apply an action to the selected ids, or to all rows matching filters; returns rows changed"""
+    audit_action, pending, apply = BULK_ACTIONS[listing][action]
+    criteria = pending(params)
+    if ids is not None:
+        key = User.id if listing == 'lawyers' else (Case if listing == 'cases' else Appointment).id
+        criteria.append(key.in_(ids))
+    else:
+        criteria += listing_filters(listing, filters)
+
+    batch_size = current_app.config['BULK_ACTION_BATCH_SIZE']
+    changed = 0
+    while True:
+        batch = _next_batch(listing, criteria, batch_size)
+        if not batch:
+            break
+        apply(batch, params)
+        # Commits the batch together with its audit entry
+        log_admin_activity(audit_action, f'{len(batch)} سجل: {", ".join(str(row_id) for row_id in batch[:50])}'
+                                         + (' ...' if len(batch) > 50 else ''))
+        db.session.commit()
+        changed += len(batch)
+        if len(batch) < batch_size:
+            break
+    return changed
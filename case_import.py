@@ -0,0 +1,301 @@
+"""Bulk import of cases from CSV or XLSX files.
+
+Lawyer, client and court references are resolved through lookup maps loaded
+once per import. Each batch validates its case numbers set-wise, inserts its
+Case rows and their initial CaseUpdate rows with bulk inserts, and commits
+in one transaction. The number of input rows consumed by committed batches
+is committed with each batch in import_checkpoints (and copied to the job),
+so a failed import resumes after the last good batch.
+"""
+import csv
+import os
+import shutil
+from datetime import date, datetime
+from itertools import islice
+
+from flask import current_app
+from sqlalchemy import insert
+
+from admin_listings import FORMULA_PREFIXES
+from app import db
+from case_numbers import taken_case_numbers
+from jobs import create_job, job_dir, save_job
+from models import Case, CaseUpdate, Court, ImportCheckpoint, LawyerProfile, User
+from utils import generate_case_number, get_case_types
+
+MAX_REPORTED_ERRORS = 1000
+
+HEADER_ALIASES = {
+    'رقم القضية': 'case_number',
+    'عنوان القضية': 'title',
+    'العنوان': 'title',
+    'الوصف': 'description',
+    'وصف القضية': 'description',
+    'نوع القضية': 'case_type',
+    'الحالة': 'status',
+    'الأولوية': 'priority',
+    'المحامي': 'lawyer',
+    'العميل': 'client',
+    'المحكمة': 'court',
+    'تاريخ رفع القضية': 'filed_date',
+    'تاريخ الجلسة القادمة': 'next_hearing_date',
+}
+
+STATUSES = {'active', 'pending', 'closed', 'on_hold', 'appeal'}
+PRIORITIES = {'high', 'medium', 'low'}
+
+
+def _normalize_header(name):
+    name = (name or '').strip()
+    return HEADER_ALIASES.get(name, name.lower())
+
+
+def _cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, (datetime, date)):
+        return value
+    value = str(value)
+    if value.startswith("'") and value[1:].startswith(FORMULA_PREFIXES):
+        value = value[1:]  # the formula guard of exported listings
+    return value.strip()
+
+
+def read_rows(path):
+    """Yield (row number in the file, dict) per data row of a CSV or XLSX file, skipping blank rows"""
+    if path.lower().endswith('.xlsx'):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise RuntimeError('استيراد ملفات XLSX يتطلب تثبيت الحزمة openpyxl')
+
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = [_normalize_header(str(h) if h is not None else '') for h in next(rows, [])]
+            for row_number, values in enumerate(rows, 2):
+                if not any(v not in (None, '') for v in values):
+                    continue
+                yield row_number, {h: _cell(v) for h, v in zip(header, values) if h}
+        finally:
+            workbook.close()
+    else:
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            reader = csv.reader(f)
+            header = [_normalize_header(h) for h in next(reader, [])]
+            for row_number, values in enumerate(reader, 2):
+                if not any(v.strip() for v in values):
+                    continue
+                yield row_number, {h: _cell(v) for h, v in zip(header, values) if h}
+
+
+def count_rows(path):
+    return sum(1 for _ in read_rows(path))
+
+
+def _parse_date(value):
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    for fmt in ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%Y/%m/%d'):
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f'تاريخ غير صالح: {value}')
+
+
+class LookupMaps:
+    """Reference resolution loaded once per import, keyed case-insensitively"""
+
+    def __init__(self):
+        self.lawyers = {}
+        self.clients = {}
+        self.courts = {}
+
+        users = db.session.query(User.id, User.username, User.email, User.role).filter(
+            User.role.in_(['lawyer', 'client']), User.is_active == True
+        )
+        for user_id, username, email, role in users:
+            target = self.lawyers if role == 'lawyer' else self.clients
+            target[username.lower()] = user_id
+            target[email.lower()] = user_id
+            target[str(user_id)] = user_id
+
+        for user_id, license_number in db.session.query(LawyerProfile.user_id, LawyerProfile.license_number):
+            # Only licenses of the active lawyers loaded above
+            if str(user_id) in self.lawyers:
+                self.lawyers.setdefault(license_number.lower(), user_id)
+
+        for court_id, name in db.session.query(Court.id, Court.name).filter(Court.is_active == True):
+            self.courts[name.strip().lower()] = court_id
+            self.courts[str(court_id)] = court_id
+
+    @staticmethod
+    def _resolve(mapping, value):
+        return mapping.get(str(value).strip().lower()) if value else None
+
+    def lawyer(self, value):
+        return self._resolve(self.lawyers, value)
+
+    def client(self, value):
+        return self._resolve(self.clients, value)
+
+    def court(self, value):
+        return self._resolve(self.courts, value)
+
+
+def _validate_row(row, lookups, case_types):
+    """Return the Case insert values for a row, or raise ValueError"""
+    title = row.get('title')
+    if not title:
+        raise ValueError('عنوان القضية مطلوب')
+
+    case_type = row.get('case_type')
+    if case_type not in case_types:
+        raise ValueError(f'نوع قضية غير معروف: {case_type}')
+
+    lawyer_id = lookups.lawyer(row.get('lawyer'))
+    if not lawyer_id:
+        raise ValueError(f"محامي غير معروف: {row.get('lawyer')}")
+
+    client_id = lookups.client(row.get('client'))
+    if not client_id:
+        raise ValueError(f"عميل غير معروف: {row.get('client')}")
+
+    court_id = None
+    if row.get('court'):
+        court_id = lookups.court(row.get('court'))
+        if not court_id:
+            raise ValueError(f"محكمة غير معروفة: {row.get('court')}")
+
+    filed_date = _parse_date(row.get('filed_date'))
+    if not filed_date:
+        raise ValueError('تاريخ رفع القضية مطلوب')
+
+    status = row.get('status') or 'active'
+    if status not in STATUSES:
+        raise ValueError(f'حالة غير معروفة: {status}')
+    priority = row.get('priority') or 'medium'
+    if priority not in PRIORITIES:
+        raise ValueError(f'أولوية غير معروفة: {priority}')
+
+    return {
+        'case_number': row.get('case_number') or generate_case_number(court_id),
+        'title': title,
+        'description': row.get('description') or None,
+        'case_type': case_type,
+        'status': status,
+        'priority': priority,
+        'lawyer_id': lawyer_id,
+        'client_id': client_id,
+        'court_id': court_id,
+        'filed_date': filed_date,
+        'next_hearing_date': _parse_date(row.get('next_hearing_date')),
+    }
+
+
+def _import_batch(job, batch, lookups, case_types, seen, checkpoint):
+    """Validate and insert one batch of rows and advance the checkpoint, in a single transaction"""
+    # Reported only once the batch is committed, so a failed batch that is
+    # retried on resume does not report its rows twice
+    errors = []
+    candidates = []
+    for row_number, row in batch:
+        try:
+            values = _validate_row(row, lookups, case_types)
+        except ValueError as e:
+            errors.append({'row': row_number, 'error': str(e)})
+            continue
+        if values['case_number'] in seen:
+            errors.append({'row': row_number, 'error': f"رقم قضية مكرر في الملف: {values['case_number']}"})
+            continue
+        seen.add(values['case_number'])
+        candidates.append((row_number, values))
+
+    # One IN query per batch instead of one lookup per row
+    numbers = [values['case_number'] for _, values in candidates]
+    existing = taken_case_numbers(db.session, numbers)
+
+    case_rows = []
+    for row_number, values in candidates:
+        if values['case_number'] in existing:
+            errors.append({'row': row_number, 'error': f"رقم القضية موجود مسبقاً: {values['case_number']}"})
+        else:
+            case_rows.append(values)
+
+    if case_rows:
+        inserted = db.session.execute(insert(Case).returning(Case.id), case_rows).scalars().all()
+        db.session.execute(insert(CaseUpdate), [{
+            'case_id': case_id,
+            'update_type': 'creation',
+            'title': 'إنشاء القضية',
+            'description': 'تم استيراد القضية',
+            'created_by': job['user_id'],
+        } for case_id in inserted])
+    checkpoint.committed_rows += len(batch)
+    checkpoint.imported += len(case_rows)
+    db.session.commit()
+
+    job['errors'].extend(errors)
+    del job['errors'][MAX_REPORTED_ERRORS:]
+
+
+def run_import(job):
+    """Import the job's input file, resuming after the last committed batch"""
+    path = os.path.join(job_dir(job['job_id']), job['file_name'])
+    batch_size = job.get('batch_size') or current_app.config['CASE_IMPORT_BATCH_SIZE']
+    lookups = LookupMaps()
+    case_types = set(get_case_types())
+
+    job.setdefault('errors', [])
+    # Case numbers committed by an earlier run of this job are caught by the
+    # set-wise existence check, so only in-file duplicates are tracked here
+    seen = set()
+
+    # The checkpoint commits with each batch; the job file may lag behind it
+    # if the process died between the two
+    checkpoint = db.session.get(ImportCheckpoint, job['job_id'])
+    if checkpoint is None:
+        checkpoint = ImportCheckpoint(job_id=job['job_id'], committed_rows=job.get('committed_rows', 0),
+                                      imported=job.get('imported', 0))
+        db.session.add(checkpoint)
+
+    rows = read_rows(path)
+    for _ in islice(rows, checkpoint.committed_rows):
+        pass
+
+    while True:
+        job['committed_rows'] = job['done'] = checkpoint.committed_rows
+        job['imported'] = checkpoint.imported
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        _import_batch(job, batch, lookups, case_types, seen, checkpoint)
+        job['committed_rows'] = job['done'] = checkpoint.committed_rows
+        job['imported'] = checkpoint.imported
+        save_job(job)
+
+    db.session.delete(checkpoint)
+    db.session.commit()
+
+
+def create_import_job(source_path, user_id, batch_size=None, file_storage=None):
+    """Create a case_import job from a path or an uploaded file; returns the job"""
+    source_name = file_storage.filename if file_storage else source_path
+    extension = 'xlsx' if source_name.lower().endswith('.xlsx') else 'csv'
+    job = create_job('case_import', user_id, batch_size=batch_size,
+                     file_name=f'input.{extension}', committed_rows=0, imported=0, errors=[])
+
+    path = os.path.join(job_dir(job['job_id']), job['file_name'])
+    if file_storage:
+        file_storage.save(path)
+    else:
+        shutil.copyfile(source_path, path)
+
+    job['total'] = count_rows(path)
+    save_job(job)
+    return job
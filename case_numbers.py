@@ -0,0 +1,118 @@
+"""Sequence-backed case number allocation.
+
+Counters live in the case_number_sequences table, one row per scope (a day,
+a year, or a court and day/year depending on CASE_NUMBER_SCOPE). Each worker
+reserves a block of CASE_NUMBER_BLOCK_SIZE numbers with one short UPDATE and
+hands them out from memory, so concurrent case creation only touches the hot
+row once per block. Numbers left in a block when a worker exits are skipped,
+which leaves gaps but never duplicates. A generated number already taken by a
+live or archived case (entered by hand or imported in the same format) is
+skipped for the next value.
+"""
+import threading
+from datetime import date
+
+from flask import current_app
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from models import ArchivedCase, Case, CaseNumberSequence
+
+MAX_CACHED_SCOPES = 1000
+
+
+def case_number_scope(scope, on_date, court_id=None):
+    """Counter key for a scope setting: day, year, court_day or court_year"""
+    if scope == 'year':
+        return f"year:{on_date.year}"
+    if scope == 'court_day':
+        return f"court:{court_id or 0}:{on_date:%Y%m%d}"
+    if scope == 'court_year':
+        return f"court:{court_id or 0}:{on_date.year}"
+    return f"day:{on_date:%Y%m%d}"
+
+
+def taken_case_numbers(connection, numbers):
+    """The numbers already used by a live or an archived case"""
+    numbers = list(numbers)
+    if not numbers:
+        return set()
+    return set(connection.execute(
+        select(Case.case_number).where(Case.case_number.in_(numbers))
+        .union_all(select(ArchivedCase.case_number).where(ArchivedCase.case_number.in_(numbers)))
+    ).scalars())
+
+
+class CaseNumberAllocator:
+    """Hands out numbers from per-scope blocks reserved in the database"""
+
+    def __init__(self, engine, scope='day', number_format='CASE-{date:%Y%m%d}-{seq:06d}', block_size=20):
+        self.engine = engine
+        self.scope = scope
+        self.number_format = number_format
+        self.block_size = block_size
+        self._blocks = {}  # scope key -> [next, end)
+        self._lock = threading.Lock()
+
+    def _reserve_block(self, key):
+        """Advance the scope counter by one block; returns [start, end)"""
+        table = CaseNumberSequence.__table__
+        while True:
+            with self.engine.begin() as conn:
+                updated = conn.execute(
+                    update(table).where(table.c.scope == key)
+                    .values(next_value=table.c.next_value + self.block_size)
+                ).rowcount
+                if updated:
+                    end = conn.execute(select(table.c.next_value).where(table.c.scope == key)).scalar_one()
+                    return [end - self.block_size, end]
+
+            # First block of a new scope; another worker may create it concurrently
+            try:
+                with self.engine.begin() as conn:
+                    conn.execute(insert(table).values(scope=key, next_value=1))
+            except IntegrityError:
+                pass
+
+    def next_value(self, key):
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is None or block[0] >= block[1]:
+                if len(self._blocks) >= MAX_CACHED_SCOPES:
+                    self._blocks.clear()
+                block = self._blocks[key] = self._reserve_block(key)
+            value = block[0]
+            block[0] += 1
+            return value
+
+    def _taken(self, number):
+        with self.engine.connect() as conn:
+            return bool(taken_case_numbers(conn, [number]))
+
+    def allocate(self, court_id=None, on_date=None):
+        on_date = on_date or date.today()
+        key = case_number_scope(self.scope, on_date, court_id)
+        while True:
+            seq = self.next_value(key)
+            number = self.number_format.format(date=on_date, year=on_date.year, seq=seq, court=court_id or 0)
+            if not self._taken(number):
+                return number
+
+
+def get_case_number_allocator(app=None):
+    app = app or current_app._get_current_object()
+    allocator = app.extensions.get('case_number_allocator')
+    if allocator is None:
+        allocator = CaseNumberAllocator(
+            db.engine,
+            scope=app.config['CASE_NUMBER_SCOPE'],
+            number_format=app.config['CASE_NUMBER_FORMAT'],
+            block_size=app.config['CASE_NUMBER_BLOCK_SIZE'],
+        )
+        app.extensions['case_number_allocator'] = allocator
+    return allocator
+
+
+def allocate_case_number(court_id=None, on_date=None):
+    return get_case_number_allocator().allocate(court_id, on_date)
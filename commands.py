@@ -0,0 +1,185 @@
+"""Flask CLI commands for maintenance and bulk operations.
+
+Run with ``flask --app main <command>``.
+"""
+import click
+
+from app import app
+
+
+@app.cli.command('upgrade-db')
+@click.pass_context
+def upgrade_db_command(ctx):
+    """Add the columns and indexes that db.create_all() does not add to existing tables"""
+    from sqlalchemy import inspect, literal
+    from sqlalchemy.schema import CreateColumn
+
+    from app import db
+
+    engine = db.engine
+    inspector = inspect(engine)
+    existing = set(inspector.get_table_names())
+    added = set()
+    with engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing:
+                continue  # created in full by db.create_all()
+            columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in columns:
+                    continue
+                ddl = str(CreateColumn(column).compile(dialect=engine.dialect))
+                if column.default is not None and column.default.is_scalar:
+                    # Fills the existing rows, which NOT NULL columns need
+                    ddl += ' DEFAULT ' + str(literal(column.default.arg).compile(
+                        dialect=engine.dialect, compile_kwargs={'literal_binds': True}))
+                connection.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {ddl}')
+                added.add((table.name, column.name))
+                click.echo(f'  added {table.name}.{column.name}')
+            indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(connection, checkfirst=True)  # skipped when ddl_if excludes this dialect
+            created = {index['name'] for index in inspect(connection).get_indexes(table.name)} - indexes
+            for name in sorted(created):
+                click.echo(f'  created index {name}')
+
+        if engine.dialect.name == 'sqlite':
+            cases_sql = connection.exec_driver_sql(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'cases'").scalar() or ''
+            if 'AUTOINCREMENT' not in cases_sql.upper():
+                click.echo('  cases is not AUTOINCREMENT; rebuild it as described on models.Case '
+                           'before archiving cases', err=True)
+
+    # Columns derived from other data are filled in once added
+    if {('courts', 'grid_lat'), ('courts', 'grid_lon')} & added:
+        ctx.invoke(reindex_courts_command)
+    if {('lawyer_profiles', 'rating_sum'), ('lawyer_profiles', 'ranking_score')} & added:
+        ctx.invoke(rerank_lawyers_command)
+    click.echo(f'{len(added)} columns added')
+
+
+@app.cli.command('import-cases')
+@click.argument('path', required=False)
+@click.option('--user', 'username', default='admin', help='User recorded as creator of the initial updates')
+@click.option('--batch-size', type=int, default=None, help='Rows per transaction')
+@click.option('--resume', 'resume_job', default=None, help='Resume a failed import job by id')
+def import_cases_command(path, username, batch_size, resume_job):
+    """Import cases from a CSV or XLSX file"""
+    from case_import import create_import_job, run_import
+    from jobs import read_job, run_job
+    from models import User
+
+    if resume_job:
+        job = read_job(resume_job)
+        if not job or job['kind'] != 'case_import':
+            raise click.ClickException(f'Unknown import job: {resume_job}')
+    else:
+        if not path:
+            raise click.UsageError('PATH is required unless --resume is given')
+        user = User.query.filter_by(username=username).first()
+        if not user:
+            raise click.ClickException(f'Unknown user: {username}')
+        job = create_import_job(path, user.id, batch_size=batch_size)
+        click.echo(f"Job {job['job_id']}: {job['total']} rows")
+
+    run_job(app, job['job_id'], run_import)
+
+    job = read_job(job['job_id'])
+    click.echo(f"{job['status']}: {job.get('imported', 0)} imported, "
+               f"{job['committed_rows']}/{job['total']} rows processed, {len(job['errors'])} errors")
+    for error in job['errors'][:20]:
+        click.echo(f"  row {error['row']}: {error['error']}")
+    if job['status'] == 'failed':
+        raise click.ClickException(f"{job['error']} (resume with --resume {job['job_id']})")
+
+
+@app.cli.command('archive-cases')
+@click.option('--older-than-days', type=int, default=None, help='Days since closing; defaults to CASE_ARCHIVE_AFTER_DAYS')
+@click.option('--user', 'username', default='admin', help='User recorded as owner of the job')
+@click.option('--batch-size', type=int, default=None, help='Cases per transaction')
+def archive_cases_command(older_than_days, username, batch_size):
+    """Move long-closed cases and their documents, appointments and updates to the archive tables"""
+    from archive import create_archive_job, run_archive
+    from jobs import read_job, run_job
+    from models import User
+
+    user = User.query.filter_by(username=username).first()
+    if not user:
+        raise click.ClickException(f'Unknown user: {username}')
+    job = create_archive_job(user.id, older_than_days=older_than_days, batch_size=batch_size)
+    click.echo(f"Job {job['job_id']}: {job['total']} cases closed before {job['cutoff']}")
+
+    run_job(app, job['job_id'], run_archive)
+
+    job = read_job(job['job_id'])
+    click.echo(f"{job['status']}: {job['archived']} cases archived")
+    if job['status'] == 'failed':
+        raise click.ClickException(f"{job['error']} (run again to archive the rest)")
+
+
+@app.cli.command('reindex-courts')
+def reindex_courts_command():
+    """Recompute the grid cells of every court with coordinates"""
+    from app import db
+    from geo import grid_cell
+    from models import Court
+
+    courts = Court.query.filter(Court.latitude.isnot(None), Court.longitude.isnot(None)).all()
+    for court in courts:
+        court.grid_lat, court.grid_lon = grid_cell(court.latitude, court.longitude)
+    db.session.commit()
+    click.echo(f'{len(courts)} courts reindexed')
+
+
+@app.cli.command('rerank-lawyers')
+def rerank_lawyers_command():
+    """Rebuild lawyer ratings and ranking scores from all reviews"""
+    from reviews import recompute_lawyer_ratings
+
+    click.echo(f'{recompute_lawyer_ratings()} lawyer profiles updated')
+
+
+@app.cli.command('precompile-templates')
+def precompile_templates_command():
+    """Compile every template into the Jinja bytecode cache"""
+    from jinja_cache import precompile_templates
+
+    if not app.config['JINJA_BYTECODE_CACHE_FOLDER']:
+        raise click.ClickException('JINJA_BYTECODE_CACHE_FOLDER is not set')
+    loaded, errors = precompile_templates(app)
+    for name, error in errors:
+        click.echo(f'  {name}: {error}')
+    click.echo(f"{loaded} templates compiled into {app.config['JINJA_BYTECODE_CACHE_FOLDER']}")
+    if errors:
+        raise click.ClickException(f'{len(errors)} templates failed to compile')
+
+
+@app.cli.command('generate-data')
+@click.option('--scale', type=click.Choice(['small', 'medium', 'national']), default='small',
+              help='Preset sizes; the options below override it')
+@click.option('--seed', type=int, default=1)
+@click.option('--batch-size', type=int, default=5000, help='Rows per transaction')
+@click.option('--courts-per-governorate', type=int, default=None)
+@click.option('--lawyers', type=int, default=None)
+@click.option('--clients', type=int, default=None)
+@click.option('--judges', type=int, default=None)
+@click.option('--students', type=int, default=None)
+@click.option('--cases', type=int, default=None)
+@click.option('--appointments-per-case', type=int, default=2, help='Average')
+@click.option('--updates-per-case', type=int, default=3, help='Average')
+@click.option('--notifications-per-user', type=int, default=3, help='Average, for lawyers and clients')
+def generate_data_command(scale, seed, batch_size, **sizes):
+    """Bulk-insert a synthetic dataset for load testing"""
+    from synthetic_data import SCALES, SYNTHETIC_PASSWORD, generate_dataset
+
+    options = dict(SCALES[scale])
+    options.update({name: value for name, value in sizes.items() if value is not None})
+    total_cases = options['cases']
+
+    def progress(done):
+        click.echo(f'  {done}/{total_cases} cases', err=True)
+
+    counts = generate_dataset(seed=seed, batch_size=batch_size, progress=progress, **options)
+    click.echo(', '.join(f'{count} {table}' for table, count in counts.items())
+               + f' added; synthetic users log in with password {SYNTHETIC_PASSWORD!r}')
@@ -0,0 +1,158 @@
+"""Read-only JSON feeds shared by the WSGI routes and the ASGI app.
+
+Each feed is a Core select plus a row serializer, so routes.py runs it on
+the Flask-SQLAlchemy session and asgi.py on an async session, and both
+serving modes return the same payloads.
+"""
+from datetime import date, datetime
+
+from sqlalchemy import func, or_, select, union_all
+
+from lawyer_directory import directory_select
+from models import Appointment, ArchivedAppointment, ArchivedCase, Case, Court, LawyerProfile, User
+
+SEARCH_LIMIT = 10
+FEED_PAGE_SIZE = 20
+
+COURT_COLUMNS = (Court.id, Court.name, Court.name_en, Court.court_type, Court.governorate, Court.city,
+                 Court.address, Court.phone, Court.email, Court.working_hours, Court.latitude, Court.longitude)
+
+LAWYER_COLUMNS = (User.id, User.first_name, User.last_name, LawyerProfile.specialization,
+                  LawyerProfile.governorate, LawyerProfile.law_firm, LawyerProfile.experience_years,
+                  LawyerProfile.consultation_fee, LawyerProfile.rating, LawyerProfile.total_reviews)
+
+
+def _json_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def row_dict(row):
+    return {key: _json_value(value) for key, value in row._mapping.items()}
+
+
+def page_payload(rows, page, per_page):
+    """Rows fetched with limit per_page + 1 as a page with has_next"""
+    return {
+        'results': [row_dict(row) for row in rows[:per_page]],
+        'page': page,
+        'has_next': len(rows) > per_page,
+    }
+
+
+def court_filters(search='', governorate='', court_type=''):
+    criteria = []
+    if search:
+        criteria.append(or_(Court.name.contains(search),
+                            Court.city.contains(search),
+                            Court.address.contains(search)))
+    if governorate:
+        criteria.append(Court.governorate == governorate)
+    if court_type:
+        criteria.append(Court.court_type == court_type)
+    return criteria
+
+
+def courts_select(search='', governorate='', court_type='', page=1, per_page=FEED_PAGE_SIZE):
+    return select(*COURT_COLUMNS).where(
+        Court.is_active == True, *court_filters(search, governorate, court_type)
+    ).order_by(Court.governorate, Court.name).limit(per_page + 1).offset((page - 1) * per_page)
+
+
+def lawyers_select(search='', specialization='', governorate='', page=1, per_page=FEED_PAGE_SIZE):
+    return directory_select(
+        *LAWYER_COLUMNS, search=search, specialization=specialization, governorate=governorate
+    ).order_by(LawyerProfile.ranking_score.desc().nulls_last(), LawyerProfile.id).limit(per_page + 1).offset((page - 1) * per_page)
+
+
+def search_selects(query, category='all', user_id=None, role=None, include_archived=False):
+    """{result type: select} for the search page's categories"""
+    selects = {}
+    if category in ('all', 'cases') and role in ('lawyer', 'client'):
+        models = (('cases', Case), ('archived_cases', ArchivedCase)) if include_archived else (('cases', Case),)
+        for name, model in models:
+            owner = model.lawyer_id if role == 'lawyer' else model.client_id
+            selects[name] = select(
+                model.id, model.case_number, model.title, model.case_type, model.status
+            ).where(owner == user_id, or_(model.title.contains(query), model.description.contains(query))
+                    ).limit(SEARCH_LIMIT)
+    if category in ('all', 'courts'):
+        selects['courts'] = select(Court.id, Court.name, Court.governorate, Court.city).where(
+            Court.is_active == True, or_(Court.name.contains(query), Court.city.contains(query))
+        ).limit(SEARCH_LIMIT)
+    if category in ('all', 'lawyers'):
+        selects['lawyers'] = select(*LAWYER_COLUMNS).join(LawyerProfile, LawyerProfile.user_id == User.id).where(
+            User.role == 'lawyer',
+            User.is_active == True,
+            or_(User.first_name.contains(query), User.last_name.contains(query))
+        ).limit(SEARCH_LIMIT)
+    return selects
+
+
+def calendar_select(user_id, role, start=None, end=None):
+    """The user's appointments as calendar events, or None for roles without a calendar"""
+    columns = (Appointment.id, Appointment.title, Appointment.start_datetime, Appointment.end_datetime,
+               Appointment.is_all_day, Appointment.appointment_type)
+    if role == 'lawyer':
+        statement = select(*columns).where(Appointment.user_id == user_id)
+    elif role == 'client':
+        statement = select(*columns).join(Case, Appointment.case_id == Case.id).where(Case.client_id == user_id)
+    else:
+        return None
+    if start:
+        statement = statement.where(Appointment.start_datetime >= start)
+    if end:
+        statement = statement.where(Appointment.start_datetime < end)
+    return statement.order_by(Appointment.start_datetime)
+
+
+def serialize_event(row):
+    """Calendar event in the format the calendar widget expects"""
+    return {
+        'id': row.id,
+        'title': row.title,
+        'start': row.start_datetime.isoformat(),
+        'end': row.end_datetime.isoformat() if row.end_datetime else None,
+        'allDay': row.is_all_day,
+        'backgroundColor': '#007bff' if row.appointment_type == 'hearing' else '#28a745'
+    }
+
+
+def _count(model, *criteria):
+    return select(func.count()).select_from(model).where(*criteria).scalar_subquery()
+
+
+def all_cases(*names):
+    """Live and archived cases as one subquery with the named columns, for reports over every case"""
+    return union_all(
+        select(*(Case.__table__.c[name] for name in names)),
+        select(*(ArchivedCase.__table__.c[name] for name in names)),
+    ).subquery('all_cases')
+
+
+def system_stats_select():
+    """All admin dashboard counters in one round trip"""
+    return select(
+        _count(User).label('total_users'),
+        _count(User, User.is_active == True).label('active_users'),
+        (_count(Case) + _count(ArchivedCase)).label('total_cases'),
+        _count(Case, Case.status == 'active').label('active_cases'),
+        _count(Court).label('total_courts'),
+        _count(Court, Court.is_active == True).label('active_courts'),
+        _count(LawyerProfile).label('total_lawyers'),
+        _count(LawyerProfile, LawyerProfile.is_verified == True).label('verified_lawyers'),
+        (_count(Appointment) + _count(ArchivedAppointment)).label('total_appointments'),
+        (_count(Appointment, Appointment.status == 'scheduled')
+         + _count(ArchivedAppointment, ArchivedAppointment.status == 'scheduled')).label('pending_appointments'),
+    )
+
+
+def parse_iso_datetime(value):
+    """Calendar range bound from a query parameter, or None"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).replace(tzinfo=None)
+    except ValueError:
+        return None
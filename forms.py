@@ -1,8 +1,46 @@
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileAllowed
 from wtforms import StringField, TextAreaField, SelectField, DateField, EmailField, PasswordField, IntegerField, FloatField, BooleanField
-from wtforms.validators import DataRequired, Email, Length, EqualTo, Optional, NumberRange
+from wtforms.validators import DataRequired, Email, Length, EqualTo, Optional, NumberRange, ValidationError
 from wtforms.widgets import TextArea
+from app import db
+from models import User, Court, Case
+
+class LookupField(IntegerField):
+    """Record id picked through a /lookup/<kind> JSON endpoint instead of a full choice list.
+    
+    Validation checks only the submitted id against query_factory(), which the
+    route may replace to scope it to the current user.
+    """
+    def __init__(self, label=None, validators=None, lookup=None, query_factory=None, **kwargs):
+        render_kw = dict(kwargs.pop('render_kw', None) or {})
+        render_kw.setdefault('data-lookup', lookup)
+        super().__init__(label, validators, render_kw=render_kw, **kwargs)
+        self.query_factory = query_factory
+    
+    def pre_validate(self, form):
+        if not self.data or self.query_factory is None:
+            return
+        if not db.session.query(self.query_factory().filter_by(id=self.data).exists()).scalar():
+            raise ValidationError('القيمة المختارة غير صالحة')
+
+class TemplateContent:
+    """Rejects document template text whose if/for blocks do not balance"""
+    def __call__(self, form, field):
+        from template_engine import TemplateSyntaxError, compile_template
+        try:
+            compile_template(field.data or '')
+        except TemplateSyntaxError as e:
+            raise ValidationError(f'صيغة النموذج غير صحيحة: {e}')
+
+def active_clients():
+    return User.query.filter_by(role='client', is_active=True)
+
+def active_lawyers():
+    return User.query.filter_by(role='lawyer', is_active=True)
+
+def active_courts():
+    return Court.query.filter_by(is_active=True)
 
 class LoginForm(FlaskForm):
     username = StringField('اسم المستخدم', validators=[DataRequired()], render_kw={"placeholder": "أدخل اسم المستخدم"})
@@ -81,9 +119,42 @@ class LawyerProfileForm(FlaskForm):
     office_address = TextAreaField('عنوان المكتب', render_kw={"placeholder": "عنوان المكتب"})
     consultation_fee = FloatField('رسوم الاستشارة', validators=[Optional(), NumberRange(min=0)], render_kw={"placeholder": "رسوم الاستشارة بالريال"})
     bio = TextAreaField('نبذة تعريفية', render_kw={"placeholder": "نبذة عن الخبرة والتخصص"})
+    governorate = SelectField('المحافظة', choices=[
+        ('', 'اختر المحافظة'),
+        ('صنعاء', 'صنعاء'),
+        ('عدن', 'عدن'),
+        ('تعز', 'تعز'),
+        ('الحديدة', 'الحديدة'),
+        ('إب', 'إب'),
+        ('ذمار', 'ذمار'),
+        ('حضرموت', 'حضرموت'),
+        ('لحج', 'لحج'),
+        ('أبين', 'أبين'),
+        ('شبوة', 'شبوة'),
+        ('مأرب', 'مأرب'),
+        ('الجوف', 'الجوف'),
+        ('صعدة', 'صعدة'),
+        ('حجة', 'حجة'),
+        ('المهرة', 'المهرة'),
+        ('عمران', 'عمران'),
+        ('الضالع', 'الضالع'),
+        ('ريمة', 'ريمة'),
+        ('البيضاء', 'البيضاء'),
+        ('سقطرى', 'سقطرى')
+    ], validators=[Optional()])
+
+class ReviewForm(FlaskForm):
+    rating = SelectField('التقييم', coerce=int, choices=[
+        (5, 'ممتاز'),
+        (4, 'جيد جداً'),
+        (3, 'جيد'),
+        (2, 'مقبول'),
+        (1, 'ضعيف')
+    ], validators=[DataRequired()])
+    comment = TextAreaField('التعليق', validators=[Optional(), Length(max=2000)], render_kw={"placeholder": "شاركنا تجربتك مع المحامي"})
 
 class CaseForm(FlaskForm):
-    case_number = StringField('رقم القضية', validators=[DataRequired()], render_kw={"placeholder": "رقم القضية"})
+    case_number = StringField('رقم القضية', validators=[Optional()], render_kw={"placeholder": "يُولَّد تلقائياً إذا تُرك فارغاً"})
     title = StringField('عنوان القضية', validators=[DataRequired()], render_kw={"placeholder": "عنوان القضية"})
     description = TextAreaField('وصف القضية', render_kw={"placeholder": "وصف تفصيلي للقضية"})
     case_type = SelectField('نوع القضية', choices=[
@@ -96,8 +167,8 @@ class CaseForm(FlaskForm):
         ('عقاري', 'عقاري'),
         ('ضرائب', 'ضرائب')
     ], validators=[DataRequired()])
-    client_id = SelectField('العميل', coerce=int, validators=[DataRequired()])
-    court_id = SelectField('المحكمة', coerce=int, validators=[Optional()])
+    client_id = LookupField('العميل', validators=[DataRequired()], lookup='clients', query_factory=active_clients)
+    court_id = LookupField('المحكمة', validators=[Optional()], lookup='courts', query_factory=active_courts)
     priority = SelectField('الأولوية', choices=[
         ('high', 'عالية'),
         ('medium', 'متوسطة'),
@@ -118,7 +189,7 @@ class DocumentTemplateForm(FlaskForm):
         ('شهادة', 'شهادة')
     ], validators=[DataRequired()])
     description = TextAreaField('الوصف', render_kw={"placeholder": "وصف النموذج"})
-    template_content = TextAreaField('محتوى النموذج', validators=[DataRequired()], 
+    template_content = TextAreaField('محتوى النموذج', validators=[DataRequired(), TemplateContent()], 
                                    widget=TextArea(), 
                                    render_kw={"rows": 15, "placeholder": "محتوى النموذج"})
 
@@ -154,7 +225,7 @@ class AppointmentForm(FlaskForm):
     end_datetime = StringField('وقت الانتهاء', validators=[Optional()], 
                               render_kw={"type": "datetime-local"})
     is_all_day = BooleanField('طوال اليوم')
-    case_id = SelectField('القضية', coerce=int, validators=[Optional()])
+    case_id = LookupField('القضية', validators=[Optional()], lookup='cases', query_factory=lambda: Case.query)
     location = StringField('المكان', render_kw={"placeholder": "مكان الموعد"})
     reminder_minutes = SelectField('تذكير قبل', choices=[
         (15, '15 دقيقة'),
@@ -193,7 +264,7 @@ class AdminUserForm(FlaskForm):
     password = PasswordField('كلمة المرور', validators=[Optional(), Length(min=6)], render_kw={"placeholder": "كلمة المرور (اتركها فارغة للاحتفاظ بالحالية)"})
 
 class AdminCaseForm(FlaskForm):
-    case_number = StringField('رقم القضية', validators=[DataRequired()], render_kw={"placeholder": "رقم القضية"})
+    case_number = StringField('رقم القضية', validators=[Optional()], render_kw={"placeholder": "يُولَّد تلقائياً إذا تُرك فارغاً"})
     title = StringField('عنوان القضية', validators=[DataRequired()], render_kw={"placeholder": "عنوان القضية"})
     description = TextAreaField('وصف القضية', render_kw={"placeholder": "وصف تفصيلي للقضية"})
     case_type = SelectField('نوع القضية', choices=[
@@ -206,9 +277,9 @@ class AdminCaseForm(FlaskForm):
         ('عقاري', 'عقاري'),
         ('ضرائب', 'ضرائب')
     ], validators=[DataRequired()])
-    lawyer_id = SelectField('المحامي', coerce=int, validators=[DataRequired()])
-    client_id = SelectField('العميل', coerce=int, validators=[DataRequired()])
-    court_id = SelectField('المحكمة', coerce=int, validators=[Optional()])
+    lawyer_id = LookupField('المحامي', validators=[DataRequired()], lookup='lawyers', query_factory=active_lawyers)
+    client_id = LookupField('العميل', validators=[DataRequired()], lookup='clients', query_factory=active_clients)
+    court_id = LookupField('المحكمة', validators=[Optional()], lookup='courts', query_factory=active_courts)
     status = SelectField('الحالة', choices=[
         ('active', 'نشطة'),
         ('pending', 'معلقة'),
@@ -301,9 +372,31 @@ class AdminDocumentTemplateForm(FlaskForm):
         ('طلب', 'طلب'), ('توكيل', 'توكيل'), ('إقرار', 'إقرار'), ('شهادة', 'شهادة')
     ], validators=[DataRequired()])
     description = TextAreaField('الوصف', render_kw={"placeholder": "وصف النموذج"})
-    template_content = TextAreaField('محتوى النموذج', validators=[DataRequired()], 
+    template_content = TextAreaField('محتوى النموذج', validators=[DataRequired(), TemplateContent()], 
                                    widget=TextArea(), 
                                    render_kw={"rows": 15, "placeholder": "محتوى النموذج"})
     template_fields = TextAreaField('الحقول القابلة للتعبئة', render_kw={"placeholder": "الحقول بتنسيق JSON"})
     is_active = BooleanField('نشط', default=True)
     created_by = SelectField('منشئ النموذج', coerce=int, validators=[DataRequired()])
+
+class MailMergeForm(FlaskForm):
+    source = SelectField('مصدر البيانات', choices=[
+        ('cases', 'قضايا محددة'),
+        ('clients', 'عملاء محددون'),
+        ('csv', 'ملف CSV')
+    ], default='cases', validators=[DataRequired()])
+    record_ids = TextAreaField('المعرفات', render_kw={"placeholder": "أرقام معرفات القضايا أو العملاء مفصولة بفواصل"})
+    csv_file = FileField('ملف البيانات', validators=[
+        FileAllowed(['csv'], 'الملفات المسموحة: CSV')
+    ])
+    output = SelectField('المخرجات', choices=[
+        ('zip', 'ملف مضغوط ZIP'),
+        ('documents', 'حفظ كمستندات في النظام')
+    ], default='zip', validators=[DataRequired()])
+
+class CaseImportForm(FlaskForm):
+    file = FileField('ملف القضايا', validators=[
+        DataRequired(),
+        FileAllowed(['csv', 'xlsx'], 'الملفات المسموحة: CSV, XLSX')
+    ])
+    batch_size = IntegerField('حجم الدفعة', validators=[Optional(), NumberRange(min=1, max=10000)], render_kw={"placeholder": "1000"})
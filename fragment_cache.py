@@ -0,0 +1,268 @@
+"""Fragment caching for Jinja templates.
+
+    {% cache 'case-row', case.id, tags=['cases:' ~ case.id], timeout=600 %}
+        ...
+    {% endcache %}
+
+The positional arguments form the key. Tags name the data a fragment depends
+on: each tag has a random version token stored in the backend and folded
+into the fragment key, so invalidating a tag only replaces its token and
+every fragment rendered under the old token stops matching. Committed model
+writes invalidate the row's table name; updates and deletes of models with
+__fragment_row_tags__ (cases, courts, lawyer_profiles, appointments) also
+invalidate the '<table>:<id>' tag. Bulk statements invalidate the table
+name, and add_row_tags the rows they changed.
+
+Backends are 'memory' (a per-worker LRU, also the stand-in for tests) and
+'filesystem' (files under FRAGMENT_CACHE_FOLDER, shared by all workers on a
+host, including tag tokens, so invalidation reaches every worker), or
+'null' to disable caching.
+"""
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from flask import current_app
+from jinja2 import nodes
+from jinja2.exceptions import TemplateSyntaxError
+from jinja2.ext import Extension
+from markupsafe import Markup
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+
+class NullBackend:
+    def get(self, key):
+        return None
+
+    def set(self, key, value, timeout=None):
+        pass
+
+    def clear(self):
+        pass
+
+
+class MemoryBackend:
+    """Per-process LRU with optional per-entry expiry"""
+
+    def __init__(self, max_entries=5000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at or None, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] is not None and entry[0] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, timeout=None):
+        expires_at = time.time() + timeout if timeout else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class FileSystemBackend:
+    """Entries as files under folder, shared by every worker on the host"""
+
+    def __init__(self, folder, max_entries=20000):
+        self.folder = folder
+        self.max_entries = max_entries
+        self._writes = 0
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.folder, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._path(key), encoding='utf-8') as f:
+                expires_at, value = f.read().split('\n', 1)
+        except (FileNotFoundError, ValueError):
+            return None
+        if expires_at and float(expires_at) <= time.time():
+            return None
+        return value
+
+    def set(self, key, value, timeout=None):
+        path = self._path(key)
+        expires_at = repr(time.time() + timeout) if timeout else ''
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(f"{expires_at}\n{value}")
+        os.replace(tmp_path, path)
+        self._writes += 1
+        if self._writes % 500 == 0:
+            self._prune()
+
+    def _prune(self):
+        # Oldest files go first; a pruned tag token only causes extra misses
+        files = []
+        for entry in os.scandir(self.folder):
+            try:
+                files.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                continue
+        files.sort()
+        for _, path in files[:max(0, len(files) - self.max_entries)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        for entry in os.scandir(self.folder):
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+class FragmentCache:
+    """Tag-versioned fragment storage on top of a backend"""
+
+    def __init__(self, backend, default_timeout=300):
+        self.backend = backend
+        self.default_timeout = default_timeout
+        self.hits = 0
+        self.misses = 0
+
+    def _tag_token(self, tag):
+        token = self.backend.get(f'tag:{tag}')
+        if token is None:
+            token = uuid.uuid4().hex
+            self.backend.set(f'tag:{tag}', token)
+        return token
+
+    def key(self, key_parts, tags=()):
+        tokens = [f'{tag}={self._tag_token(tag)}' for tag in sorted(set(tags))]
+        raw = '\x1f'.join([repr(part) for part in key_parts] + tokens)
+        return 'fragment:' + hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get_or_render(self, key_parts, tags, timeout, render):
+        key = self.key(key_parts, tags or ())
+        content = self.backend.get(key)
+        if content is None:
+            self.misses += 1
+            content = render()
+            self.backend.set(key, str(content), self.default_timeout if timeout is None else timeout)
+        else:
+            self.hits += 1
+        return content
+
+    def invalidate_tags(self, tags):
+        for tag in tags:
+            self.backend.set(f'tag:{tag}', uuid.uuid4().hex)
+
+
+def create_backend(config):
+    name = config['FRAGMENT_CACHE_BACKEND']
+    if name == 'filesystem':
+        return FileSystemBackend(config['FRAGMENT_CACHE_FOLDER'])
+    if name == 'memory':
+        return MemoryBackend()
+    if name == 'null':
+        return NullBackend()
+    raise ValueError(f'Unknown FRAGMENT_CACHE_BACKEND: {name}')
+
+
+def get_fragment_cache(app=None):
+    app = app or current_app._get_current_object()
+    cache = app.extensions.get('fragment_cache')
+    if cache is None:
+        cache = FragmentCache(create_backend(app.config), app.config['FRAGMENT_CACHE_TIMEOUT'])
+        app.extensions['fragment_cache'] = cache
+    return cache
+
+
+class FragmentCacheExtension(Extension):
+    """{% cache key[, key...][, tags=[...]][, timeout=seconds] %}...{% endcache %}"""
+
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key_parts, options = [], {}
+        while parser.stream.current.type != 'block_end':
+            if key_parts or options:
+                parser.stream.expect('comma')
+            if parser.stream.current.type == 'name' and parser.stream.look().type == 'assign':
+                name = next(parser.stream).value
+                if name not in ('tags', 'timeout'):
+                    raise TemplateSyntaxError(f'Unknown cache option: {name}', lineno)
+                next(parser.stream)
+                options[name] = parser.parse_expression()
+            else:
+                key_parts.append(parser.parse_expression())
+        if not key_parts:
+            raise TemplateSyntaxError('cache requires a key', lineno)
+
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        call = self.call_method('_cached', [
+            nodes.List(key_parts),
+            options.get('tags', nodes.Const(None)),
+            options.get('timeout', nodes.Const(None)),
+        ])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _cached(self, key_parts, tags, timeout, caller):
+        content = get_fragment_cache().get_or_render(key_parts, tags, timeout, caller)
+        # The body was rendered (and escaped) before it was stored
+        return Markup(content) if self.environment.autoescape else content
+
+
+@event.listens_for(Session, 'after_flush')
+def collect_fragment_tags(session, flush_context):
+    tags = session.info.setdefault('fragment_tags', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        table = getattr(obj, '__tablename__', None)
+        if table is None:
+            continue
+        tags.add(table)
+        # A new row cannot be in a fragment yet; row tags are opt-in so that
+        # large flushes do not write a tag per row
+        if obj in session.new or not getattr(obj, '__fragment_row_tags__', False):
+            continue
+        identity = inspect(obj).mapper.primary_key_from_instance(obj)
+        if None not in identity:
+            tags.add(f"{table}:{':'.join(str(part) for part in identity)}")
+
+
+def add_row_tags(session, table, ids):
+    """Invalidate '<table>:<id>' tags on commit, for rows changed by bulk statements"""
+    session.info.setdefault('fragment_tags', set()).update(f'{table}:{row_id}' for row_id in ids)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def collect_bulk_fragment_tags(orm_execute_state):
+    """Bulk insert/update/delete statements bypass the flush"""
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = orm_execute_state.statement.table
+        orm_execute_state.session.info.setdefault('fragment_tags', set()).add(table.name)
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_fragment_tags(session):
+    tags = session.info.pop('fragment_tags', None)
+    if tags and current_app:
+        get_fragment_cache().invalidate_tags(tags)
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_fragment_tags(session):
+    session.info.pop('fragment_tags', None)
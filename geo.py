@@ -0,0 +1,106 @@
+"""Geospatial helpers: great-circle distance, grid cells and a small KD-tree.
+
+Points are indexed as unit vectors on the sphere, where straight-line (chord)
+distance grows monotonically with great-circle distance, so a plain 3-D
+KD-tree answers k-nearest and radius queries exactly.
+"""
+import heapq
+import math
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Grid cell size in degrees for the indexed grid_lat/grid_lon columns (~28 km)
+GRID_CELL_DEGREES = 0.25
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points in kilometres"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def to_unit_vector(lat, lon):
+    phi, lam = math.radians(lat), math.radians(lon)
+    cos_phi = math.cos(phi)
+    return (cos_phi * math.cos(lam), cos_phi * math.sin(lam), math.sin(phi))
+
+
+def chord_for_km(distance_km):
+    """Chord length on the unit sphere matching a great-circle distance"""
+    angle = min(distance_km / EARTH_RADIUS_KM, math.pi)
+    return 2 * math.sin(angle / 2)
+
+
+def grid_cell(lat, lon):
+    """(grid_lat, grid_lon) cell of a coordinate"""
+    return math.floor(lat / GRID_CELL_DEGREES), math.floor(lon / GRID_CELL_DEGREES)
+
+
+def grid_bounds(lat, lon, radius_km):
+    """Inclusive cell ranges and lat/lon box covering a radius around a point"""
+    d_lat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    cos_lat = math.cos(math.radians(lat))
+    d_lon = 180.0 if cos_lat < 1e-6 else min(180.0, d_lat / cos_lat)
+    box = (lat - d_lat, lat + d_lat, lon - d_lon, lon + d_lon)
+    (lat_lo, lon_lo), (lat_hi, lon_hi) = grid_cell(box[0], box[2]), grid_cell(box[1], box[3])
+    return (lat_lo, lat_hi, lon_lo, lon_hi), box
+
+
+class KDTree:
+    """Static 3-D KD-tree over (lat, lon, item) triples"""
+
+    __slots__ = ('root', 'size')
+
+    def __init__(self, entries):
+        points = [(to_unit_vector(lat, lon), item) for lat, lon, item in entries]
+        self.size = len(points)
+        self.root = self._build(points, 0)
+
+    def _build(self, points, depth):
+        if not points:
+            return None
+        axis = depth % 3
+        points.sort(key=lambda entry: entry[0][axis])
+        middle = len(points) // 2
+        point, item = points[middle]
+        return (point, item, axis,
+                self._build(points[:middle], depth + 1),
+                self._build(points[middle + 1:], depth + 1))
+
+    def nearest(self, lat, lon, k, radius_km=None):
+        """Up to k items within radius_km, nearest first, as (chord_sq, item)"""
+        if k <= 0 or self.root is None:
+            return []
+        target = to_unit_vector(lat, lon)
+        bound = chord_for_km(radius_km) ** 2 if radius_km is not None else float('inf')
+        heap = []  # max-heap of (-chord_sq, tiebreak, item)
+        counter = 0
+
+        stack = [(self.root, 0.0)]  # (node, squared distance to its splitting plane)
+        while stack:
+            node, plane_dist = stack.pop()
+            if node is None:
+                continue
+            worst = -heap[0][0] if len(heap) == k else bound
+            if plane_dist > worst:
+                continue
+            point, item, axis, left, right = node
+            dx, dy, dz = point[0] - target[0], point[1] - target[1], point[2] - target[2]
+            dist = dx * dx + dy * dy + dz * dz
+            if dist <= worst:
+                counter += 1
+                if len(heap) == k:
+                    heapq.heapreplace(heap, (-dist, counter, item))
+                else:
+                    heapq.heappush(heap, (-dist, counter, item))
+
+            diff = target[axis] - point[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            # Far side is pushed first so the near side is explored before it
+            stack.append((far, max(plane_dist, diff * diff)))
+            stack.append((near, plane_dist))
+
+        return [(-neg, item) for neg, _, item in sorted(heap, reverse=True)]
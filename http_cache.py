@@ -0,0 +1,218 @@
+"""HTTP caching for the public court and lawyer directories.
+
+Each directory has a change version in the table_versions table, bumped in
+the same transaction as any flush that touches its rows (courts for the
+court directory; lawyer users, their profiles and reviews for the lawyer
+directory). Pages carry a weak ETag built from that version, the query
+parameters and the viewer, plus a Last-Modified from the version's
+timestamp, so revalidation costs one primary-key query and no render.
+Anonymous pages are also kept in a per-worker LRU of rendered bodies and may
+be stored by a reverse proxy for DIRECTORY_CACHE_PROXY_MAX_AGE seconds.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import current_app, make_response, request, session
+from flask_login import current_user
+from sqlalchemy import event, inspect, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app import db
+from models import Court, LawyerProfile, Review, TableVersion, User
+
+class PageCache:
+    """Per-process LRU of rendered directory pages"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (scope, version, endpoint, args) -> (body, mimetype)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return entry
+
+    def put(self, key, body, mimetype):
+        with self._lock:
+            self._entries[key] = (body, mimetype)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, scope):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == scope]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def get_page_cache(app=None):
+    app = app or current_app._get_current_object()
+    cache = app.extensions.get('directory_page_cache')
+    if cache is None:
+        cache = app.extensions['directory_page_cache'] = PageCache(app.config['DIRECTORY_CACHE_MAX_ENTRIES'])
+    return cache
+
+
+def _changed_scopes(target):
+    if isinstance(target, Court):
+        return ('courts',)
+    if isinstance(target, (LawyerProfile, Review)):
+        return ('lawyers',)
+    if isinstance(target, User):
+        state = inspect(target)
+        role_history = state.attrs.role.history
+        if target.role == 'lawyer' or 'lawyer' in (role_history.deleted or ()):
+            return ('lawyers',)
+    return ()
+
+
+@event.listens_for(Court, 'after_insert')
+@event.listens_for(Court, 'after_update')
+@event.listens_for(Court, 'after_delete')
+@event.listens_for(LawyerProfile, 'after_insert')
+@event.listens_for(LawyerProfile, 'after_update')
+@event.listens_for(LawyerProfile, 'after_delete')
+@event.listens_for(Review, 'after_insert')
+@event.listens_for(Review, 'after_update')
+@event.listens_for(Review, 'after_delete')
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def directory_row_changed(mapper, connection, target):
+    scopes = _changed_scopes(target)
+    db_session = inspect(target).session
+    if scopes and db_session is not None:
+        db_session.info.setdefault('changed_directories', set()).update(scopes)
+
+
+def touch_directories(session, scopes):
+    """Advance directory versions in the session's transaction, e.g. after a Core UPDATE"""
+    table = TableVersion.__table__
+    session.connection().execute(
+        update(table).where(table.c.name.in_(sorted(scopes)))
+        .values(version=table.c.version + 1, updated_at=datetime.utcnow())
+    )
+    session.info.setdefault('committed_directories', set()).update(scopes)
+
+
+@event.listens_for(Session, 'after_flush')
+def bump_directory_versions(session, flush_context):
+    """Advance the version of every directory touched by this flush"""
+    scopes = session.info.get('changed_directories')
+    if scopes:
+        touch_directories(session, scopes)
+        scopes.clear()
+
+
+@event.listens_for(Session, 'after_commit')
+def drop_stale_pages(session):
+    scopes = session.info.pop('committed_directories', None)
+    if scopes and current_app:
+        cache = get_page_cache()
+        for scope in scopes:
+            cache.invalidate(scope)
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_directory_changes(session):
+    session.info.pop('changed_directories', None)
+    session.info.pop('committed_directories', None)
+
+
+def get_directory_versions(scopes):
+    """{scope: (version, updated_at)}, creating missing rows at version 1"""
+    table = TableVersion.__table__
+    query = select(table.c.name, table.c.version, table.c.updated_at).where(table.c.name.in_(scopes))
+    versions = {name: (version, updated_at) for name, version, updated_at in db.session.execute(query)}
+
+    missing = [scope for scope in scopes if scope not in versions]
+    for scope in missing:
+        # Seeded outside the request transaction; another worker may race us
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(insert(table).values(name=scope, version=1, updated_at=datetime.utcnow()))
+        except IntegrityError:
+            pass
+    if missing:
+        # Read back from the primary; a replica may not have the new rows yet
+        versions.update({name: (version, updated_at) for name, version, updated_at in
+                         db.session.execute(query.where(table.c.name.in_(missing)),
+                                            bind_arguments={'bind': db.engine})})
+    return versions
+
+
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def _set_validators(response, etag, last_modified, anonymous):
+    response.set_etag(etag, weak=True)
+    response.last_modified = last_modified
+    response.vary.add('Cookie')
+    if anonymous:
+        response.cache_control.public = True
+        response.cache_control.max_age = 0
+        response.cache_control.s_maxage = current_app.config['DIRECTORY_CACHE_PROXY_MAX_AGE']
+    else:
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    return response
+
+
+def cached_directory(scope):
+    """Conditional GET, proxy headers and page caching for a directory view"""
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            # Pending flash messages are rendered into the page; never cache those
+            if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+                return view(*args, **kwargs)
+
+            version, updated_at = get_directory_versions([scope])[scope]
+            last_modified = updated_at.replace(microsecond=0, tzinfo=timezone.utc)
+            anonymous = not current_user.is_authenticated
+            viewer = 'anonymous' if anonymous else f'user:{current_user.id}'
+            params = tuple(sorted(request.args.items(multi=True)))
+            etag = hashlib.sha1(
+                f"{request.endpoint}|{scope}:{version}|{params!r}|{viewer}".encode('utf-8')
+            ).hexdigest()
+
+            if _not_modified(etag, last_modified):
+                response = current_app.response_class(status=304)
+                return _set_validators(response, etag, last_modified, anonymous)
+
+            cache = get_page_cache()
+            key = (scope, version, request.endpoint, params)
+            cached = cache.get(key) if anonymous else None
+            if cached is not None:
+                body, mimetype = cached
+                response = current_app.response_class(body, mimetype=mimetype)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                if anonymous and not session.get('_flashes'):
+                    cache.put(key, response.get_data(), response.mimetype)
+            return _set_validators(response, etag, last_modified, anonymous)
+        return wrapped
+    return decorator
@@ -0,0 +1,35 @@
+"""Jinja bytecode cache and template preloading.
+
+Compiled templates are stored under JINJA_BYTECODE_CACHE_FOLDER, keyed by
+template name and source checksum, so a worker that loads a template another
+process already compiled only unmarshals its code object. ``flask
+precompile-templates`` fills the cache after a deploy, and each worker loads
+every template at startup (JINJA_PRELOAD_TEMPLATES) so first requests skip
+both compiling and the loader.
+"""
+import os
+
+from jinja2 import FileSystemBytecodeCache, TemplateError
+
+TEMPLATE_EXTENSIONS = ('html', 'txt', 'xml')
+
+
+def create_bytecode_cache(folder):
+    """A shared on-disk bytecode cache, or None when folder is empty"""
+    if not folder:
+        return None
+    os.makedirs(folder, exist_ok=True)
+    return FileSystemBytecodeCache(folder)
+
+
+def precompile_templates(app):
+    """Load every template, compiling into the bytecode cache; returns (count, errors)"""
+    env = app.jinja_env
+    loaded, errors = 0, []
+    for name in env.list_templates(extensions=TEMPLATE_EXTENSIONS):
+        try:
+            env.get_template(name)
+            loaded += 1
+        except TemplateError as e:
+            errors.append((name, str(e)))
+    return loaded, errors
@@ -0,0 +1,91 @@
+"""Background jobs with file-backed progress.
+
+Long operations (mail merge, imports, ...) run on a background thread of the
+worker that started them. Their state lives in ``uploads/jobs/<id>/status.json``
+so any gunicorn worker can report progress, and so an interrupted job can be
+resumed from its last saved checkpoint.
+"""
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+
+from flask import current_app
+
+from app import db
+
+JOBS_FOLDER = 'jobs'
+
+
+def job_dir(job_id, app=None):
+    app = app or current_app
+    return os.path.join(app.root_path, app.config['UPLOAD_FOLDER'], JOBS_FOLDER, job_id)
+
+
+def read_job(job_id, app=None):
+    """Return the status dict of a job, or None if it does not exist"""
+    if not job_id.isalnum():
+        return None
+    try:
+        with open(os.path.join(job_dir(job_id, app), 'status.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_job(job, app=None):
+    path = os.path.join(job_dir(job['job_id'], app), 'status.json')
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(job, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def create_job(kind, user_id, total=0, **fields):
+    """Create the job directory and initial status; returns the job dict"""
+    job = {
+        'job_id': uuid.uuid4().hex,
+        'kind': kind,
+        'user_id': user_id,
+        'total': total,
+        'done': 0,
+        'status': 'queued',
+        'error': None,
+        'created_at': datetime.utcnow().isoformat(),
+        'finished_at': None,
+    }
+    job.update(fields)
+    os.makedirs(job_dir(job['job_id']), exist_ok=True)
+    save_job(job)
+    return job
+
+
+def run_job(app, job_id, work):
+    """Run work(job) inside an app context, recording the outcome"""
+    with app.app_context():
+        job = read_job(job_id)
+        job['status'] = 'running'
+        job['error'] = None
+        save_job(job)
+
+        try:
+            work(job)
+            job['status'] = 'done'
+        except Exception as e:
+            db.session.rollback()
+            app.logger.exception('%s job %s failed', job['kind'], job_id)
+            job['status'] = 'failed'
+            job['error'] = str(e)
+        finally:
+            job['finished_at'] = datetime.utcnow().isoformat()
+            save_job(job)
+            db.session.remove()
+
+
+def start_job(job_id, work):
+    """Run work(job) for an existing job on a background thread"""
+    app = current_app._get_current_object()
+    thread = threading.Thread(target=run_job, args=(app, job_id, work), daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,105 @@
+"""Lawyer directory queries and facet counts.
+
+Facet counts come from one GROUP BY specialization, governorate query over
+the lawyers matching the search text. Each facet is then summed with the
+other facet's selection applied but not its own, so the page can show how
+many lawyers each specialization or governorate option would return. The
+grouped rows are cached per search text for LAWYER_FACET_CACHE_TTL seconds.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy import func, or_, select
+
+from app import db
+from models import LawyerProfile, User
+
+MAX_CACHED_SIGNATURES = 1000
+
+
+def directory_filters(search='', specialization='', governorate=''):
+    """WHERE criteria for verified active lawyers matching the filters"""
+    criteria = [
+        User.role == 'lawyer',
+        User.is_active == True,
+        LawyerProfile.is_verified == True
+    ]
+    if search:
+        criteria.append(
+            or_(User.first_name.contains(search),
+                User.last_name.contains(search),
+                LawyerProfile.law_firm.contains(search))
+        )
+    if specialization:
+        criteria.append(LawyerProfile.specialization == specialization)
+    if governorate:
+        criteria.append(LawyerProfile.governorate == governorate)
+    return criteria
+
+
+def directory_query(*columns, **filters):
+    """Verified active lawyers matching the filters"""
+    return db.session.query(*columns).select_from(User).join(LawyerProfile).filter(*directory_filters(**filters))
+
+
+def directory_select(*columns, **filters):
+    """directory_query as a Core select, for async sessions"""
+    return select(*columns).select_from(User).join(LawyerProfile).where(*directory_filters(**filters))
+
+
+class FacetCache:
+    """Short-lived cache of grouped facet rows keyed by filter signature"""
+
+    def __init__(self):
+        self._entries = OrderedDict()  # signature -> (expires_at, rows)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_load(self, signature, ttl, load):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(signature)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        rows = load()
+        with self._lock:
+            self._entries[signature] = (now + ttl, rows)
+            self._entries.move_to_end(signature)
+            while len(self._entries) > MAX_CACHED_SIGNATURES:
+                self._entries.popitem(last=False)
+        return rows
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+facet_cache = FacetCache()
+
+
+def _grouped_counts(search):
+    query = directory_query(
+        LawyerProfile.specialization, LawyerProfile.governorate, func.count(LawyerProfile.id),
+        search=search
+    ).group_by(LawyerProfile.specialization, LawyerProfile.governorate)
+    return [tuple(row) for row in query]
+
+
+def lawyer_facets(search='', specialization='', governorate=''):
+    """({specialization: count}, {governorate: count}) for the current filters"""
+    rows = facet_cache.get_or_load(
+        ('lawyers', search), current_app.config['LAWYER_FACET_CACHE_TTL'],
+        lambda: _grouped_counts(search)
+    )
+    specializations, governorates = {}, {}
+    for row_specialization, row_governorate, count in rows:
+        if not governorate or row_governorate == governorate:
+            specializations[row_specialization] = specializations.get(row_specialization, 0) + count
+        if row_governorate and (not specialization or row_specialization == specialization):
+            governorates[row_governorate] = governorates.get(row_governorate, 0) + count
+    return specializations, governorates
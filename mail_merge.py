@@ -0,0 +1,211 @@
+"""Bulk mail-merge generation from a DocumentTemplate.
+
+A job renders one template against many field-value rows (selected cases,
+selected clients or an uploaded CSV). Rendering runs in a process pool, the
+results are streamed into a ZIP archive or stored as Document rows with bulk
+inserts, and progress is tracked through the jobs module.
+"""
+import csv
+import multiprocessing
+import os
+import uuid
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+from flask import current_app
+from sqlalchemy import insert
+from sqlalchemy.orm import joinedload
+from werkzeug.utils import secure_filename
+
+from app import db
+from jobs import create_job, job_dir, save_job, start_job
+from models import Case, Document, DocumentTemplate, User
+from template_engine import render_chunk
+from utils import get_status_display_name
+
+def case_field_values(case):
+    """Merge fields available for a case"""
+    return {
+        'case_number': case.case_number,
+        'case_title': case.title,
+        'case_type': case.case_type,
+        'case_status': get_status_display_name(case.status),
+        'client_name': case.client.full_name,
+        'client_phone': case.client.phone or '',
+        'client_email': case.client.email,
+        'lawyer_name': case.lawyer.full_name,
+        'court_name': case.court.name if case.court else '',
+        'court_governorate': case.court.governorate if case.court else '',
+        'filed_date': case.filed_date,
+        'next_hearing_date': case.next_hearing_date or '',
+        'today': date.today(),
+    }
+
+
+def client_field_values(client):
+    """Merge fields available for a client"""
+    return {
+        'client_name': client.full_name,
+        'client_phone': client.phone or '',
+        'client_email': client.email,
+        'today': date.today(),
+    }
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def iter_case_rows(case_ids, chunk_size):
+    """Yield (case_id, label, values) for the selected cases, one query per chunk"""
+    for ids in _chunks(case_ids, chunk_size):
+        cases = Case.query.options(
+            joinedload(Case.lawyer), joinedload(Case.client), joinedload(Case.court)
+        ).filter(Case.id.in_(ids)).order_by(Case.id).all()
+        for case in cases:
+            yield case.id, secure_filename(case.case_number) or f"case_{case.id}", case_field_values(case)
+        db.session.expunge_all()
+
+
+def iter_client_rows(client_ids, chunk_size):
+    """Yield (None, label, values) for the selected clients"""
+    for ids in _chunks(client_ids, chunk_size):
+        clients = User.query.filter(User.id.in_(ids), User.role == 'client').order_by(User.id).all()
+        for client in clients:
+            yield None, f"client_{client.id}", client_field_values(client)
+        db.session.expunge_all()
+
+
+def iter_csv_rows(csv_path):
+    """Yield (None, label, values) for every row of an uploaded CSV"""
+    with open(csv_path, encoding='utf-8-sig', newline='') as f:
+        for index, row in enumerate(csv.DictReader(f), start=1):
+            values = {k.strip(): (v or '').strip() for k, v in row.items() if k}
+            yield None, f"row_{index}", values
+
+
+def count_csv_rows(csv_path):
+    with open(csv_path, encoding='utf-8-sig', newline='') as f:
+        return sum(1 for _ in csv.DictReader(f))
+
+
+def _batched(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _rendered_batches(template, batches, workers):
+    """Yield (batch, outputs) in order, rendering up to 2*workers batches ahead"""
+    key = (template['id'], template['version'])
+    content = template['content']
+
+    if workers <= 1:
+        for batch in batches:
+            yield batch, render_chunk(key, content, [values for _, _, values in batch])
+        return
+
+    # spawn keeps forked DB connections and app threads out of the workers
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        pending = deque()
+        for batch in batches:
+            pending.append((batch, executor.submit(
+                render_chunk, key, content, [values for _, _, values in batch]
+            )))
+            if len(pending) >= workers * 2:
+                batch, future = pending.popleft()
+                yield batch, future.result()
+        while pending:
+            batch, future = pending.popleft()
+            yield batch, future.result()
+
+
+def _store_documents(template, batch, outputs, user_id, upload_path):
+    """Write rendered files and bulk insert their Document rows"""
+    rows = []
+    for (case_id, label, _), content in zip(batch, outputs):
+        file_name = f"{label}_{uuid.uuid4().hex[:8]}.txt"
+        file_path = os.path.join(upload_path, file_name)
+        data = content.encode('utf-8')
+        with open(file_path, 'wb') as f:
+            f.write(data)
+        rows.append({
+            'title': f"{template['name']} - {label}",
+            'file_name': file_name,
+            'file_path': file_path,
+            'file_size': len(data),
+            'mime_type': 'text/plain',
+            'document_type': 'generated',
+            'template_category': template['category'],
+            'case_id': case_id,
+            'uploaded_by': user_id,
+        })
+    db.session.execute(insert(Document), rows)
+    db.session.commit()
+
+
+def run_merge(job):
+    """Render every row of a mail-merge job; runs on the job thread"""
+    app = current_app
+    directory = job_dir(job['job_id'])
+
+    # Plain snapshot: the session is committed and expunged between batches
+    row = db.session.get(DocumentTemplate, job['template_id'])
+    template = {
+        'id': row.id,
+        'version': row.version or 1,
+        'content': row.template_content,
+        'name': row.name,
+        'category': row.category,
+    }
+    chunk_size = app.config['MAIL_MERGE_CHUNK_SIZE']
+    if job['source'] == 'cases':
+        rows = iter_case_rows(job['record_ids'], chunk_size)
+    elif job['source'] == 'clients':
+        rows = iter_client_rows(job['record_ids'], chunk_size)
+    else:
+        rows = iter_csv_rows(os.path.join(directory, 'input.csv'))
+
+    batches = _rendered_batches(template, _batched(rows, chunk_size),
+                                app.config['MAIL_MERGE_WORKERS'])
+
+    if job['output'] == 'zip':
+        with zipfile.ZipFile(os.path.join(directory, 'output.zip'), 'w',
+                             compression=zipfile.ZIP_DEFLATED) as archive:
+            for batch, outputs in batches:
+                for (_, label, _), content in zip(batch, outputs):
+                    archive.writestr(f"{label}.txt", content)
+                job['done'] += len(batch)
+                save_job(job)
+    else:
+        upload_path = os.path.join(app.root_path, app.config['UPLOAD_FOLDER'])
+        os.makedirs(upload_path, exist_ok=True)
+        for batch, outputs in batches:
+            _store_documents(template, batch, outputs, job['user_id'], upload_path)
+            job['done'] += len(batch)
+            save_job(job)
+
+
+def start_merge_job(template, source, output, user_id, record_ids=None, csv_file=None):
+    """Queue a mail-merge job and start it on a background thread; returns the job id"""
+    record_ids = sorted(set(record_ids or []))
+    job = create_job('mail_merge', user_id, total=len(record_ids), template_id=template.id,
+                     source=source, output=output, record_ids=record_ids)
+
+    if source == 'csv':
+        csv_path = os.path.join(job_dir(job['job_id']), 'input.csv')
+        csv_file.save(csv_path)
+        job['total'] = count_csv_rows(csv_path)
+        save_job(job)
+
+    start_job(job['job_id'], run_merge)
+    return job['job_id']
@@ -1,5 +1,11 @@
 from app import app
 import routes
+import commands
+from jinja_cache import precompile_templates
+
+# Filters are registered by routes, so templates can only be loaded now
+if app.config["JINJA_PRELOAD_TEMPLATES"]:
+    precompile_templates(app)
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
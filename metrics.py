@@ -0,0 +1,290 @@
+"""Prometheus metrics, aggregated across gunicorn workers through files.
+
+Each worker counts in plain dicts under a lock (a couple of microseconds
+per request):
+
+- http_requests_total{endpoint, status}
+- http_request_duration_seconds{endpoint} (histogram)
+- http_upload_bytes_total{endpoint}: bodies of multipart requests
+- cache_hits_total / cache_misses_total{cache} for the render, directory
+  page, fragment and lawyer facet caches, and a derived cache_hit_ratio
+- db_pool_size / db_pool_checked_out / db_pool_overflow for the primary engine
+
+Endpoints are Flask endpoint names, so URLs with ids share a series, and
+unrouted requests are 'unmatched'. A background thread writes the worker's
+totals to METRICS_FOLDER/worker-<pid>-<token>.json every
+METRICS_FLUSH_INTERVAL seconds; /metrics sums every worker's file with the
+live numbers of the worker serving the scrape. Files of exited workers are
+folded into archive.json so their counts survive restarts; their pool
+gauges are dropped.
+"""
+import atexit
+import bisect
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+
+from flask import current_app, g, request
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ARCHIVE_FILE = 'archive.json'
+
+
+class WorkerMetrics:
+    """This process's counters"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.requests = {}  # (endpoint, status) -> count
+        self.latency = {}  # endpoint -> [per-bucket counts..., +Inf count, sum]
+        self.uploads = {}  # endpoint -> bytes
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, status, seconds, upload_bytes=0):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            key = (endpoint, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            histogram = self.latency.get(endpoint)
+            if histogram is None:
+                histogram = self.latency[endpoint] = [0] * (len(self.buckets) + 1) + [0.0]
+            histogram[index] += 1
+            histogram[-1] += seconds
+            if upload_bytes:
+                self.uploads[endpoint] = self.uploads.get(endpoint, 0) + upload_bytes
+
+    def snapshot(self, app):
+        with self._lock:
+            data = {
+                'buckets': list(self.buckets),
+                'requests': [[endpoint, status, count] for (endpoint, status), count in self.requests.items()],
+                'latency': {endpoint: list(histogram) for endpoint, histogram in self.latency.items()},
+                'uploads': dict(self.uploads),
+            }
+        data['caches'] = _cache_counts(app)
+        data['pool'] = _pool_gauges(app)
+        return data
+
+
+def _cache_counts(app):
+    """{cache: [hits, misses]} of this process's caches that exist"""
+    from lawyer_directory import facet_cache
+    counts = {'lawyer_facets': [facet_cache.hits, facet_cache.misses]}
+    render_cache = app.extensions.get('render_cache')
+    if render_cache is not None:
+        counts['render'] = [render_cache.memory_hits + render_cache.disk_hits, render_cache.misses]
+    for name, key in (('directory_pages', 'directory_page_cache'), ('fragments', 'fragment_cache')):
+        cache = app.extensions.get(key)
+        if cache is not None:
+            counts[name] = [cache.hits, cache.misses]
+    return counts
+
+
+def _pool_gauges(app):
+    from app import db
+    with app.app_context():
+        pool = db.engine.pool
+    if not hasattr(pool, 'checkedout'):
+        return {}  # e.g. SQLite in-memory pools
+    # overflow() counts up from -size until the pool is full
+    return {'size': pool.size(), 'checked_out': pool.checkedout(), 'overflow': max(pool.overflow(), 0)}
+
+
+class MetricsFiles:
+    """Worker files under a folder and the merge of all of them"""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.name = f'worker-{os.getpid()}-{uuid.uuid4().hex[:8]}.json'
+        os.makedirs(folder, exist_ok=True)
+
+    def write(self, data):
+        path = os.path.join(self.folder, self.name)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def _read(self, name):
+        try:
+            with open(os.path.join(self.folder, name)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _archive_exited(self, names):
+        """Fold files of workers that are gone into the archive"""
+        with open(os.path.join(self.folder, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            archive = self._read(ARCHIVE_FILE) or {}
+            for name in names:
+                data = self._read(name)
+                if data is not None:
+                    data.pop('pool', None)
+                    archive = merge([archive, data])
+                try:
+                    os.remove(os.path.join(self.folder, name))
+                except FileNotFoundError:
+                    pass
+            path = os.path.join(self.folder, ARCHIVE_FILE)
+            with open(f'{path}.tmp', 'w') as f:
+                json.dump(archive, f)
+            os.replace(f'{path}.tmp', path)
+
+    def collect(self, own):
+        """Merged metrics of every worker, with this worker's own data live"""
+        snapshots, exited = [own], []
+        for name in os.listdir(self.folder):
+            if not name.startswith('worker-') or not name.endswith('.json') or name == self.name:
+                continue
+            if _alive(int(name.split('-')[1])):
+                data = self._read(name)
+                if data is not None:
+                    snapshots.append(data)
+            else:
+                exited.append(name)
+        if exited:
+            self._archive_exited(exited)
+        archive = self._read(ARCHIVE_FILE)
+        if archive:
+            snapshots.append(archive)
+        return merge(snapshots)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def merge(snapshots):
+    """Sum of several workers' snapshots"""
+    merged = {'buckets': None, 'requests': {}, 'latency': {}, 'uploads': {}, 'caches': {}, 'pool': {}}
+    for data in snapshots:
+        if not data:
+            continue
+        merged['buckets'] = merged['buckets'] or data.get('buckets')
+        for endpoint, status, count in data.get('requests', []):
+            key = (endpoint, status)
+            merged['requests'][key] = merged['requests'].get(key, 0) + count
+        for endpoint, histogram in data.get('latency', {}).items():
+            total = merged['latency'].get(endpoint)
+            merged['latency'][endpoint] = histogram if total is None else [a + b for a, b in zip(total, histogram)]
+        for section in ('uploads', 'pool'):
+            for key, value in data.get(section, {}).items():
+                merged[section][key] = merged[section].get(key, 0) + value
+        for cache, (hits, misses) in data.get('caches', {}).items():
+            total = merged['caches'].get(cache, [0, 0])
+            merged['caches'][cache] = [total[0] + hits, total[1] + misses]
+    merged['requests'] = [[endpoint, status, count] for (endpoint, status), count in merged['requests'].items()]
+    return merged
+
+
+def _label(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def render_prometheus(data):
+    """Prometheus text exposition format (version 0.0.4)"""
+    lines = ['# HELP http_requests_total Requests by endpoint and status.', '# TYPE http_requests_total counter']
+    for endpoint, status, count in sorted(data['requests']):
+        lines.append(f'http_requests_total{{endpoint="{_label(endpoint)}",status="{status}"}} {count}')
+
+    lines += ['# HELP http_request_duration_seconds Request latency by endpoint.',
+              '# TYPE http_request_duration_seconds histogram']
+    buckets = data['buckets'] or list(DEFAULT_BUCKETS)
+    for endpoint, histogram in sorted(data['latency'].items()):
+        label = _label(endpoint)
+        cumulative = 0
+        for bound, count in zip(buckets + ['+Inf'], histogram[:-1]):
+            cumulative += count
+            lines.append(f'http_request_duration_seconds_bucket{{endpoint="{label}",le="{bound}"}} {cumulative}')
+        lines.append(f'http_request_duration_seconds_sum{{endpoint="{label}"}} {histogram[-1]}')
+        lines.append(f'http_request_duration_seconds_count{{endpoint="{label}"}} {cumulative}')
+
+    lines += ['# HELP http_upload_bytes_total Bytes received in multipart (upload) requests.',
+              '# TYPE http_upload_bytes_total counter']
+    for endpoint, total in sorted(data['uploads'].items()):
+        lines.append(f'http_upload_bytes_total{{endpoint="{_label(endpoint)}"}} {total}')
+
+    caches = sorted(data['caches'].items())
+    for name, index, help_text in (('cache_hits_total', 0, 'Cache hits.'), ('cache_misses_total', 1, 'Cache misses.')):
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        lines += [f'{name}{{cache="{cache}"}} {counts[index]}' for cache, counts in caches]
+    lines += ['# HELP cache_hit_ratio Hits over lookups since the workers started.', '# TYPE cache_hit_ratio gauge']
+    for cache, (hits, misses) in caches:
+        lines.append(f'cache_hit_ratio{{cache="{cache}"}} {hits / (hits + misses) if hits + misses else 0.0}')
+
+    for name, help_text in (('size', 'Configured pool size.'), ('checked_out', 'Connections in use.'),
+                            ('overflow', 'Connections beyond the pool size.')):
+        if name in data['pool']:
+            lines += [f'# HELP db_pool_{name} {help_text} Summed over workers.', f'# TYPE db_pool_{name} gauge',
+                      f'db_pool_{name} {data["pool"][name]}']
+    return '\n'.join(lines) + '\n'
+
+
+class Metrics:
+    """Per-process metrics with a flusher thread, recreated after a fork"""
+
+    def __init__(self, app):
+        self.app = app
+        self.pid = os.getpid()
+        self.worker = WorkerMetrics(app.config['METRICS_BUCKETS'])
+        self.files = MetricsFiles(os.path.join(app.root_path, app.config['METRICS_FOLDER']))
+        self._thread = threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def flush(self):
+        self.files.write(self.worker.snapshot(self.app))
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.app.config['METRICS_FLUSH_INTERVAL'])
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception('Writing metrics failed')
+
+    def collect(self):
+        return self.files.collect(self.worker.snapshot(self.app))
+
+
+_metrics_lock = threading.Lock()
+
+
+def get_metrics(app=None):
+    app = app or current_app._get_current_object()
+    metrics = app.extensions.get('metrics')
+    if metrics is None or metrics.pid != os.getpid():
+        with _metrics_lock:
+            metrics = app.extensions.get('metrics')
+            if metrics is None or metrics.pid != os.getpid():
+                metrics = app.extensions['metrics'] = Metrics(app)
+    return metrics
+
+
+def start_timer():
+    g._metrics_started = time.perf_counter()
+
+
+def observe_request(response):
+    started = g.pop('_metrics_started', None)
+    if started is not None:
+        upload_bytes = (request.content_length or 0) if request.mimetype == 'multipart/form-data' else 0
+        get_metrics().worker.observe(request.endpoint or 'unmatched', response.status_code,
+                                     time.perf_counter() - started, upload_bytes)
+    return response
+
+
+def init_metrics(app):
+    if app.config['METRICS_ENABLED']:
+        app.before_request(start_timer)
+        app.after_request(observe_request)
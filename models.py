@@ -1,11 +1,17 @@
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy import event, text
+from sqlalchemy.orm.attributes import NO_VALUE, NEVER_SET
 from werkzeug.security import generate_password_hash, check_password_hash
 from app import db
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        db.Index('ix_users_role_first_name', 'role', 'first_name'),
+        db.Index('ix_users_role_last_name', 'role', 'last_name'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -36,6 +42,13 @@ class User(UserMixin, db.Model):
 
 class Court(db.Model):
     __tablename__ = 'courts'
+    __fragment_row_tags__ = True  # fragments tag rows of this table as '<table>:<id>'
+    __table_args__ = (
+        db.Index('ix_courts_name', 'name'),
+        db.Index('ix_courts_grid', 'grid_lat', 'grid_lon'),
+        db.Index('ix_courts_location_gist', text('point(longitude, latitude)'),
+                 postgresql_using='gist').ddl_if(dialect='postgresql'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
@@ -49,6 +62,8 @@ class Court(db.Model):
     working_hours = db.Column(db.Text)
     latitude = db.Column(db.Float)
     longitude = db.Column(db.Float)
+    grid_lat = db.Column(db.Integer)  # geo.grid_cell of the coordinates, set on save
+    grid_lon = db.Column(db.Integer)
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
@@ -57,6 +72,12 @@ class Court(db.Model):
 
 class LawyerProfile(db.Model):
     __tablename__ = 'lawyer_profiles'
+    __fragment_row_tags__ = True  # fragments tag rows of this table as '<table>:<id>'
+    __table_args__ = (
+        db.Index('ix_lawyer_profiles_verified_ranking', 'is_verified', 'ranking_score'),
+        db.Index('ix_lawyer_profiles_governorate_ranking', 'is_verified', 'governorate', 'ranking_score'),
+        db.Index('ix_lawyer_profiles_specialization_ranking', 'is_verified', 'specialization', 'ranking_score'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -67,16 +88,49 @@ class LawyerProfile(db.Model):
     office_address = db.Column(db.Text)
     consultation_fee = db.Column(db.Float)
     bio = db.Column(db.Text)
+    governorate = db.Column(db.String(50))  # office governorate, filtered on by the directory
     rating = db.Column(db.Float, default=0.0)
     total_reviews = db.Column(db.Integer, default=0)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)  # maintained by reviews.py
+    ranking_score = db.Column(db.Float)  # Bayesian average the directory sorts on
     is_verified = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
     user = db.relationship('User', backref='lawyer_profile')
 
+class Review(db.Model):
+    __tablename__ = 'reviews'
+    __table_args__ = (
+        db.UniqueConstraint('lawyer_id', 'client_id', name='uq_reviews_lawyer_client'),
+        db.Index('ix_reviews_lawyer_created', 'lawyer_id', 'created_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    lawyer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    client_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    rating = db.Column(db.Integer, nullable=False)  # 1-5
+    comment = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Relationships
+    lawyer = db.relationship('User', foreign_keys=[lawyer_id], backref='reviews_received')
+    client = db.relationship('User', foreign_keys=[client_id], backref='reviews_written')
+
 class Case(db.Model):
     __tablename__ = 'cases'
+    __fragment_row_tags__ = True  # fragments tag rows of this table as '<table>:<id>'
+    # AUTOINCREMENT so SQLite never hands out the id of an archived or deleted
+    # case again. Existing SQLite databases need the table rebuilt (CREATE the
+    # new table, INSERT ... SELECT, DROP, RENAME) and then
+    #   INSERT OR REPLACE INTO sqlite_sequence (name, seq) SELECT 'cases',
+    #   max(coalesce((SELECT max(id) FROM cases), 0), coalesce((SELECT max(id) FROM archived_cases), 0));
+    __table_args__ = (
+        db.Index('ix_cases_lawyer_title', 'lawyer_id', 'title'),
+        db.Index('ix_cases_client_title', 'client_id', 'title'),
+        {'sqlite_autoincrement': True},
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     case_number = db.Column(db.String(50), unique=True, nullable=False)
@@ -104,9 +158,20 @@ class Case(db.Model):
     documents = db.relationship('Document', backref='case', lazy='dynamic')
     appointments = db.relationship('Appointment', backref='case', lazy='dynamic')
     case_updates = db.relationship('CaseUpdate', backref='case', lazy='dynamic')
+    
+    is_archived = False  # see ArchivedCase
+
+class CaseNumberSequence(db.Model):
+    __tablename__ = 'case_number_sequences'
+    
+    scope = db.Column(db.String(50), primary_key=True)  # day:20250101, court:3:2025, etc.
+    next_value = db.Column(db.Integer, nullable=False, default=1)
 
 class Document(db.Model):
     __tablename__ = 'documents'
+    __table_args__ = (
+        db.Index('ix_documents_case_created_at', 'case_id', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
@@ -135,6 +200,7 @@ class DocumentTemplate(db.Model):
     description = db.Column(db.Text)
     template_content = db.Column(db.Text, nullable=False)
     template_fields = db.Column(db.Text)  # JSON of fillable fields
+    version = db.Column(db.Integer, nullable=False, default=1)  # bumped when template_content changes
     is_active = db.Column(db.Boolean, default=True)
     created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -142,8 +208,18 @@ class DocumentTemplate(db.Model):
     # Relationships
     creator = db.relationship('User', backref='created_templates')
 
+@event.listens_for(DocumentTemplate.template_content, 'set', active_history=True)
+def bump_template_version(target, value, oldvalue, initiator):
+    """Bump the version so compiled templates cached under the old one are dropped"""
+    if oldvalue is not NO_VALUE and oldvalue is not NEVER_SET and value != oldvalue:
+        target.version = (target.version or 1) + 1
+
 class Appointment(db.Model):
     __tablename__ = 'appointments'
+    __fragment_row_tags__ = True  # fragments tag rows of this table as '<table>:<id>'
+    __table_args__ = (
+        db.Index('ix_appointments_case_start_datetime', 'case_id', 'start_datetime', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
@@ -170,6 +246,9 @@ class Appointment(db.Model):
 
 class CaseUpdate(db.Model):
     __tablename__ = 'case_updates'
+    __table_args__ = (
+        db.Index('ix_case_updates_case_created_at', 'case_id', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     case_id = db.Column(db.Integer, db.ForeignKey('cases.id'), nullable=False)
@@ -182,6 +261,128 @@ class CaseUpdate(db.Model):
     # Relationships
     creator = db.relationship('User', backref='case_updates')
 
+# Closed cases moved out of the live tables by archive.py; read-only copies
+# with the same columns, so the case page and search can show them
+class ArchivedCase(db.Model):
+    __tablename__ = 'archived_cases'
+    __table_args__ = (
+        db.Index('ix_archived_cases_lawyer_title', 'lawyer_id', 'title'),
+        db.Index('ix_archived_cases_client_title', 'client_id', 'title'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)  # the id the case had in cases
+    case_number = db.Column(db.String(50), unique=True, nullable=False)
+    title = db.Column(db.String(200), nullable=False)
+    description = db.Column(db.Text)
+    case_type = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(30), nullable=False)
+    priority = db.Column(db.String(20))
+    lawyer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    client_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    court_id = db.Column(db.Integer, db.ForeignKey('courts.id'))
+    filed_date = db.Column(db.Date, nullable=False)
+    last_hearing_date = db.Column(db.Date)
+    next_hearing_date = db.Column(db.Date)
+    closed_date = db.Column(db.Date)
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    # Relationships
+    lawyer = db.relationship('User', foreign_keys=[lawyer_id])
+    client = db.relationship('User', foreign_keys=[client_id])
+    court = db.relationship('Court')
+    documents = db.relationship('ArchivedDocument', backref='case', lazy='dynamic')
+    appointments = db.relationship('ArchivedAppointment', backref='case', lazy='dynamic')
+    case_updates = db.relationship('ArchivedCaseUpdate', backref='case', lazy='dynamic')
+    
+    is_archived = True
+
+class ArchivedDocument(db.Model):
+    __tablename__ = 'archived_documents'
+    __table_args__ = (
+        db.Index('ix_archived_documents_case_created_at', 'case_id', 'created_at', 'id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(200), nullable=False)
+    description = db.Column(db.Text)
+    file_name = db.Column(db.String(255), nullable=False)
+    file_path = db.Column(db.String(500), nullable=False)
+    file_size = db.Column(db.Integer)
+    mime_type = db.Column(db.String(100))
+    document_type = db.Column(db.String(50), nullable=False)
+    case_id = db.Column(db.Integer, db.ForeignKey('archived_cases.id'))
+    uploaded_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    is_template = db.Column(db.Boolean)
+    template_category = db.Column(db.String(50))
+    created_at = db.Column(db.DateTime)
+    
+    # Relationships
+    uploaded_by_user = db.relationship('User')
+
+class ArchivedAppointment(db.Model):
+    __tablename__ = 'archived_appointments'
+    __table_args__ = (
+        db.Index('ix_archived_appointments_case_start_datetime', 'case_id', 'start_datetime', 'id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(200), nullable=False)
+    description = db.Column(db.Text)
+    appointment_type = db.Column(db.String(50), nullable=False)
+    start_datetime = db.Column(db.DateTime, nullable=False)
+    end_datetime = db.Column(db.DateTime)
+    is_all_day = db.Column(db.Boolean)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    case_id = db.Column(db.Integer, db.ForeignKey('archived_cases.id'))
+    reminder_minutes = db.Column(db.Integer)
+    reminder_sent = db.Column(db.Boolean)
+    status = db.Column(db.String(20))
+    location = db.Column(db.String(200))
+    created_at = db.Column(db.DateTime)
+    
+    # Relationships
+    user = db.relationship('User')
+
+class ArchivedCaseUpdate(db.Model):
+    __tablename__ = 'archived_case_updates'
+    __table_args__ = (
+        db.Index('ix_archived_case_updates_case_created_at', 'case_id', 'created_at', 'id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    case_id = db.Column(db.Integer, db.ForeignKey('archived_cases.id'), nullable=False)
+    update_type = db.Column(db.String(50), nullable=False)
+    title = db.Column(db.String(200), nullable=False)
+    description = db.Column(db.Text)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    created_at = db.Column(db.DateTime)
+    
+    # Relationships
+    creator = db.relationship('User')
+
+class TableVersion(db.Model):
+    __tablename__ = 'table_versions'
+    
+    name = db.Column(db.String(50), primary_key=True)  # courts, lawyers, etc.
+    version = db.Column(db.Integer, nullable=False, default=1)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class ReplicaHeartbeat(db.Model):
+    __tablename__ = 'replica_heartbeats'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    beat_at = db.Column(db.DateTime, nullable=False)  # last primary stamp, read back on replicas to measure lag
+
+class ImportCheckpoint(db.Model):
+    __tablename__ = 'import_checkpoints'
+    
+    # Committed with each case import batch, so a resume never re-runs a committed batch
+    job_id = db.Column(db.String(32), primary_key=True)
+    committed_rows = db.Column(db.Integer, nullable=False)  # data rows of the file covered by committed batches
+    imported = db.Column(db.Integer, nullable=False)
+
 class Notification(db.Model):
     __tablename__ = 'notifications'
     
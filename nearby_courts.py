@@ -0,0 +1,123 @@
+"""k-nearest active courts around a point.
+
+The full active court set is small, so each worker keeps it in a KD-tree that
+is rebuilt when courts change locally or after COURT_GEO_CACHE_TTL seconds
+(to pick up writes from other workers). Beyond COURT_KDTREE_MAX_COURTS the
+search goes to the database instead: a GiST index on point(longitude,
+latitude) on PostgreSQL, or the indexed grid_lat/grid_lon cells elsewhere.
+Results are always ordered by exact great-circle distance.
+"""
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import event, text
+
+from app import db
+from geo import KDTree, grid_bounds, grid_cell, haversine_km
+from models import Court
+
+
+class CourtIndex:
+    """Per-process KD-tree over active courts with coordinates"""
+
+    def __init__(self):
+        self._tree = None
+        self._built_at = 0.0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._built_at = 0.0
+
+    def _load(self, max_courts):
+        query = db.session.query(
+            Court.id, Court.name, Court.court_type, Court.governorate, Court.city,
+            Court.address, Court.phone, Court.latitude, Court.longitude
+        ).filter(
+            Court.is_active == True,
+            Court.latitude.isnot(None),
+            Court.longitude.isnot(None)
+        )
+        rows = query.limit(max_courts + 1).all()
+        if len(rows) > max_courts:
+            return None  # too many for memory; searches go to the database
+        return KDTree((row.latitude, row.longitude, row._asdict()) for row in rows)
+
+    def tree(self, ttl, max_courts):
+        """The cached tree, or None when the court set exceeds max_courts"""
+        with self._lock:
+            if time.monotonic() - self._built_at < ttl:
+                return self._tree
+        tree = self._load(max_courts)
+        with self._lock:
+            self._tree, self._built_at = tree, time.monotonic()
+        return tree
+
+
+court_index = CourtIndex()
+
+
+@event.listens_for(Court, 'before_insert')
+@event.listens_for(Court, 'before_update')
+def set_court_grid_cell(mapper, connection, target):
+    """Keep the indexed grid cell in step with the coordinates"""
+    if target.latitude is not None and target.longitude is not None:
+        target.grid_lat, target.grid_lon = grid_cell(target.latitude, target.longitude)
+    else:
+        target.grid_lat = target.grid_lon = None
+
+
+@event.listens_for(Court, 'after_insert')
+@event.listens_for(Court, 'after_update')
+@event.listens_for(Court, 'after_delete')
+def court_changed(mapper, connection, target):
+    court_index.invalidate()
+
+
+def _with_distance(lat, lon, courts, k, radius_km):
+    results = []
+    for court in courts:
+        distance = haversine_km(lat, lon, court['latitude'], court['longitude'])
+        if radius_km is None or distance <= radius_km:
+            results.append(dict(court, distance_km=round(distance, 3)))
+    results.sort(key=lambda court: court['distance_km'])
+    return results[:k]
+
+
+def _database_candidates(lat, lon, k, radius_km):
+    columns = (Court.id, Court.name, Court.court_type, Court.governorate, Court.city,
+               Court.address, Court.phone, Court.latitude, Court.longitude)
+    query = db.session.query(*columns).filter(
+        Court.is_active == True, Court.latitude.isnot(None), Court.longitude.isnot(None)
+    )
+
+    postgresql = db.engine.dialect.name == 'postgresql'
+    if radius_km is not None:
+        (lat_lo, lat_hi, lon_lo, lon_hi), (min_lat, max_lat, min_lon, max_lon) = grid_bounds(lat, lon, radius_km)
+        query = query.filter(
+            Court.latitude.between(min_lat, max_lat),
+            Court.longitude.between(min_lon, max_lon)
+        )
+        if not postgresql:
+            query = query.filter(Court.grid_lat.between(lat_lo, lat_hi), Court.grid_lon.between(lon_lo, lon_hi))
+
+    if postgresql:
+        # Index-assisted KNN ordering on the GiST point index; planar degrees
+        # only approximate the ranking, so over-fetch and re-rank exactly
+        query = query.order_by(text('point(longitude, latitude) <-> point(:lon, :lat)')).params(
+            lon=lon, lat=lat
+        ).limit(max(k * 4, k + 20))
+    return [row._asdict() for row in query]
+
+
+def nearest_courts(lat, lon, k=5, radius_km=None):
+    """Up to k active courts within radius_km, nearest first, with distance_km"""
+    config = current_app.config
+    tree = court_index.tree(config['COURT_GEO_CACHE_TTL'], config['COURT_KDTREE_MAX_COURTS'])
+    if tree is not None:
+        courts = [court for _, court in tree.nearest(lat, lon, k, radius_km)]
+    else:
+        courts = _database_candidates(lat, lon, k, radius_km)
+    return _with_distance(lat, lon, courts, k, radius_km)
+
@@ -0,0 +1,321 @@
+"""On-demand profiling of live requests.
+
+Nothing is profiled until an admin turns the switch on from
+/admin/profiles: a sampled fraction of requests for a limited number of
+minutes. The switch is a file under PROFILER_FOLDER so every worker sees
+it; a worker re-reads it at most every PROFILER_SWITCH_CHECK_INTERVAL
+seconds, and while it is off the per-request cost is a clock comparison and
+a header lookup. A single request can also be profiled with the switch off
+by sending the signed token shown on the admin page as the X-Profile
+header.
+
+A profiled request records, depending on PROFILER_MODE:
+
+- 'sample': the request thread's stack every PROFILER_SAMPLE_INTERVAL
+  seconds from a helper thread, written as collapsed stacks (<id>.folded,
+  one 'outer;inner count' line per stack), the input of flamegraph.pl,
+  speedscope and inferno;
+- 'cprofile': cProfile statistics (<id>.prof) for pstats, snakeviz or
+  flameprof.
+
+Either way <id>.json holds the request, its timing and the SQL timeline:
+every statement with its start offset, duration and fingerprint. Only the
+newest PROFILER_MAX_PROFILES profiles are kept.
+"""
+import cProfile
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from flask import current_app, g, has_request_context, request
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from query_stats import fingerprint
+
+SWITCH_FILE = 'switch.json'
+TOKEN_HEADER = 'X-Profile'
+TOKEN_SALT = 'request-profile'
+# The profile pages themselves are never profiled
+SKIPPED_ENDPOINTS = {'static', 'admin_profiles', 'admin_profile_switch', 'admin_profile_download'}
+
+_listeners_lock = threading.Lock()
+_listeners_installed = False
+
+
+class ProfilerSwitch:
+    """The shared on/off state, cached per process"""
+
+    def __init__(self, folder, check_interval):
+        self.path = os.path.join(folder, SWITCH_FILE)
+        self.check_interval = check_interval
+        self.sample_rate = 0.0
+        self.until = 0.0
+        self._mtime = None
+        self._checked_at = float('-inf')
+
+    def _reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            self.sample_rate, self.until, self._mtime = 0.0, 0.0, None
+            return
+        if mtime != self._mtime:
+            try:
+                with open(self.path) as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                return
+            self.sample_rate, self.until, self._mtime = state['sample_rate'], state['until'], mtime
+
+    def current_rate(self):
+        """Fraction of requests to profile now; 0 while the switch is off"""
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            self._reload()
+        return self.sample_rate if self.until > time.time() else 0.0
+
+    def state(self):
+        self._reload()
+        return {'sample_rate': self.sample_rate, 'until': self.until, 'active': self.until > time.time()}
+
+    def turn_on(self, sample_rate, minutes):
+        self._write({'sample_rate': sample_rate, 'until': time.time() + minutes * 60})
+
+    def turn_off(self):
+        self._write({'sample_rate': 0.0, 'until': 0.0})
+
+    def _write(self, state):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(f'{self.path}.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(f'{self.path}.tmp', self.path)
+        self._checked_at = float('-inf')
+
+
+def profiles_folder(app):
+    return os.path.join(app.root_path, app.config['PROFILER_FOLDER'])
+
+
+def get_profiler_switch(app=None):
+    app = app or current_app._get_current_object()
+    switch = app.extensions.get('profiler_switch')
+    if switch is None:
+        switch = ProfilerSwitch(profiles_folder(app), app.config['PROFILER_SWITCH_CHECK_INTERVAL'])
+        app.extensions['profiler_switch'] = switch
+    return switch
+
+
+def _serializer(app):
+    return URLSafeTimedSerializer(app.secret_key, salt=TOKEN_SALT)
+
+
+def profile_token(user_id, app=None):
+    """X-Profile header value that has the request it is sent with profiled"""
+    return _serializer(app or current_app).dumps(user_id)
+
+
+def _valid_token(token):
+    try:
+        _serializer(current_app).loads(token, max_age=current_app.config['PROFILER_TOKEN_MAX_AGE'])
+    except BadSignature:
+        return False
+    return True
+
+
+class StackSampler:
+    """Samples one thread's stack from a helper thread"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}  # 'outer;...;inner' -> samples
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            if names:
+                stack = ';'.join(reversed(names))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def folded(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in sorted(self.stacks.items()))
+
+
+class RequestProfile:
+    """The profile of one request in progress"""
+
+    def __init__(self, mode, interval, reason):
+        self.id = f'{datetime.utcnow():%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:8]}'
+        self.reason = reason
+        self.started = time.perf_counter()
+        self.sql = []
+        self.status = None
+        self.profile = self.sampler = None
+        if mode == 'cprofile':
+            self.profile = cProfile.Profile()
+            try:
+                self.profile.enable()
+            except ValueError:
+                # Another profiler is active in this process (Python 3.12+)
+                self.profile = None
+        if self.profile is None:
+            self.sampler = StackSampler(threading.get_ident(), interval)
+            self.sampler.start()
+
+    def finish(self, folder, max_profiles):
+        elapsed = time.perf_counter() - self.started
+        if self.profile is not None:
+            self.profile.disable()
+        else:
+            self.sampler.stop()
+        os.makedirs(folder, exist_ok=True)
+        base = os.path.join(folder, self.id)
+        if self.profile is not None:
+            self.profile.dump_stats(f'{base}.prof')
+            profile_file = f'{self.id}.prof'
+        else:
+            with open(f'{base}.folded', 'w') as f:
+                f.write(self.sampler.folded())
+            profile_file = f'{self.id}.folded'
+        meta = {
+            'id': self.id,
+            'at': datetime.utcnow().isoformat(timespec='seconds'),
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'endpoint': request.endpoint,
+            'status': self.status,
+            'reason': self.reason,
+            'duration_ms': round(elapsed * 1000, 1),
+            'samples': sum(self.sampler.stacks.values()) if self.sampler else None,
+            'profile_file': profile_file,
+            'sql': self.sql,
+        }
+        with open(f'{base}.json', 'w') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        prune_profiles(folder, max_profiles)
+
+
+def prune_profiles(folder, max_profiles):
+    """Delete all but the newest max_profiles profiles"""
+    ids = sorted(name[:-5] for name in os.listdir(folder) if name.endswith('.json') and name != SWITCH_FILE)
+    for profile_id in ids[:-max_profiles] if max_profiles else ids:
+        for extension in ('.json', '.folded', '.prof'):
+            try:
+                os.remove(os.path.join(folder, profile_id + extension))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles(folder):
+    """Metadata of the stored profiles, newest first, without the SQL timelines"""
+    if not os.path.isdir(folder):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(folder), reverse=True):
+        if not name.endswith('.json') or name == SWITCH_FILE:
+            continue
+        try:
+            with open(os.path.join(folder, name)) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue  # pruned or still being written
+        meta['queries'] = len(meta.pop('sql'))
+        profiles.append(meta)
+    return profiles
+
+
+def _current_profile():
+    if not has_request_context():
+        return None
+    return g.get('_profile')
+
+
+def _install_sql_listeners():
+    """Record statements of profiled requests; done the first time anything is profiled"""
+    global _listeners_installed
+    with _listeners_lock:
+        if _listeners_installed:
+            return
+        event.listen(Engine, 'before_cursor_execute', _start_statement)
+        event.listen(Engine, 'after_cursor_execute', _record_statement)
+        _listeners_installed = True
+
+
+def _start_statement(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the execution context, not the pooled connection, so a failed
+    # statement cannot skew the timings that follow it
+    if _current_profile() is not None and context is not None:
+        context._profile_started = time.perf_counter()
+
+
+def _record_statement(conn, cursor, statement, parameters, context, executemany):
+    profile = _current_profile()
+    started = getattr(context, '_profile_started', None)
+    if profile is None or started is None:
+        return
+    profile.sql.append({
+        'start_ms': round((started - profile.started) * 1000, 2),
+        'ms': round((time.perf_counter() - started) * 1000, 2),
+        'statement': fingerprint(statement),
+    })
+
+
+def start_profile():
+    token = request.headers.get(TOKEN_HEADER)
+    if token:
+        reason = 'header' if _valid_token(token) else None
+    else:
+        rate = get_profiler_switch().current_rate()
+        reason = 'sampled' if rate and random.random() < rate else None
+    if reason is None or request.endpoint in SKIPPED_ENDPOINTS:
+        return
+    _install_sql_listeners()
+    g._profile = RequestProfile(current_app.config['PROFILER_MODE'],
+                                current_app.config['PROFILER_SAMPLE_INTERVAL'], reason)
+
+
+def record_status(response):
+    profile = g.get('_profile')
+    if profile is not None:
+        profile.status = response.status_code
+    return response
+
+
+def finish_profile(exc):
+    profile = g.pop('_profile', None)
+    if profile is None:
+        return
+    if profile.status is None:
+        profile.status = 500
+    try:
+        profile.finish(profiles_folder(current_app), current_app.config['PROFILER_MAX_PROFILES'])
+    except OSError:
+        current_app.logger.exception('Writing request profile failed')
+
+
+def init_profiler(app):
+    app.before_request(start_profile)
+    app.after_request(record_status)
+    app.teardown_request(finish_profile)
@@ -0,0 +1,198 @@
+"""Per-request SQL instrumentation.
+
+Cursor-level engine events count every statement a request runs (ORM,
+Core and raw, on the primary and on replicas) with its time and a
+normalized fingerprint: literals, placeholders and IN lists collapsed, so
+the same query with different values shares one fingerprint. When the
+request ends:
+
+- the response gets a Server-Timing header with the query count and DB time,
+  for admins or for everyone with QUERY_SERVER_TIMING set;
+- a SELECT fingerprint repeated QUERY_N_PLUS_ONE_THRESHOLD times or more is
+  logged as an N+1 pattern;
+- the numbers are added to this worker's per-endpoint window of the last
+  QUERY_STATS_WINDOW requests, shown on /admin/queries.
+
+Statements slower than QUERY_SLOW_THRESHOLD_MS are logged with the types of
+their bound parameters, never the values.
+"""
+import logging
+import re
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from functools import lru_cache
+
+from flask import current_app, g, has_request_context, request
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger('query_stats')
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'%\(\w+\)s|%s|\$\d+|(?<!:):\w+|\?')
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(statement):
+    """The statement with its values replaced by ?"""
+    normalized = _STRING_LITERAL.sub('?', statement)
+    normalized = _PLACEHOLDER.sub('?', normalized)
+    normalized = _NUMBER_LITERAL.sub('?', normalized)
+    normalized = _IN_LIST.sub('(?, ...)', normalized)
+    return ' '.join(normalized.split())
+
+
+def bind_shape(parameters, executemany=False):
+    """Parameter types of a statement, e.g. '(int, str)' or '20 x {name: str}'"""
+    if executemany:
+        return f'{len(parameters)} x {bind_shape(parameters[0])}' if parameters else '[]'
+    if isinstance(parameters, dict):
+        return '{' + ', '.join(f'{key}: {type(value).__name__}' for key, value in parameters.items()) + '}'
+    return '(' + ', '.join(type(value).__name__ for value in parameters or ()) + ')'
+
+
+class RequestQueries:
+    """The statements one request ran"""
+
+    __slots__ = ('count', 'duration', 'fingerprints')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def repeated(self, threshold):
+        return {statement: count for statement, count in self.fingerprints.items()
+                if count >= threshold and statement[:6].upper() == 'SELECT'}
+
+
+class QueryStats:
+    """Recent per-endpoint query numbers and slow statements of this worker"""
+
+    def __init__(self, window=100, slow_entries=50):
+        self.window = window
+        self._routes = {}  # endpoint -> deque of (query count, db seconds, request seconds)
+        self._n_plus_one = {}  # endpoint -> Counter of fingerprint -> requests flagged
+        self._totals = Counter()  # endpoint -> requests since start
+        self.slow = deque(maxlen=slow_entries)
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, queries, elapsed, repeated):
+        with self._lock:
+            samples = self._routes.get(endpoint)
+            if samples is None:
+                samples = self._routes[endpoint] = deque(maxlen=self.window)
+            samples.append((queries.count, queries.duration, elapsed))
+            self._totals[endpoint] += 1
+            if repeated:
+                self._n_plus_one.setdefault(endpoint, Counter()).update(repeated.keys())
+
+    def add_slow(self, entry):
+        with self._lock:
+            self.slow.append(entry)
+
+    def routes(self):
+        """Per-endpoint averages over the window, most DB time first"""
+        with self._lock:
+            snapshot = {endpoint: list(samples) for endpoint, samples in self._routes.items()}
+            n_plus_one = {endpoint: counter.most_common(5) for endpoint, counter in self._n_plus_one.items()}
+            totals = dict(self._totals)
+        rows = []
+        for endpoint, samples in snapshot.items():
+            counts = sorted(count for count, _, _ in samples)
+            db_time = sum(duration for _, duration, _ in samples)
+            rows.append({
+                'endpoint': endpoint,
+                'requests': totals[endpoint],
+                'window': len(samples),
+                'avg_queries': sum(counts) / len(samples),
+                'max_queries': counts[-1],
+                'avg_db_ms': db_time / len(samples) * 1000,
+                'avg_request_ms': sum(elapsed for _, _, elapsed in samples) / len(samples) * 1000,
+                'n_plus_one': [{'fingerprint': statement, 'requests': flagged}
+                               for statement, flagged in n_plus_one.get(endpoint, [])],
+            })
+        rows.sort(key=lambda row: row['avg_db_ms'] * row['window'], reverse=True)
+        return rows
+
+    def slow_queries(self):
+        with self._lock:
+            return list(reversed(self.slow))
+
+
+def get_query_stats(app=None):
+    app = app or current_app._get_current_object()
+    stats = app.extensions.get('query_stats')
+    if stats is None:
+        stats = QueryStats(app.config['QUERY_STATS_WINDOW'])
+        app.extensions['query_stats'] = stats
+    return stats
+
+
+def _current_queries():
+    if not has_request_context():
+        return None
+    return g.get('_queries')
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    # On the statement's execution context, so a statement that raises leaves
+    # nothing behind on the pooled connection
+    if _current_queries() is not None and context is not None:
+        context._query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    queries = _current_queries()
+    started = getattr(context, '_query_started', None)
+    if queries is None or started is None:
+        return
+    duration = time.perf_counter() - started
+    key = fingerprint(statement)
+    queries.count += 1
+    queries.duration += duration
+    queries.fingerprints[key] += 1
+
+    if duration * 1000 >= current_app.config['QUERY_SLOW_THRESHOLD_MS']:
+        shape = bind_shape(parameters, executemany)
+        logger.warning('Slow query (%.1f ms) on %s: %s  binds=%s', duration * 1000, request.endpoint, key, shape)
+        get_query_stats().add_slow({
+            'at': datetime.utcnow().isoformat(timespec='seconds'),
+            'endpoint': request.endpoint,
+            'ms': round(duration * 1000, 1),
+            'fingerprint': key,
+            'binds': shape,
+        })
+
+
+def start_request():
+    g._queries = RequestQueries()
+    g._request_started = time.perf_counter()
+
+
+def finish_request(response):
+    queries = g.pop('_queries', None)
+    if queries is None or request.endpoint is None:
+        return response
+    elapsed = time.perf_counter() - g.pop('_request_started')
+    repeated = queries.repeated(current_app.config['QUERY_N_PLUS_ONE_THRESHOLD'])
+    for statement, count in repeated.items():
+        logger.warning('Possible N+1 on %s: %d x %s', request.endpoint, count, statement)
+    get_query_stats().record(request.endpoint, queries, elapsed, repeated)
+    if current_app.config['QUERY_SERVER_TIMING'] or (current_user.is_authenticated and current_user.role == 'admin'):
+        response.headers.add('Server-Timing',
+                             f'db;desc="{queries.count} queries";dur={queries.duration * 1000:.1f}')
+    return response
+
+
+def init_query_stats(app):
+    if app.config['QUERY_STATS_ENABLED']:
+        app.before_request(start_request)
+        app.after_request(finish_request)
@@ -0,0 +1,240 @@
+"""Lawyer recommendations for a new case.
+
+A column-oriented feature table of all active lawyers (specialization,
+governorate, per-case-type volume and outcomes, per-court volume, active
+caseload, ranking score, verification) is built from three grouped queries
+and kept per worker for LAWYER_RECOMMENDER_REFRESH seconds. A query is then
+one vectorized scoring pass over the table with NumPy; without NumPy the same
+score is computed in a plain loop.
+
+Cases carry no judgement outcome, so closed cases count as successful
+resolutions and appealed ones against them.
+"""
+import math
+import threading
+import time
+from array import array
+
+from flask import current_app
+from sqlalchemy import func
+
+from app import db
+from models import Case, LawyerProfile, User
+from utils import get_case_types
+
+try:
+    import numpy as np
+except ImportError:  # optional; scoring falls back to a pure-Python loop
+    np = None
+
+WEIGHTS = {
+    'specialization': 3.0,
+    'volume': 2.0,
+    'outcome': 2.0,
+    'court': 1.5,
+    'governorate': 1.0,
+    'rating': 2.0,
+    'verified': 1.0,
+    'caseload': 2.0,  # penalty at full caseload
+}
+
+# Active cases at which the caseload penalty is at its maximum
+CASELOAD_CAP = 30
+
+ACTIVE_STATUSES = ('active', 'pending', 'on_hold', 'appeal')
+
+
+def _specialization_key(value):
+    return (value or '').replace('_', ' ').strip()
+
+
+def _column(values, typecode='f'):
+    return np.asarray(values, dtype='float32' if typecode == 'f' else 'int32') if np is not None \
+        else array(typecode, values)
+
+
+class LawyerFeatures:
+    """Feature columns for n lawyers; row i describes lawyers[i]"""
+
+    def __init__(self, profiles, case_counts, court_counts, case_types):
+        self.lawyers = list(profiles)
+        self.case_types = {_specialization_key(t): i for i, t in enumerate(case_types)}
+        self.governorates = {}
+        rows = {lawyer['id']: i for i, lawyer in enumerate(self.lawyers)}
+        n, t = len(self.lawyers), len(self.case_types)
+
+        specialization, governorate = [], []
+        for lawyer in self.lawyers:
+            specialization.append(self.case_types.get(_specialization_key(lawyer['specialization']), -1))
+            governorate.append(self.governorates.setdefault(lawyer['governorate'], len(self.governorates))
+                               if lawyer['governorate'] else -1)
+
+        totals, closed, appealed = [0] * (n * t), [0] * (n * t), [0] * (n * t)
+        overall, active = [0] * n, [0] * n
+        for lawyer_id, case_type, status, count in case_counts:
+            row = rows.get(lawyer_id)
+            if row is None:
+                continue
+            overall[row] += count
+            if status in ACTIVE_STATUSES:
+                active[row] += count
+            column = self.case_types.get(_specialization_key(case_type))
+            if column is None:
+                continue
+            totals[row * t + column] += count
+            if status == 'closed':
+                closed[row * t + column] += count
+            elif status == 'appeal':
+                appealed[row * t + column] += count
+
+        courts = {}
+        for lawyer_id, court_id, count in court_counts:
+            row = rows.get(lawyer_id)
+            if row is not None:
+                courts.setdefault(court_id, ([], []))
+                courts[court_id][0].append(row)
+                courts[court_id][1].append(count)
+
+        self.size, self.width = n, t
+        self.specialization = _column(specialization, 'i')
+        self.governorate = _column(governorate, 'i')
+        self.totals = _column(totals)
+        self.closed = _column(closed)
+        self.appealed = _column(appealed)
+        self.overall = _column(overall)
+        self.active = _column(active)
+        self.rating = _column([(lawyer['ranking_score'] or 0.0) / 5.0 for lawyer in self.lawyers])
+        self.verified = _column([1.0 if lawyer['is_verified'] else 0.0 for lawyer in self.lawyers])
+        self.courts = {court_id: (_column(r, 'i'), _column(c)) for court_id, (r, c) in courts.items()}
+        if np is not None and n:
+            for name in ('totals', 'closed', 'appealed'):
+                setattr(self, name, getattr(self, name).reshape(n, t))
+
+    def score(self, case_type=None, governorate=None, court_id=None):
+        """Score of every lawyer for a case; higher is better"""
+        column = self.case_types.get(_specialization_key(case_type)) if case_type else None
+        governorate_code = self.governorates.get(governorate, -2) if governorate else -2
+        if np is None:
+            return self._score_loop(column, governorate_code, court_id)
+        if not self.size:
+            return np.zeros(0, dtype='float32')
+
+        w = WEIGHTS
+        if column is not None:
+            volume = self.totals[:, column]
+            closed, appealed = self.closed[:, column], self.appealed[:, column]
+            score = w['specialization'] * (self.specialization == column)
+        else:
+            volume = self.overall
+            closed, appealed = self.closed.sum(axis=1), self.appealed.sum(axis=1)
+            score = np.zeros(self.size, dtype='float32')
+
+        peak = volume.max()
+        if peak > 0:
+            score += w['volume'] * np.log1p(volume) / np.log1p(peak)
+        score += w['outcome'] * (closed + 1) / (closed + appealed + 2)
+        score += w['governorate'] * (self.governorate == governorate_code)
+        if court_id in self.courts:
+            rows, counts = self.courts[court_id]
+            score[rows] += w['court'] * np.log1p(counts) / np.log1p(counts.max())
+        score += w['rating'] * self.rating
+        score += w['verified'] * self.verified
+        score -= w['caseload'] * np.minimum(self.active / CASELOAD_CAP, 1.0)
+        return score
+
+    def _score_loop(self, column, governorate_code, court_id):
+        w, t = WEIGHTS, self.width
+        if column is not None:
+            volume = [self.totals[i * t + column] for i in range(self.size)]
+            closed = [self.closed[i * t + column] for i in range(self.size)]
+            appealed = [self.appealed[i * t + column] for i in range(self.size)]
+        else:
+            volume = list(self.overall)
+            closed = [sum(self.closed[i * t:(i + 1) * t]) for i in range(self.size)]
+            appealed = [sum(self.appealed[i * t:(i + 1) * t]) for i in range(self.size)]
+
+        court = [0.0] * self.size
+        if court_id in self.courts:
+            rows, counts = self.courts[court_id]
+            peak = math.log1p(max(counts))
+            for row, count in zip(rows, counts):
+                court[row] = math.log1p(count) / peak
+
+        peak = math.log1p(max(volume, default=0))
+        scores = []
+        for i in range(self.size):
+            score = w['specialization'] * (column is not None and self.specialization[i] == column)
+            if peak > 0:
+                score += w['volume'] * math.log1p(volume[i]) / peak
+            score += w['outcome'] * (closed[i] + 1) / (closed[i] + appealed[i] + 2)
+            score += w['governorate'] * (self.governorate[i] == governorate_code)
+            score += w['court'] * court[i]
+            score += w['rating'] * self.rating[i]
+            score += w['verified'] * self.verified[i]
+            score -= w['caseload'] * min(self.active[i] / CASELOAD_CAP, 1.0)
+            scores.append(score)
+        return scores
+
+    def top(self, limit, **case):
+        """The limit best lawyers for a case, as profile dicts with a score"""
+        scores = self.score(**case)
+        if np is not None:
+            limit = min(limit, self.size)
+            if not limit:
+                return []
+            best = np.argpartition(-scores, limit - 1)[:limit]
+            ranked = sorted(best.tolist(), key=lambda i: (-scores[i], self.lawyers[i]['id']))
+        else:
+            ranked = sorted(range(self.size), key=lambda i: (-scores[i], self.lawyers[i]['id']))[:limit]
+        return [dict(self.lawyers[i], score=round(float(scores[i]), 4)) for i in ranked]
+
+
+def load_features():
+    """Build the feature table with three grouped queries"""
+    profiles = db.session.query(
+        User.id, User.first_name, User.last_name, LawyerProfile.specialization,
+        LawyerProfile.governorate, LawyerProfile.law_firm, LawyerProfile.rating,
+        LawyerProfile.total_reviews, LawyerProfile.ranking_score, LawyerProfile.is_verified
+    ).join(LawyerProfile, LawyerProfile.user_id == User.id).filter(
+        User.role == 'lawyer', User.is_active == True
+    ).order_by(User.id)
+
+    case_counts = db.session.query(
+        Case.lawyer_id, Case.case_type, Case.status, func.count(Case.id)
+    ).group_by(Case.lawyer_id, Case.case_type, Case.status)
+
+    court_counts = db.session.query(
+        Case.lawyer_id, Case.court_id, func.count(Case.id)
+    ).filter(Case.court_id.isnot(None)).group_by(Case.lawyer_id, Case.court_id)
+
+    return LawyerFeatures([row._asdict() for row in profiles], case_counts, court_counts, get_case_types())
+
+
+class Recommender:
+    """Per-process feature table, rebuilt when older than the refresh interval"""
+
+    def __init__(self):
+        self._features = None
+        self._built_at = 0.0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._built_at = 0.0
+
+    def features(self, refresh):
+        with self._lock:
+            if self._features is not None and time.monotonic() - self._built_at < refresh:
+                return self._features
+        features = load_features()
+        with self._lock:
+            self._features, self._built_at = features, time.monotonic()
+        return features
+
+
+recommender = Recommender()
+
+
+def recommend_lawyers(case_type=None, governorate=None, court_id=None, limit=10):
+    features = recommender.features(current_app.config['LAWYER_RECOMMENDER_REFRESH'])
+    return features.top(limit, case_type=case_type, governorate=governorate, court_id=court_id)
@@ -0,0 +1,258 @@
+"""Cache of rendered document templates.
+
+Entries are keyed by a hash of the template id, its version and the exact
+field values with their types. A byte-bounded in-memory LRU sits in front
+of an on-disk tier shared by all workers; both evict least recently used
+entries when over budget. Changing ``template_content`` bumps the template version,
+so stale entries can never be hit, and the after-update hook below drops
+them eagerly to give the memory back.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy import event, inspect
+
+from models import DocumentTemplate
+
+
+def _tagged(value):
+    """The value with the type of every part, so distinct values never share a key"""
+    if isinstance(value, dict):
+        items = [[_tagged(k), _tagged(v)] for k, v in value.items()]
+        # Only key order is made canonical
+        return ['dict', sorted(items, key=lambda item: json.dumps(item[0], ensure_ascii=False))]
+    if isinstance(value, (list, tuple)):
+        return [type(value).__name__, [_tagged(v) for v in value]]
+    if value is None or isinstance(value, (str, int, float)):
+        return [type(value).__name__, value]
+    return [type(value).__name__, repr(value)]
+
+
+def cache_key(template_id, version, field_values):
+    """Stable hash of a template version and its exact field values"""
+    payload = json.dumps(_tagged(field_values), ensure_ascii=False)
+    digest = hashlib.sha256(f"{template_id}:{version}:{payload}".encode('utf-8')).hexdigest()
+    return digest
+
+
+class MemoryTier:
+    """LRU of rendered documents bounded by total encoded size"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()  # key -> (template_id, data)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key, template_id, data):
+        if len(data) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.bytes -= len(old[1])
+        self._entries[key] = (template_id, data)
+        self.bytes += len(data)
+        while self.bytes > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.bytes -= len(evicted)
+
+    def invalidate(self, template_id):
+        for key in [k for k, entry in self._entries.items() if entry[0] == template_id]:
+            self.bytes -= len(self._entries.pop(key)[1])
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskTier:
+    """Rendered documents stored as files under <folder>/<template_id>/<key>"""
+
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        os.makedirs(folder, exist_ok=True)
+        self.bytes = sum(size for _, _, size in self._files())
+
+    def _files(self):
+        for entry in os.scandir(self.folder):
+            if not entry.is_dir():
+                continue
+            for item in os.scandir(entry.path):
+                try:
+                    stat = item.stat()
+                except FileNotFoundError:
+                    continue
+                yield item.path, stat.st_mtime, stat.st_size
+
+    def _path(self, template_id, key):
+        return os.path.join(self.folder, str(template_id), key)
+
+    def get(self, template_id, key):
+        path = self._path(template_id, key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)  # mtime doubles as last-access time for eviction
+        except FileNotFoundError:
+            pass  # evicted or invalidated by another worker since the read
+        return data
+
+    def put(self, template_id, key, data):
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(template_id, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        try:
+            replaced = os.path.getsize(path)
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(tmp_path, path)
+        self.bytes += len(data) - replaced
+        if self.bytes > self.max_bytes:
+            self._evict()
+
+    def _evict(self):
+        # Rescan so files written by other workers are accounted for, then
+        # drop oldest entries down to 90% of the budget to amortize the scan
+        files = sorted(self._files(), key=lambda item: item[1])
+        self.bytes = sum(size for _, _, size in files)
+        target = self.max_bytes * 0.9
+        for path, _, size in files:
+            if self.bytes <= target:
+                break
+            try:
+                os.remove(path)
+                self.bytes -= size
+            except FileNotFoundError:
+                pass
+
+    def invalidate(self, template_id):
+        directory = os.path.join(self.folder, str(template_id))
+        if not os.path.isdir(directory):
+            return
+        for item in os.scandir(directory):
+            try:
+                size = item.stat().st_size
+                os.remove(item.path)
+                self.bytes -= size
+            except FileNotFoundError:
+                pass
+
+
+class RenderCache:
+    """Two-tier cache of rendered template output"""
+
+    def __init__(self, folder, memory_bytes, disk_bytes):
+        self.memory = MemoryTier(memory_bytes)
+        self.disk = DiskTier(folder, disk_bytes) if disk_bytes else None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get_or_render(self, template, field_values, render):
+        """Return cached output for these values, calling render() on a miss"""
+        version = template.version or 1
+        key = cache_key(template.id, version, field_values)
+
+        with self._lock:
+            data = self.memory.get(key)
+            if data is not None:
+                self.memory_hits += 1
+                return data.decode('utf-8')
+
+        data = self.disk.get(template.id, key) if self.disk else None
+        if data is not None:
+            with self._lock:
+                self.disk_hits += 1
+                self.memory.put(key, template.id, data)
+            return data.decode('utf-8')
+
+        content = render()
+        data = content.encode('utf-8')
+        with self._lock:
+            self.misses += 1
+            self.memory.put(key, template.id, data)
+        if self.disk:
+            self.disk.put(template.id, key, data)
+        return content
+
+    def invalidate(self, template_id):
+        with self._lock:
+            self.memory.invalidate(template_id)
+        if self.disk:
+            self.disk.invalidate(template_id)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_ratio': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                'memory_entries': len(self.memory),
+                'memory_bytes': self.memory.bytes,
+                'memory_max_bytes': self.memory.max_bytes,
+                'disk_bytes': self.disk.bytes if self.disk else 0,
+                'disk_max_bytes': self.disk.max_bytes if self.disk else 0,
+            }
+
+
+def get_render_cache(app=None):
+    """Return the per-process RenderCache, creating it on first use"""
+    app = app or current_app._get_current_object()
+    cache = app.extensions.get('render_cache')
+    if cache is None:
+        cache = RenderCache(
+            os.path.join(app.root_path, app.config['RENDER_CACHE_FOLDER']),
+            app.config['RENDER_CACHE_MEMORY_BYTES'],
+            app.config['RENDER_CACHE_DISK_BYTES'],
+        )
+        app.extensions['render_cache'] = cache
+    return cache
+
+
+def render_cached(template, field_values):
+    """Render a DocumentTemplate through the rendered-output cache"""
+    from template_engine import render_document_template
+    return get_render_cache().get_or_render(
+        template, field_values, lambda: render_document_template(template, field_values)
+    )
+
+
+def invalidate_template(template_id):
+    """Drop compiled and rendered entries of a template"""
+    from template_engine import compiled_templates
+
+    compiled_templates.invalidate(template_id)
+    cache = current_app.extensions.get('render_cache') if current_app else None
+    if cache is not None:
+        cache.invalidate(template_id)
+
+
+@event.listens_for(DocumentTemplate, 'after_update')
+def template_updated(mapper, connection, target):
+    if inspect(target).attrs.version.history.has_changes():
+        invalidate_template(target.id)
+
+
+@event.listens_for(DocumentTemplate, 'after_delete')
+def template_deleted(mapper, connection, target):
+    invalidate_template(target.id)
@@ -0,0 +1,177 @@
+"""Read-replica routing for the Flask-SQLAlchemy session.
+
+Replicas are configured as READ_REPLICA_URLS and registered as the binds
+replica_0, replica_1, ... ; models stay on the primary. Reads route to a
+replica when all of these hold:
+
+- the request is a GET or HEAD (listings, search and the report pages);
+- the statement is a plain SELECT without FOR UPDATE;
+- the session has not written anything during this request;
+- the user has not written anything in the last READ_REPLICA_STICKY_SECONDS
+  (a timestamp in the Flask session), so redirects after a POST and the
+  next few page views read the user's own writes from the primary.
+
+A session keeps the replica it first read from for as long as that replica
+stays healthy, so a request never mixes reads with different lags.
+Everything else, including CLI commands and background jobs, uses the
+primary. Replica lag is measured with a heartbeat row: every
+READ_REPLICA_LAG_CHECK_INTERVAL seconds a worker stamps replica_heartbeats
+on the primary and reads the replicated stamp back from each replica. A
+replica that is more than READ_REPLICA_MAX_LAG seconds behind, or that
+fails to answer, is skipped until a later check, and reads fall back to the
+primary when no replica qualifies. A replica can be simulated locally with
+a copy of the SQLite file (or any second PostgreSQL database): writes to
+the primary make it fall behind until it is refreshed.
+"""
+import itertools
+import logging
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app, has_request_context, request
+from flask import session as flask_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+REPLICA_BIND_PREFIX = 'replica_'
+STICKY_SESSION_KEY = '_db_primary_until'
+HEARTBEAT_ID = 1
+
+
+def replica_binds(urls):
+    """SQLALCHEMY_BINDS entries for a list of replica URLs"""
+    return {f'{REPLICA_BIND_PREFIX}{index}': url for index, url in enumerate(urls)}
+
+
+class ReplicaRouter:
+    """Per-process choice of a replica engine, skipping lagging replicas"""
+
+    def __init__(self, max_lag, check_interval):
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.lag = {}  # bind key -> seconds behind, or None when unreachable
+        self.checked_at = 0.0
+        self._lock = threading.Lock()
+        self._turn = itertools.count()
+
+    def _heartbeat(self, engine):
+        from models import ReplicaHeartbeat
+        table = ReplicaHeartbeat.__table__
+        with engine.connect() as conn:
+            return conn.execute(select(table.c.beat_at).where(table.c.id == HEARTBEAT_ID)).scalar()
+
+    def _beat(self, primary):
+        """Stamp the heartbeat row on the primary"""
+        from models import ReplicaHeartbeat
+        table = ReplicaHeartbeat.__table__
+        now = datetime.utcnow()
+        with primary.begin() as conn:
+            if not conn.execute(update(table).where(table.c.id == HEARTBEAT_ID).values(beat_at=now)).rowcount:
+                try:
+                    with conn.begin_nested():
+                        conn.execute(insert(table).values(id=HEARTBEAT_ID, beat_at=now))
+                except IntegrityError:
+                    pass
+
+    def check(self, engines):
+        """Measure every replica against the primary's last stamp, then stamp again"""
+        primary = engines[None]
+        lag = {}
+        try:
+            # Stamped by whichever worker checked last
+            primary_beat = self._heartbeat(primary)
+            for key, engine in engines.items():
+                if key is None or not key.startswith(REPLICA_BIND_PREFIX):
+                    continue
+                try:
+                    replica_beat = self._heartbeat(engine)
+                except SQLAlchemyError as e:
+                    logging.warning(f'Read replica {key} unavailable: {e}')
+                    lag[key] = None
+                    continue
+                if primary_beat is None:
+                    lag[key] = 0.0
+                elif replica_beat is None:
+                    lag[key] = None
+                else:
+                    lag[key] = max((primary_beat - replica_beat).total_seconds(), 0.0)
+            self._beat(primary)
+        except SQLAlchemyError as e:
+            logging.warning(f'Replica heartbeat failed: {e}')
+        self.lag = lag
+        self.checked_at = time.monotonic()
+
+    def healthy(self, engines):
+        if time.monotonic() - self.checked_at >= self.check_interval and self._lock.acquire(blocking=False):
+            # One thread measures; the others keep using the previous result
+            try:
+                self.check(engines)
+            finally:
+                self._lock.release()
+        return [key for key, lag in sorted(self.lag.items()) if lag is not None and lag <= self.max_lag]
+
+    def choose(self, engines, current=None):
+        """Bind key of a replica, keeping current while it stays healthy; None to read from the primary"""
+        keys = self.healthy(engines)
+        if not keys:
+            return None
+        if current in keys:
+            return current
+        return keys[next(self._turn) % len(keys)]
+
+
+def get_replica_router(app=None):
+    app = app or current_app._get_current_object()
+    router = app.extensions.get('replica_router')
+    if router is None:
+        router = ReplicaRouter(app.config['READ_REPLICA_MAX_LAG'], app.config['READ_REPLICA_LAG_CHECK_INTERVAL'])
+        app.extensions['replica_router'] = router
+    return router
+
+
+def replica_reads_allowed():
+    """Whether the current request may read from a replica"""
+    if not has_request_context() or request.method not in ('GET', 'HEAD'):
+        return False
+    return flask_session.get(STICKY_SESSION_KEY, 0) <= time.time()
+
+
+def _is_plain_select(clause):
+    return (clause is not None and getattr(clause, 'is_select', False)
+            and getattr(clause, '_for_update_arg', None) is None)
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session that sends safe reads to a replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and not self.info.get('wrote')
+                and _is_plain_select(clause) and replica_reads_allowed()):
+            engines = self._db.engines
+            if len(engines) > 1:
+                # One replica per session (a request), so its reads share one replication lag
+                key = get_replica_router().choose(engines, self.info.get('replica'))
+                if key is not None:
+                    self.info['replica'] = key
+                    return engines[key]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def mark_flush_write(session, flush_context):
+    session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def mark_statement_write(orm_execute_state):
+    if not orm_execute_state.is_select:
+        orm_execute_state.session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def stick_to_primary(session):
+    """Keep the writer on the primary until the replicas have caught up"""
+    if session.info.get('wrote') and has_request_context():
+        flask_session[STICKY_SESSION_KEY] = time.time() + current_app.config['READ_REPLICA_STICKY_SECONDS']
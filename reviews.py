@@ -0,0 +1,116 @@
+"""Lawyer ratings maintained incrementally from reviews.
+
+Every Review insert, update or delete applies its delta to the lawyer's
+rating_sum and total_reviews with one UPDATE in the same transaction, and
+refreshes the average rating and the ranking score from the new totals. The
+ranking score is a Bayesian average that pulls lawyers with few reviews
+towards LAWYER_RATING_PRIOR_MEAN, weighted as LAWYER_RATING_PRIOR_WEIGHT
+reviews, so one 5-star review does not outrank fifty 4.8-star ones.
+"""
+from flask import current_app
+from sqlalchemy import case, event, func, inspect, select, update
+from sqlalchemy.orm import Session
+
+from app import db
+from http_cache import touch_directories
+from models import LawyerProfile, Review
+
+
+def _prior():
+    config = current_app.config
+    return float(config['LAWYER_RATING_PRIOR_MEAN']), float(config['LAWYER_RATING_PRIOR_WEIGHT'])
+
+
+def ranking_score(rating_sum, total_reviews, prior_mean, prior_weight):
+    return (prior_mean * prior_weight + rating_sum) / (prior_weight + total_reviews)
+
+
+def _apply_delta(connection, session, lawyer_id, d_sum, d_count):
+    """Add a review delta to a lawyer's running totals"""
+    if not d_sum and not d_count:
+        return
+    table = LawyerProfile.__table__
+    prior_mean, prior_weight = _prior()
+    new_sum = table.c.rating_sum + d_sum
+    new_count = func.coalesce(table.c.total_reviews, 0) + d_count
+    # SET expressions all read the pre-update row, so each uses new_sum/new_count
+    connection.execute(
+        update(table).where(table.c.user_id == lawyer_id).values(
+            rating_sum=new_sum,
+            total_reviews=new_count,
+            rating=case((new_count > 0, new_sum * 1.0 / new_count), else_=0.0),
+            ranking_score=(prior_mean * prior_weight + new_sum) / (prior_weight + new_count),
+        )
+    )
+    if session is not None:
+        session.info.setdefault('rated_lawyers', set()).add(lawyer_id)
+
+
+@event.listens_for(Review, 'after_insert')
+def review_added(mapper, connection, target):
+    _apply_delta(connection, inspect(target).session, target.lawyer_id, target.rating, 1)
+
+
+@event.listens_for(Review, 'after_delete')
+def review_deleted(mapper, connection, target):
+    state = inspect(target)
+    lawyer_id = state.attrs.lawyer_id.history.deleted or [target.lawyer_id]
+    rating = state.attrs.rating.history.deleted or [target.rating]
+    _apply_delta(connection, state.session, lawyer_id[0], -rating[0], -1)
+
+
+@event.listens_for(Review, 'after_update')
+def review_changed(mapper, connection, target):
+    state = inspect(target)
+    lawyer_history = state.attrs.lawyer_id.history
+    rating_history = state.attrs.rating.history
+    if not lawyer_history.has_changes() and not rating_history.has_changes():
+        return
+    old_lawyer = (lawyer_history.deleted or [target.lawyer_id])[0]
+    old_rating = (rating_history.deleted or [target.rating])[0]
+    if old_lawyer == target.lawyer_id:
+        _apply_delta(connection, state.session, target.lawyer_id, target.rating - old_rating, 0)
+    else:
+        _apply_delta(connection, state.session, old_lawyer, -old_rating, -1)
+        _apply_delta(connection, state.session, target.lawyer_id, target.rating, 1)
+
+
+@event.listens_for(LawyerProfile, 'before_insert')
+def set_initial_ranking(mapper, connection, target):
+    if target.ranking_score is None:
+        target.ranking_score = ranking_score(target.rating_sum or 0, target.total_reviews or 0, *_prior())
+
+
+@event.listens_for(Session, 'after_flush_postexec')
+def expire_rated_profiles(session, flush_context):
+    """Loaded profiles hold pre-update totals after the Core UPDATEs above"""
+    lawyer_ids = session.info.pop('rated_lawyers', None)
+    if not lawyer_ids:
+        return
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, LawyerProfile) and obj.user_id in lawyer_ids:
+            session.expire(obj, ['rating', 'total_reviews', 'rating_sum', 'ranking_score'])
+
+
+def recompute_lawyer_ratings():
+    """Rebuild every lawyer's totals from the reviews table; returns profiles updated"""
+    prior_mean, prior_weight = _prior()
+    totals = {lawyer_id: (rating_sum, count) for lawyer_id, rating_sum, count in db.session.execute(
+        select(Review.lawyer_id, func.sum(Review.rating), func.count(Review.id)).group_by(Review.lawyer_id)
+    )}
+    profiles = db.session.execute(select(LawyerProfile.id, LawyerProfile.user_id)).all()
+    rows = []
+    for profile_id, user_id in profiles:
+        rating_sum, count = totals.get(user_id, (0, 0))
+        rows.append({
+            'id': profile_id,
+            'rating_sum': rating_sum,
+            'total_reviews': count,
+            'rating': rating_sum / count if count else 0.0,
+            'ranking_score': ranking_score(rating_sum, count, prior_mean, prior_weight),
+        })
+    if rows:
+        db.session.execute(update(LawyerProfile), rows)
+        touch_directories(db.session, ['lawyers'])
+    db.session.commit()
+    return len(rows)
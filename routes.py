@@ -1,13 +1,31 @@
 import os
+import json
 from datetime import datetime, date
-from flask import render_template, request, redirect, url_for, flash, jsonify, send_file, abort
+from flask import (render_template, request, redirect, url_for, flash, jsonify, send_file, abort, Response,
+                   stream_with_context)
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import check_password_hash
 from sqlalchemy import or_, desc, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 from app import app, db
 from models import *
 from forms import *
 from utils import *
+from render_cache import render_cached, get_render_cache
+from query_stats import get_query_stats
+from metrics import get_metrics, render_prometheus
+from profiler import get_profiler_switch, list_profiles, profile_token, profiles_folder
+from admin_listings import EXPORTS, export_listing, has_listing_filters, listing_filters
+from case_numbers import taken_case_numbers
+from timeline import case_sections, case_timeline, decode_cursor, serialize_entry
+from nearby_courts import nearest_courts
+from http_cache import cached_directory
+from lawyer_directory import directory_query, lawyer_facets
+from recommendations import recommend_lawyers
+from feeds import (FEED_PAGE_SIZE, all_cases, calendar_select, court_filters, courts_select, lawyers_select,
+                   page_payload, parse_iso_datetime, row_dict, search_selects, serialize_event)
+import reviews  # noqa: F401  keeps lawyer ratings in step with reviews
 
 # Jinja2 template filters
 @app.template_filter('arabic_date')
@@ -16,15 +34,15 @@ def arabic_date_filter(date_obj):
 
 @app.template_filter('role_name')
 def role_name_filter(role):
-    return get_role_display_name(role)
+    return ROLE_NAMES.get(role, role)
 
 @app.template_filter('status_name')
 def status_name_filter(status):
-    return get_status_display_name(status)
+    return STATUS_NAMES.get(status, status)
 
 @app.template_filter('priority_color')
 def priority_color_filter(priority):
-    return get_priority_color(priority)
+    return PRIORITY_COLORS.get(priority, 'secondary')
 
 @app.template_filter('file_size')
 def file_size_filter(bytes):
@@ -132,26 +150,18 @@ def logout():
 
 # Court directory routes
 @app.route('/courts')
+@cached_directory('courts')
 def courts():
-    page = request.args.get('page', 1, type=int)
+    page = max(request.args.get('page', 1, type=int), 1)
     search = request.args.get('search', '')
     governorate = request.args.get('governorate', '')
     court_type = request.args.get('court_type', '')
     
-    query = Court.query.filter_by(is_active=True)
-    
-    if search:
-        query = query.filter(
-            or_(Court.name.contains(search), 
-                Court.city.contains(search),
-                Court.address.contains(search))
-        )
+    if request.args.get('format') == 'json':
+        rows = db.session.execute(courts_select(search, governorate, court_type, page)).all()
+        return jsonify(page_payload(rows, page, FEED_PAGE_SIZE))
     
-    if governorate:
-        query = query.filter_by(governorate=governorate)
-    
-    if court_type:
-        query = query.filter_by(court_type=court_type)
+    query = Court.query.filter_by(is_active=True).filter(*court_filters(search, governorate, court_type))
     
     courts = query.order_by(Court.governorate, Court.name).paginate(
         page=page, per_page=20, error_out=False
@@ -165,6 +175,27 @@ def courts():
                          governorates=get_governorates(),
                          court_types=get_court_types())
 
+@app.route('/courts/nearby')
+def courts_nearby():
+    """Courts near a point: JSON for the map widget, HTML otherwise"""
+    lat = request.args.get('lat', type=float)
+    lng = request.args.get('lng', type=float)
+    k = min(max(request.args.get('k', 5, type=int), 1), 50)
+    radius = request.args.get('radius', type=float)
+    
+    results = None
+    if lat is not None and lng is not None:
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            abort(400)
+        results = nearest_courts(lat, lng, k=k, radius_km=radius)
+    
+    if request.args.get('format') == 'json' or request.accept_mimetypes.best == 'application/json':
+        if results is None:
+            abort(400)
+        return jsonify({'results': results})
+    
+    return render_template('courts/nearby.html', courts=results, lat=lat, lng=lng, k=k, radius=radius)
+
 @app.route('/courts/add', methods=['GET', 'POST'])
 @login_required
 def add_court():
@@ -194,33 +225,26 @@ def add_court():
 
 # Lawyer directory routes
 @app.route('/lawyers')
+@cached_directory('lawyers')
 def lawyers():
-    page = request.args.get('page', 1, type=int)
+    page = max(request.args.get('page', 1, type=int), 1)
     search = request.args.get('search', '')
     specialization = request.args.get('specialization', '')
     governorate = request.args.get('governorate', '')
     
-    query = db.session.query(User, LawyerProfile).join(LawyerProfile).filter(
-        User.role == 'lawyer',
-        User.is_active == True,
-        LawyerProfile.is_verified == True
-    )
+    if request.args.get('format') == 'json':
+        rows = db.session.execute(lawyers_select(search, specialization, governorate, page)).all()
+        return jsonify(page_payload(rows, page, FEED_PAGE_SIZE))
     
-    if search:
-        query = query.filter(
-            or_(User.first_name.contains(search),
-                User.last_name.contains(search),
-                LawyerProfile.law_firm.contains(search))
-        )
+    query = directory_query(User, LawyerProfile, search=search,
+                            specialization=specialization, governorate=governorate)
     
-    if specialization:
-        query = query.filter(LawyerProfile.specialization == specialization)
-    
-    lawyers = query.order_by(LawyerProfile.rating.desc()).paginate(
+    lawyers = query.order_by(LawyerProfile.ranking_score.desc().nulls_last(), LawyerProfile.id).paginate(
         page=page, per_page=20, error_out=False
     )
     
     specializations = ['مدني', 'جنائي', 'تجاري', 'عمالي', 'أحوال_شخصية', 'إداري', 'دستوري', 'دولي', 'عقاري', 'ضرائب']
+    specialization_counts, governorate_counts = lawyer_facets(search, specialization, governorate)
     
     return render_template('lawyers/directory.html',
                          lawyers=lawyers,
@@ -228,6 +252,29 @@ def lawyers():
                          specialization=specialization,
                          governorate=governorate,
                          specializations=specializations,
+                         governorates=get_governorates(),
+                         specialization_counts=specialization_counts,
+                         governorate_counts=governorate_counts)
+
+@app.route('/lawyers/recommend')
+def lawyers_recommend():
+    """Lawyers ranked for a new case: JSON for the case form, HTML otherwise"""
+    case_type = request.args.get('case_type', '')
+    governorate = request.args.get('governorate', '')
+    court_id = request.args.get('court_id', type=int)
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    
+    results = recommend_lawyers(case_type or None, governorate or None, court_id, limit)
+    
+    if request.args.get('format') == 'json' or request.accept_mimetypes.best == 'application/json':
+        return jsonify({'results': results})
+    
+    return render_template('lawyers/recommend.html',
+                         lawyers=results,
+                         case_type=case_type,
+                         governorate=governorate,
+                         court_id=court_id,
+                         case_types=get_case_types(),
                          governorates=get_governorates())
 
 @app.route('/lawyers/profile')
@@ -255,6 +302,7 @@ def edit_lawyer_profile():
             profile = LawyerProfile(user_id=current_user.id)
         
         form.populate_obj(profile)
+        profile.governorate = form.governorate.data or None
         db.session.add(profile)
         db.session.commit()
         flash('تم تحديث الملف الشخصي بنجاح', 'success')
@@ -262,6 +310,55 @@ def edit_lawyer_profile():
     
     return render_template('lawyers/edit_profile.html', form=form, profile=profile)
 
+@app.route('/lawyers/<int:lawyer_id>/review', methods=['GET', 'POST'])
+@login_required
+def review_lawyer(lawyer_id):
+    """Create or update the current client's review of a lawyer"""
+    lawyer = User.query.filter_by(id=lawyer_id, role='lawyer').first_or_404()
+    if current_user.role != 'client':
+        flash('التقييم متاح للعملاء فقط', 'danger')
+        return redirect(url_for('lawyers'))
+    
+    has_case = db.session.query(
+        Case.query.filter_by(lawyer_id=lawyer_id, client_id=current_user.id).exists()
+    ).scalar()
+    if not has_case:
+        flash('يمكنك تقييم المحامين الذين تولوا قضاياك فقط', 'danger')
+        return redirect(url_for('lawyers'))
+    
+    review = Review.query.filter_by(lawyer_id=lawyer_id, client_id=current_user.id).first()
+    form = ReviewForm(obj=review)
+    
+    if form.validate_on_submit():
+        if not review:
+            review = Review(lawyer_id=lawyer_id, client_id=current_user.id)
+            db.session.add(review)
+        review.rating = form.rating.data
+        review.comment = form.comment.data
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            flash('لقد قمت بتقييم هذا المحامي مسبقاً', 'danger')
+            return redirect(url_for('review_lawyer', lawyer_id=lawyer_id))
+        flash('تم حفظ تقييمك بنجاح', 'success')
+        return redirect(url_for('lawyers'))
+    
+    return render_template('lawyers/review.html', form=form, lawyer=lawyer, review=review)
+
+@app.route('/reviews/<int:review_id>/delete', methods=['POST'])
+@login_required
+def delete_review(review_id):
+    review = Review.query.get_or_404(review_id)
+    if review.client_id != current_user.id and current_user.role != 'admin':
+        flash('ليس لديك صلاحية لحذف هذا التقييم', 'danger')
+        return redirect(url_for('lawyers'))
+    
+    db.session.delete(review)
+    db.session.commit()
+    flash('تم حذف التقييم', 'success')
+    return redirect(url_for('lawyers'))
+
 # Case management routes
 @app.route('/cases')
 @login_required
@@ -300,33 +397,31 @@ def create_case():
         flash('ليس لديك صلاحية لإنشاء قضية', 'danger')
         return redirect(url_for('cases'))
     
+    # Client and court are picked through /lookup/clients and /lookup/courts
     form = CaseForm()
     
-    # Populate client choices
-    clients = User.query.filter_by(role='client', is_active=True).all()
-    form.client_id.choices = [(u.id, u.full_name) for u in clients]
-    
-    # Populate court choices
-    courts = Court.query.filter_by(is_active=True).all()
-    form.court_id.choices = [(0, 'اختر المحكمة')] + [(c.id, c.name) for c in courts]
-    
     if form.validate_on_submit():
+        court_id = form.court_id.data or None
+        if form.case_number.data and taken_case_numbers(db.session, [form.case_number.data]):
+            flash('رقم القضية مستخدم بالفعل', 'danger')
+            return render_template('cases/create.html', form=form)
+        
         case = Case(
-            case_number=form.case_number.data,
+            case_number=form.case_number.data or generate_case_number(court_id),
             title=form.title.data,
             description=form.description.data,
             case_type=form.case_type.data,
             lawyer_id=current_user.id,
             client_id=form.client_id.data,
-            court_id=form.court_id.data if form.court_id.data != 0 else None,
+            court_id=court_id,
             priority=form.priority.data,
             filed_date=form.filed_date.data,
             next_hearing_date=form.next_hearing_date.data
         )
         db.session.add(case)
-        db.session.commit()
+        db.session.flush()
         
-        # Create initial case update
+        # Create initial case update in the same transaction
         update = CaseUpdate(
             case_id=case.id,
             update_type='creation',
@@ -340,40 +435,69 @@ def create_case():
         flash('تم إنشاء القضية بنجاح', 'success')
         return redirect(url_for('view_case', id=case.id))
     
-    # Auto-generate case number
-    if not form.case_number.data:
-        form.case_number.data = generate_case_number()
-    
     return render_template('cases/create.html', form=form)
 
+def _case_access_denied(case):
+    """True if the current user may not see this case"""
+    if current_user.role == 'lawyer' and case.lawyer_id != current_user.id:
+        return True
+    elif current_user.role == 'client' and case.client_id != current_user.id:
+        return True
+    return False
+
 @app.route('/cases/<int:id>')
 @login_required
 def view_case(id):
-    case = Case.query.get_or_404(id)
+    case = Case.query.options(
+        joinedload(Case.lawyer), joinedload(Case.client), joinedload(Case.court)
+    ).filter_by(id=id).first()
+    if case is None:
+        # Archived cases are shown read-only (case.is_archived)
+        case = ArchivedCase.query.options(
+            joinedload(ArchivedCase.lawyer), joinedload(ArchivedCase.client), joinedload(ArchivedCase.court)
+        ).filter_by(id=id).first_or_404()
     
     # Check permissions
-    if current_user.role == 'lawyer' and case.lawyer_id != current_user.id:
+    if _case_access_denied(case):
         flash('ليس لديك صلاحية لعرض هذه القضية', 'danger')
         return redirect(url_for('cases'))
-    elif current_user.role == 'client' and case.client_id != current_user.id:
-        flash('ليس لديك صلاحية لعرض هذه القضية', 'danger')
-        return redirect(url_for('cases'))
-    
-    # Get case updates
-    updates = CaseUpdate.query.filter_by(case_id=case.id).order_by(desc(CaseUpdate.created_at)).all()
     
-    # Get case documents
-    documents = Document.query.filter_by(case_id=case.id).order_by(desc(Document.created_at)).all()
+    # First page of the merged timeline; later pages come from case_timeline_feed
+    timeline, next_cursor = case_timeline(case.id, limit=app.config['CASE_TIMELINE_PAGE_SIZE'],
+                                          archived=case.is_archived)
     
-    # Get case appointments
-    appointments = Appointment.query.filter_by(case_id=case.id).order_by(Appointment.start_datetime).all()
+    # The updates, documents and appointments sections list everything, not just the first page
+    updates, documents, appointments = case_sections(case.id, archived=case.is_archived)
     
     return render_template('cases/view.html',
                          case=case,
+                         timeline=timeline,
+                         next_cursor=next_cursor,
                          updates=updates,
                          documents=documents,
                          appointments=appointments)
 
+@app.route('/cases/<int:id>/timeline')
+@login_required
+def case_timeline_feed(id):
+    """Keyset-paginated timeline of updates, documents and appointments"""
+    case = db.session.get(Case, id) or ArchivedCase.query.get_or_404(id)
+    if _case_access_denied(case):
+        abort(403)
+    
+    cursor = None
+    if request.args.get('cursor'):
+        cursor = decode_cursor(request.args['cursor'])
+        if cursor is None:
+            abort(400)
+    limit = min(max(request.args.get('limit', app.config['CASE_TIMELINE_PAGE_SIZE'], type=int), 1), 100)
+    
+    entries, next_cursor = case_timeline(case.id, cursor=cursor, limit=limit, archived=case.is_archived)
+    return jsonify({
+        'items': [serialize_entry(entry) for entry in entries],
+        'next_cursor': next_cursor
+    })
+
 # Document templates routes
 @app.route('/documents/templates')
 @login_required
@@ -421,6 +545,106 @@ def create_document_template():
     
     return render_template('documents/create.html', form=form)
 
+@app.route('/documents/templates/<int:id>/render', methods=['GET', 'POST'])
+@login_required
+def render_template_document(id):
+    """Fill a document template with submitted field values"""
+    if current_user.role not in ['lawyer', 'admin']:
+        flash('ليس لديك صلاحية لاستخدام النماذج', 'danger')
+        return redirect(url_for('document_templates'))
+
+    template = DocumentTemplate.query.get_or_404(id)
+    fields = json.loads(template.template_fields) if template.template_fields else []
+
+    rendered = None
+    if request.method == 'POST':
+        values = request.get_json(silent=True) or request.form.to_dict()
+        rendered = render_cached(template, values)
+        if request.is_json:
+            return jsonify({'template_id': template.id, 'version': template.version, 'content': rendered})
+
+    return render_template('documents/render.html', template=template, fields=fields, rendered=rendered)
+
+def _allowed_merge_ids(source, ids):
+    """Restrict submitted case/client ids to the ones the current user may use"""
+    if source == 'cases':
+        query = db.session.query(Case.id).filter(Case.id.in_(ids))
+        if current_user.role != 'admin':
+            query = query.filter(Case.lawyer_id == current_user.id)
+    else:
+        query = db.session.query(User.id).filter(User.id.in_(ids), User.role == 'client')
+        if current_user.role != 'admin':
+            query = query.filter(User.id.in_(
+                db.session.query(Case.client_id).filter(Case.lawyer_id == current_user.id)
+            ))
+    return [row[0] for row in query.all()]
+
+@app.route('/documents/templates/<int:id>/generate', methods=['GET', 'POST'])
+@login_required
+def generate_documents(id):
+    """Bulk mail-merge of a template over cases, clients or a CSV file"""
+    if current_user.role not in ['lawyer', 'admin']:
+        flash('ليس لديك صلاحية لاستخدام النماذج', 'danger')
+        return redirect(url_for('document_templates'))
+
+    from mail_merge import start_merge_job
+    template = DocumentTemplate.query.get_or_404(id)
+    form = MailMergeForm()
+
+    if form.validate_on_submit():
+        record_ids = None
+        if form.source.data == 'csv':
+            if not form.csv_file.data:
+                flash('يرجى اختيار ملف CSV', 'danger')
+                return render_template('documents/generate.html', form=form, template=template)
+        else:
+            ids = [int(part) for part in form.record_ids.data.replace('،', ',').split(',') if part.strip().isdigit()]
+            record_ids = _allowed_merge_ids(form.source.data, ids) if ids else []
+            if not record_ids:
+                flash('لم يتم تحديد أي سجلات صالحة', 'danger')
+                return render_template('documents/generate.html', form=form, template=template)
+
+        job_id = start_merge_job(template, form.source.data, form.output.data, current_user.id,
+                                 record_ids=record_ids, csv_file=form.csv_file.data)
+        flash('تم بدء إنشاء المستندات', 'info')
+        return redirect(url_for('merge_job', job_id=job_id))
+
+    return render_template('documents/generate.html', form=form, template=template)
+
+def _get_job_or_404(job_id, kind):
+    """Load a background job the current user started (admins see all)"""
+    from jobs import read_job
+    job = read_job(job_id)
+    if not job or job['kind'] != kind:
+        abort(404)
+    if current_user.role != 'admin' and job['user_id'] != current_user.id:
+        abort(403)
+    return job
+
+@app.route('/documents/merge/<job_id>')
+@login_required
+def merge_job(job_id):
+    job = _get_job_or_404(job_id, 'mail_merge')
+    return render_template('documents/merge_status.html', job=job)
+
+@app.route('/documents/merge/<job_id>/status')
+@login_required
+def merge_job_status(job_id):
+    """Progress of a mail-merge job for polling"""
+    job = _get_job_or_404(job_id, 'mail_merge')
+    job.pop('record_ids', None)
+    return jsonify(job)
+
+@app.route('/documents/merge/<job_id>/download')
+@login_required
+def merge_job_download(job_id):
+    from jobs import job_dir
+    job = _get_job_or_404(job_id, 'mail_merge')
+    if job['output'] != 'zip' or job['status'] != 'done':
+        abort(404)
+    return send_file(os.path.join(job_dir(job_id), 'output.zip'), as_attachment=True,
+                     download_name=f"documents_{job_id[:8]}.zip")
+
 # Calendar routes
 @app.route('/calendar')
 @login_required
@@ -434,28 +658,28 @@ def calendar():
         appointments = []
     
     # Convert appointments to calendar events format
-    events = []
-    for appointment in appointments:
-        events.append({
-            'id': appointment.id,
-            'title': appointment.title,
-            'start': appointment.start_datetime.isoformat(),
-            'end': appointment.end_datetime.isoformat() if appointment.end_datetime else None,
-            'allDay': appointment.is_all_day,
-            'backgroundColor': '#007bff' if appointment.appointment_type == 'hearing' else '#28a745'
-        })
+    events = [serialize_event(appointment) for appointment in appointments]
     
     return render_template('calendar/calendar.html', events=events)
 
+@app.route('/calendar/events')
+@login_required
+def calendar_events():
+    """Calendar feed for the widget, optionally limited to [start, end)"""
+    statement = calendar_select(current_user.id, current_user.role,
+                                parse_iso_datetime(request.args.get('start')),
+                                parse_iso_datetime(request.args.get('end')))
+    if statement is None:
+        return jsonify([])
+    return jsonify([serialize_event(row) for row in db.session.execute(statement)])
+
 @app.route('/calendar/appointments/create', methods=['GET', 'POST'])
 @login_required
 def create_appointment():
     form = AppointmentForm()
     
-    # Populate case choices for lawyers
-    if current_user.role == 'lawyer':
-        cases = Case.query.filter_by(lawyer_id=current_user.id, status='active').all()
-        form.case_id.choices = [(0, 'اختر القضية')] + [(c.id, f"{c.case_number} - {c.title}") for c in cases]
+    # Cases are picked through /lookup/cases; only the submitted id is checked
+    form.case_id.query_factory = lambda: _lookup_cases_query().filter_by(status='active')
     
     if form.validate_on_submit():
         start_datetime = datetime.fromisoformat(form.start_datetime.data)
@@ -469,7 +693,7 @@ def create_appointment():
             end_datetime=end_datetime,
             is_all_day=form.is_all_day.data,
             user_id=current_user.id,
-            case_id=form.case_id.data if form.case_id.data != 0 else None,
+            case_id=form.case_id.data or None,
             location=form.location.data,
             reminder_minutes=form.reminder_minutes.data
         )
@@ -480,6 +704,68 @@ def create_appointment():
     
     return render_template('calendar/create_appointment.html', form=form)
 
+# Lookup API routes (searchable select widgets)
+def _lookup_args():
+    q = request.args.get('q', '').strip()
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 50)
+    return q, limit
+
+def _lookup_cases_query():
+    """Cases the current user may attach records to"""
+    if current_user.role == 'admin':
+        return Case.query
+    if current_user.role == 'client':
+        return Case.query.filter_by(client_id=current_user.id)
+    return Case.query.filter_by(lawyer_id=current_user.id)
+
+def _lookup_users(role):
+    if current_user.role not in ['lawyer', 'admin']:
+        abort(403)
+    q, limit = _lookup_args()
+    query = db.session.query(User.id, User.first_name, User.last_name).filter(
+        User.role == role, User.is_active == True
+    )
+    if q:
+        query = query.filter(or_(
+            prefix_filter(User.first_name, q),
+            prefix_filter(User.last_name, q),
+            prefix_filter(User.username, q)
+        ))
+    rows = query.order_by(User.first_name, User.last_name).limit(limit).all()
+    return jsonify({'results': [{'id': r.id, 'text': f"{r.first_name} {r.last_name}"} for r in rows]})
+
+@app.route('/lookup/clients')
+@login_required
+def lookup_clients():
+    return _lookup_users('client')
+
+@app.route('/lookup/lawyers')
+@login_required
+def lookup_lawyers():
+    return _lookup_users('lawyer')
+
+@app.route('/lookup/courts')
+@login_required
+def lookup_courts():
+    q, limit = _lookup_args()
+    query = db.session.query(Court.id, Court.name, Court.city).filter(Court.is_active == True)
+    if q:
+        query = query.filter(prefix_filter(Court.name, q))
+    rows = query.order_by(Court.name).limit(limit).all()
+    return jsonify({'results': [{'id': r.id, 'text': f"{r.name} - {r.city}"} for r in rows]})
+
+@app.route('/lookup/cases')
+@login_required
+def lookup_cases():
+    q, limit = _lookup_args()
+    query = _lookup_cases_query().with_entities(Case.id, Case.case_number, Case.title)
+    if request.args.get('status'):
+        query = query.filter(Case.status == request.args['status'])
+    if q:
+        query = query.filter(or_(prefix_filter(Case.case_number, q), prefix_filter(Case.title, q)))
+    rows = query.order_by(Case.created_at.desc()).limit(limit).all()
+    return jsonify({'results': [{'id': r.id, 'text': f"{r.case_number} - {r.title}"} for r in rows]})
+
 # Client portal routes
 @app.route('/client/portal')
 @login_required
@@ -515,27 +801,22 @@ def reports():
         flash('ليس لديك صلاحية لعرض التقارير', 'danger')
         return redirect(url_for('index'))
     
-    # Basic statistics
-    if current_user.role == 'lawyer':
-        total_cases = Case.query.filter_by(lawyer_id=current_user.id).count()
-        active_cases = Case.query.filter_by(lawyer_id=current_user.id, status='active').count()
-        closed_cases = Case.query.filter_by(lawyer_id=current_user.id, status='closed').count()
-        
-        # Cases by type
-        case_types = db.session.query(
-            Case.case_type,
-            func.count(Case.id).label('count')
-        ).filter_by(lawyer_id=current_user.id).group_by(Case.case_type).all()
-        
-    else:  # admin
-        total_cases = Case.query.count()
-        active_cases = Case.query.filter_by(status='active').count()
-        closed_cases = Case.query.filter_by(status='closed').count()
-        
-        case_types = db.session.query(
-            Case.case_type,
-            func.count(Case.id).label('count')
-        ).group_by(Case.case_type).all()
+    # Archived cases count too; they are closed cases moved out of the live table
+    cases = all_cases('id', 'case_type', 'status', 'lawyer_id')
+    criteria = [cases.c.lawyer_id == current_user.id] if current_user.role == 'lawyer' else []
+    
+    def count_cases(*extra):
+        return db.session.query(func.count()).select_from(cases).filter(*criteria, *extra).scalar()
+    
+    total_cases = count_cases()
+    active_cases = count_cases(cases.c.status == 'active')
+    closed_cases = count_cases(cases.c.status == 'closed')
+    
+    # Cases by type
+    case_types = db.session.query(
+        cases.c.case_type,
+        func.count(cases.c.id).label('count')
+    ).filter(*criteria).group_by(cases.c.case_type).all()
     
     stats = {
         'total_cases': total_cases,
@@ -552,6 +833,14 @@ def search():
     form = SearchForm()
     results = {}
     
+    if request.args.get('query') and request.args.get('format') == 'json':
+        user_id = current_user.id if current_user.is_authenticated else None
+        role = current_user.role if current_user.is_authenticated else None
+        selects = search_selects(request.args['query'], request.args.get('category', 'all'), user_id, role,
+                                 include_archived=request.args.get('archived') == '1')
+        return jsonify({name: [row_dict(row) for row in db.session.execute(statement)]
+                        for name, statement in selects.items()})
+    
     if request.args.get('query'):
         query = request.args.get('query')
         category = request.args.get('category', 'all')
@@ -560,17 +849,22 @@ def search():
         form.category.data = category
         
         if category in ['all', 'cases'] and current_user.is_authenticated:
-            if current_user.role == 'lawyer':
-                cases = Case.query.filter_by(lawyer_id=current_user.id).filter(
-                    or_(Case.title.contains(query), Case.description.contains(query))
-                ).limit(10).all()
-            elif current_user.role == 'client':
-                cases = Case.query.filter_by(client_id=current_user.id).filter(
-                    or_(Case.title.contains(query), Case.description.contains(query))
-                ).limit(10).all()
-            else:
-                cases = []
-            results['cases'] = cases
+            # Archived cases only when asked for (archived=1)
+            models = [('cases', Case)]
+            if request.args.get('archived') == '1':
+                models.append(('archived_cases', ArchivedCase))
+            for name, model in models:
+                if current_user.role == 'lawyer':
+                    cases = model.query.filter_by(lawyer_id=current_user.id).filter(
+                        or_(model.title.contains(query), model.description.contains(query))
+                    ).limit(10).all()
+                elif current_user.role == 'client':
+                    cases = model.query.filter_by(client_id=current_user.id).filter(
+                        or_(model.title.contains(query), model.description.contains(query))
+                    ).limit(10).all()
+                else:
+                    cases = []
+                results[name] = cases
         
         if category in ['all', 'courts']:
             courts = Court.query.filter_by(is_active=True).filter(
@@ -621,27 +915,8 @@ def admin_users():
     admin_required(lambda: None)()
     
     page = request.args.get('page', 1, type=int)
-    search = request.args.get('search', '')
-    role_filter = request.args.get('role', '')
-    status_filter = request.args.get('status', '')
-    
-    query = User.query
     
-    if search:
-        query = query.filter(or_(
-            User.first_name.contains(search),
-            User.last_name.contains(search),
-            User.username.contains(search),
-            User.email.contains(search)
-        ))
-    
-    if role_filter:
-        query = query.filter_by(role=role_filter)
-    
-    if status_filter == 'active':
-        query = query.filter_by(is_active=True)
-    elif status_filter == 'inactive':
-        query = query.filter_by(is_active=False)
+    query = User.query.filter(*listing_filters('users', request.args))
     
     users = query.order_by(User.created_at.desc()).paginate(
         page=page, per_page=20, error_out=False
@@ -729,8 +1004,10 @@ def admin_edit_user(user_id):
 @app.route('/admin/users/<int:user_id>/delete', methods=['POST'])
 @login_required
 def admin_delete_user(user_id):
-    """Delete user"""
+    """Disable the user now and delete their data in a background job"""
     from utils import admin_required, log_admin_activity
+    from user_deletion import create_user_deletion_job, run_user_deletion
+    from jobs import start_job
     admin_required(lambda: None)()
     
     user = User.query.get_or_404(user_id)
@@ -739,13 +1016,50 @@ def admin_delete_user(user_id):
         flash('لا يمكنك حذف حسابك الخاص', 'danger')
         return redirect(url_for('admin_users'))
     
+    # Optional lawyer who takes over the user's cases and appointments
+    reassign_to = request.form.get('reassign_to', type=int)
+    if reassign_to is not None:
+        replacement = db.session.get(User, reassign_to)
+        if not replacement or replacement.id == user.id or replacement.role != 'lawyer' or not replacement.is_active:
+            flash('المحامي البديل غير صالح', 'danger')
+            return redirect(url_for('admin_users'))
+    
     user_name = user.full_name
-    db.session.delete(user)
-    db.session.commit()
+    job = create_user_deletion_job(user, current_user.id, reassign_to=reassign_to)
+    start_job(job['job_id'], run_user_deletion)
     
-    log_admin_activity('حذف مستخدم', f'تم حذف المستخدم: {user_name}')
-    flash(f'تم حذف المستخدم {user_name} بنجاح', 'success')
-    return redirect(url_for('admin_users'))
+    log_admin_activity('حذف مستخدم', f'تم تعطيل المستخدم {user_name} وبدء حذف بياناته')
+    flash(f'تم تعطيل المستخدم {user_name} وسيتم حذف بياناته في الخلفية', 'info')
+    return redirect(url_for('admin_user_deletion_job', job_id=job['job_id']))
+
+@app.route('/admin/users/delete/<job_id>')
+@login_required
+def admin_user_deletion_job(job_id):
+    """Progress of a user deletion"""
+    from utils import admin_required
+    admin_required(lambda: None)()
+    
+    job = _get_job_or_404(job_id, 'user_delete')
+    if request.args.get('format') == 'json':
+        return jsonify(job)
+    return render_template('admin/user_deletion_status.html', job=job)
+
+@app.route('/admin/users/delete/<job_id>/resume', methods=['POST'])
+@login_required
+def admin_resume_user_deletion(job_id):
+    """Resume a failed user deletion at the step it stopped in"""
+    from utils import admin_required
+    from user_deletion import run_user_deletion
+    from jobs import start_job
+    admin_required(lambda: None)()
+    
+    job = _get_job_or_404(job_id, 'user_delete')
+    if job['status'] != 'failed':
+        flash('لا يمكن استئناف عملية الحذف هذه', 'warning')
+    else:
+        start_job(job_id, run_user_deletion)
+        flash('تم استئناف حذف المستخدم', 'info')
+    return redirect(url_for('admin_user_deletion_job', job_id=job_id))
 
 @app.route('/admin/cases')
 @login_required
@@ -755,24 +1069,8 @@ def admin_cases():
     admin_required(lambda: None)()
     
     page = request.args.get('page', 1, type=int)
-    search = request.args.get('search', '')
-    status_filter = request.args.get('status', '')
-    type_filter = request.args.get('type', '')
-    
-    query = Case.query
-    
-    if search:
-        query = query.filter(or_(
-            Case.title.contains(search),
-            Case.case_number.contains(search),
-            Case.description.contains(search)
-        ))
     
-    if status_filter:
-        query = query.filter_by(status=status_filter)
-    
-    if type_filter:
-        query = query.filter_by(case_type=type_filter)
+    query = Case.query.filter(*listing_filters('cases', request.args))
     
     cases = query.order_by(Case.created_at.desc()).paginate(
         page=page, per_page=20, error_out=False
@@ -788,28 +1086,23 @@ def admin_add_case():
     from forms import AdminCaseForm
     admin_required(lambda: None)()
     
+    # Lawyer, client and court are picked through the /lookup endpoints
     form = AdminCaseForm()
     
-    # Populate choices
-    form.lawyer_id.choices = [(0, 'اختر المحامي')] + [
-        (u.id, u.full_name) for u in User.query.filter_by(role='lawyer', is_active=True).all()
-    ]
-    form.client_id.choices = [(0, 'اختر العميل')] + [
-        (u.id, u.full_name) for u in User.query.filter_by(role='client', is_active=True).all()
-    ]
-    form.court_id.choices = [(0, 'اختر المحكمة')] + [
-        (c.id, c.name) for c in Court.query.filter_by(is_active=True).all()
-    ]
-    
     if form.validate_on_submit():
+        court_id = form.court_id.data or None
+        if form.case_number.data and taken_case_numbers(db.session, [form.case_number.data]):
+            flash('رقم القضية مستخدم بالفعل', 'danger')
+            return render_template('admin/add_case.html', form=form)
+        
         case = Case(
-            case_number=form.case_number.data or generate_case_number(),
+            case_number=form.case_number.data or generate_case_number(court_id),
             title=form.title.data,
             description=form.description.data,
             case_type=form.case_type.data,
             lawyer_id=form.lawyer_id.data,
             client_id=form.client_id.data,
-            court_id=form.court_id.data if form.court_id.data != 0 else None,
+            court_id=court_id,
             status=form.status.data,
             priority=form.priority.data,
             filed_date=form.filed_date.data,
@@ -824,6 +1117,88 @@ def admin_add_case():
     
     return render_template('admin/add_case.html', form=form)
 
+@app.route('/admin/cases/import', methods=['GET', 'POST'])
+@login_required
+def admin_import_cases():
+    """Bulk import cases from a CSV or XLSX file"""
+    from utils import admin_required, log_admin_activity
+    from case_import import create_import_job, run_import
+    from jobs import start_job
+    admin_required(lambda: None)()
+    
+    form = CaseImportForm()
+    if form.validate_on_submit():
+        job = create_import_job(None, current_user.id, batch_size=form.batch_size.data,
+                                file_storage=form.file.data)
+        start_job(job['job_id'], run_import)
+        
+        log_admin_activity('استيراد قضايا', f"تم بدء استيراد {job['total']} قضية")
+        flash('تم بدء استيراد القضايا', 'info')
+        return redirect(url_for('admin_import_job', job_id=job['job_id']))
+    
+    return render_template('admin/import_cases.html', form=form)
+
+@app.route('/admin/cases/import/<job_id>')
+@login_required
+def admin_import_job(job_id):
+    """Progress and row errors of a case import"""
+    from utils import admin_required
+    admin_required(lambda: None)()
+    
+    job = _get_job_or_404(job_id, 'case_import')
+    if request.args.get('format') == 'json':
+        return jsonify(job)
+    return render_template('admin/import_status.html', job=job)
+
+@app.route('/admin/cases/import/<job_id>/resume', methods=['POST'])
+@login_required
+def admin_resume_import(job_id):
+    """Resume a failed import after its last committed batch"""
+    from utils import admin_required
+    from case_import import run_import
+    from jobs import start_job
+    admin_required(lambda: None)()
+    
+    job = _get_job_or_404(job_id, 'case_import')
+    if job['status'] != 'failed':
+        flash('لا يمكن استئناف هذا الاستيراد', 'warning')
+    else:
+        start_job(job_id, run_import)
+        flash('تم استئناف الاستيراد', 'info')
+    return redirect(url_for('admin_import_job', job_id=job_id))
+
+@app.route('/admin/cases/archive', methods=['POST'])
+@login_required
+def admin_archive_cases():
+    """Move cases closed longer than the archive period to the archive tables"""
+    from utils import admin_required, log_admin_activity
+    from archive import create_archive_job, run_archive
+    from jobs import start_job
+    admin_required(lambda: None)()
+    
+    days = request.form.get('older_than_days', app.config['CASE_ARCHIVE_AFTER_DAYS'], type=int)
+    if days < 0:
+        flash('مدة الأرشفة غير صالحة', 'danger')
+        return redirect(url_for('admin_cases'))
+    job = create_archive_job(current_user.id, older_than_days=days)
+    start_job(job['job_id'], run_archive)
+    
+    log_admin_activity('أرشفة قضايا', f"تم بدء أرشفة {job['total']} قضية مغلقة منذ أكثر من {days} يوماً")
+    flash('تم بدء أرشفة القضايا المغلقة', 'info')
+    return redirect(url_for('admin_archive_job', job_id=job['job_id']))
+
+@app.route('/admin/cases/archive/<job_id>')
+@login_required
+def admin_archive_job(job_id):
+    """Progress of a case archival job"""
+    from utils import admin_required
+    admin_required(lambda: None)()
+    
+    job = _get_job_or_404(job_id, 'case_archive')
+    if request.args.get('format') == 'json':
+        return jsonify(job)
+    return render_template('admin/archive_status.html', job=job)
+
 @app.route('/admin/courts')
 @login_required
 def admin_courts():
@@ -898,27 +1273,10 @@ def admin_lawyers():
     admin_required(lambda: None)()
     
     page = request.args.get('page', 1, type=int)
-    search = request.args.get('search', '')
-    verified_filter = request.args.get('verified', '')
-    specialization_filter = request.args.get('specialization', '')
-    
-    query = db.session.query(User, LawyerProfile).join(LawyerProfile).filter(User.role == 'lawyer')
-    
-    if search:
-        query = query.filter(or_(
-            User.first_name.contains(search),
-            User.last_name.contains(search),
-            LawyerProfile.license_number.contains(search),
-            LawyerProfile.law_firm.contains(search)
-        ))
-    
-    if verified_filter == 'verified':
-        query = query.filter(LawyerProfile.is_verified == True)
-    elif verified_filter == 'unverified':
-        query = query.filter(LawyerProfile.is_verified == False)
     
-    if specialization_filter:
-        query = query.filter(LawyerProfile.specialization == specialization_filter)
+    query = db.session.query(User, LawyerProfile).join(LawyerProfile).filter(
+        *listing_filters('lawyers', request.args)
+    )
     
     lawyers = query.order_by(User.created_at.desc()).paginate(
         page=page, per_page=20, error_out=False
@@ -934,24 +1292,8 @@ def admin_appointments():
     admin_required(lambda: None)()
     
     page = request.args.get('page', 1, type=int)
-    search = request.args.get('search', '')
-    status_filter = request.args.get('status', '')
-    type_filter = request.args.get('type', '')
-    
-    query = Appointment.query
-    
-    if search:
-        query = query.filter(or_(
-            Appointment.title.contains(search),
-            Appointment.description.contains(search),
-            Appointment.location.contains(search)
-        ))
-    
-    if status_filter:
-        query = query.filter_by(status=status_filter)
     
-    if type_filter:
-        query = query.filter_by(appointment_type=type_filter)
+    query = Appointment.query.filter(*listing_filters('appointments', request.args))
     
     appointments = query.order_by(Appointment.start_datetime.desc()).paginate(
         page=page, per_page=20, error_out=False
@@ -959,6 +1301,65 @@ def admin_appointments():
     
     return render_template('admin/appointments.html', appointments=appointments)
 
+@app.route('/admin/<listing>/export')
+@login_required
+def admin_export(listing):
+    """Stream an admin listing with its current filters as CSV or XLSX"""
+    from utils import admin_required, log_admin_activity
+    admin_required(lambda: None)()
+    
+    if listing not in EXPORTS:
+        abort(404)
+    file_format = request.args.get('format', 'csv')
+    if file_format not in ('csv', 'xlsx'):
+        abort(400)
+    try:
+        chunks, mimetype, file_name = export_listing(db.session, listing, request.args, file_format)
+    except RuntimeError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for(f'admin_{listing}'))
+    
+    log_admin_activity('تصدير بيانات', f'تم تصدير {listing} بصيغة {file_format.upper()}')
+    return Response(stream_with_context(chunks), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{file_name}"'})
+
+@app.route('/admin/<listing>/bulk', methods=['POST'])
+@login_required
+def admin_bulk_action(listing):
+    """Apply a bulk action to the selected rows, or with scope=all to every row matching the listing's filters"""
+    from utils import admin_required
+    from bulk_actions import BULK_ACTIONS, run_bulk_action
+    admin_required(lambda: None)()
+
+    action = request.form.get('action', '')
+    if action not in BULK_ACTIONS.get(listing, {}):
+        abort(404)
+    # Back to the listing as it was filtered; the filters are in the query string, as for the listing itself
+    listing_url = url_for(f'admin_{listing}', **request.args)
+
+    params = {'admin_id': current_user.id}
+    if action == 'reassign':
+        lawyer = db.session.get(User, request.form.get('lawyer_id', 0, type=int))
+        if not lawyer or lawyer.role != 'lawyer' or not lawyer.is_active:
+            flash('المحامي المختار غير صالح', 'danger')
+            return redirect(listing_url)
+        params['lawyer_id'] = lawyer.id
+
+    if request.form.get('scope') == 'all':
+        if not has_listing_filters(listing, request.args):
+            flash('لا يمكن تطبيق الإجراء على جميع السجلات دون تحديد عامل تصفية', 'danger')
+            return redirect(listing_url)
+        changed = run_bulk_action(listing, action, params, filters=request.args)
+    else:
+        ids = request.form.getlist('ids', type=int)
+        if not ids:
+            flash('لم يتم اختيار أي سجل', 'warning')
+            return redirect(listing_url)
+        changed = run_bulk_action(listing, action, params, ids=ids)
+
+    flash(f'تم تطبيق الإجراء على {changed} سجل', 'success' if changed else 'info')
+    return redirect(listing_url)
+
 @app.route('/admin/document-templates')
 @login_required
 def admin_document_templates():
@@ -987,6 +1388,79 @@ def admin_document_templates():
     
     return render_template('admin/document_templates.html', templates=templates)
 
+@app.route('/admin/render-cache/stats')
+@login_required
+def admin_render_cache_stats():
+    """Hit ratio and bytes held by the rendered-document cache"""
+    from utils import admin_required
+    admin_required(lambda: None)()
+    
+    return jsonify(get_render_cache().stats())
+
+@app.route('/admin/queries')
+@login_required
+def admin_query_stats():
+    """Recent per-route query counts, N+1 patterns and slow queries of this worker"""
+    from utils import admin_required
+    admin_required(lambda: None)()
+    
+    stats = get_query_stats()
+    if request.args.get('format') == 'json':
+        return jsonify({'routes': stats.routes(), 'slow_queries': stats.slow_queries()})
+    return render_template('admin/query_stats.html', routes=stats.routes(), slow_queries=stats.slow_queries())
+
+@app.route('/admin/profiles')
+@login_required
+def admin_profiles():
+    """Profiling switch and the stored request profiles"""
+    from utils import admin_required
+    admin_required(lambda: None)()
+    
+    switch = get_profiler_switch().state()
+    profiles = list_profiles(profiles_folder(app))
+    token = profile_token(current_user.id)
+    if request.args.get('format') == 'json':
+        return jsonify({'switch': switch, 'profiles': profiles, 'token': token})
+    return render_template('admin/profiles.html', switch=switch, profiles=profiles, token=token)
+
+@app.route('/admin/profiles/switch', methods=['POST'])
+@login_required
+def admin_profile_switch():
+    """Turn sampled profiling on for a number of minutes, or off"""
+    from utils import admin_required, log_admin_activity
+    admin_required(lambda: None)()
+    
+    switch = get_profiler_switch()
+    if request.form.get('action') == 'off':
+        switch.turn_off()
+        log_admin_activity('إيقاف التحليل', 'تم إيقاف تحليل أداء الطلبات')
+        flash('تم إيقاف تحليل الأداء', 'success')
+        return redirect(url_for('admin_profiles'))
+    
+    percent = request.form.get('percent', 1, type=float)
+    minutes = request.form.get('minutes', 10, type=int)
+    if not 0 < percent <= 100 or not 0 < minutes <= 24 * 60:
+        flash('قيم غير صالحة لنسبة العينة أو المدة', 'danger')
+        return redirect(url_for('admin_profiles'))
+    switch.turn_on(percent / 100, minutes)
+    log_admin_activity('تشغيل التحليل', f'تحليل {percent:g}% من الطلبات لمدة {minutes} دقيقة')
+    flash(f'تم تشغيل تحليل الأداء لـ {percent:g}% من الطلبات لمدة {minutes} دقيقة', 'success')
+    return redirect(url_for('admin_profiles'))
+
+@app.route('/admin/profiles/<profile_id>/<kind>')
+@login_required
+def admin_profile_download(profile_id, kind):
+    """A stored profile: its metadata and SQL timeline (json) or stack data (folded, prof)"""
+    from utils import admin_required
+    admin_required(lambda: None)()
+    
+    if kind not in ('json', 'folded', 'prof') or not profile_id.replace('-', '').isalnum():
+        abort(404)
+    path = os.path.join(profiles_folder(app), f'{profile_id}.{kind}')
+    if not os.path.exists(path):
+        abort(404)
+    return send_file(os.path.abspath(path), as_attachment=kind != 'json', download_name=f'{profile_id}.{kind}')
+
 @app.route('/admin/system-settings')
 @login_required
 def admin_system_settings():
@@ -1005,18 +1479,31 @@ def admin_reports():
     
     stats = get_system_stats()
     
-    # Additional report data
+    # Additional report data, over live and archived cases
+    cases = all_cases('id', 'case_type', 'status', 'created_at')
     case_stats = {
-        'by_type': db.session.query(Case.case_type, func.count(Case.id)).group_by(Case.case_type).all(),
-        'by_status': db.session.query(Case.status, func.count(Case.id)).group_by(Case.status).all(),
+        'by_type': db.session.query(cases.c.case_type, func.count(cases.c.id)).group_by(cases.c.case_type).all(),
+        'by_status': db.session.query(cases.c.status, func.count(cases.c.id)).group_by(cases.c.status).all(),
         'by_month': db.session.query(
-            func.extract('month', Case.created_at).label('month'),
-            func.count(Case.id)
+            func.extract('month', cases.c.created_at).label('month'),
+            func.count(cases.c.id)
         ).group_by('month').all()
     }
     
     return render_template('admin/reports.html', stats=stats, case_stats=case_stats)
 
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics summed over all workers"""
+    token = app.config['METRICS_TOKEN']
+    if not token:
+        from utils import admin_required
+        admin_required(lambda: None)()
+    elif request.headers.get('Authorization') != f'Bearer {token}':
+        abort(403)
+    
+    return render_prometheus(get_metrics().collect()), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
 # Error handlers
 @app.errorhandler(404)
 def not_found(error):
@@ -0,0 +1,262 @@
+"""Synthetic datasets for load tests and query-plan checks.
+
+Generates courts in every governorate, users of every role, verified and
+unverified lawyer profiles, and cases with appointments, case updates and
+notifications, all with Arabic text. Rows are built in memory a batch at a
+time and written with bulk inserts, one transaction per batch, so millions
+of cases fit in bounded memory. The generator is seeded, so the same
+options give the same dataset.
+
+Every synthetic user has the username syn_<role>_<n> and the password
+SYNTHETIC_PASSWORD, which the load benchmark logs in with.
+"""
+import random
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func, insert, select, text
+from werkzeug.security import generate_password_hash
+
+from app import db
+from geo import grid_cell
+from http_cache import touch_directories
+from models import Appointment, Case, CaseUpdate, Court, LawyerProfile, Notification, User
+from utils import get_case_types, get_court_types, get_governorates
+
+SYNTHETIC_PASSWORD = 'synthetic-password'
+
+SCALES = {
+    'small': dict(courts_per_governorate=3, lawyers=200, clients=2000, judges=20, students=50, cases=5000),
+    'medium': dict(courts_per_governorate=8, lawyers=2000, clients=50000, judges=200, students=500, cases=200000),
+    'national': dict(courts_per_governorate=15, lawyers=12000, clients=1500000, judges=1500, students=5000,
+                     cases=3000000),
+}
+
+FIRST_NAMES = ['محمد', 'أحمد', 'علي', 'عبدالله', 'صالح', 'عبدالرحمن', 'خالد', 'يحيى', 'حسن', 'عمر',
+               'فاطمة', 'مريم', 'عائشة', 'خديجة', 'سارة', 'أمل', 'نور', 'هدى', 'سلمى', 'زينب']
+LAST_NAMES = ['الحميري', 'العولقي', 'الشامي', 'الأهدل', 'باوزير', 'السقاف', 'المخلافي', 'العريقي',
+              'الكبسي', 'الوزير', 'العمودي', 'بن بريك', 'الزبيدي', 'الحكيمي', 'الأغبري', 'المقطري']
+CITIES = {
+    'صنعاء': 'صنعاء', 'عدن': 'كريتر', 'تعز': 'تعز', 'الحديدة': 'الحديدة', 'إب': 'إب', 'ذمار': 'ذمار',
+    'حضرموت': 'المكلا', 'لحج': 'الحوطة', 'أبين': 'زنجبار', 'شبوة': 'عتق', 'مأرب': 'مأرب', 'الجوف': 'الحزم',
+    'صعدة': 'صعدة', 'حجة': 'حجة', 'المهرة': 'الغيضة', 'عمران': 'عمران', 'الضالع': 'الضالع', 'ريمة': 'الجبين',
+    'البيضاء': 'البيضاء', 'سقطرى': 'حديبو',
+}
+SPECIALIZATIONS = ['مدني', 'جنائي', 'تجاري', 'عمالي', 'أحوال_شخصية', 'إداري', 'دستوري', 'دولي', 'عقاري', 'ضرائب']
+CASE_SUBJECTS = ['نزاع على ملكية أرض', 'مطالبة بدين', 'فسخ عقد إيجار', 'قضية نفقة', 'حضانة أطفال',
+                 'تعويض عن حادث مروري', 'فصل تعسفي', 'إخلال بعقد توريد', 'قسمة تركة', 'شيك بدون رصيد',
+                 'اعتداء على ممتلكات', 'تزوير محررات', 'منازعة ضريبية', 'إلغاء قرار إداري', 'شراكة تجارية']
+UPDATE_TITLES = [('hearing', 'عقد جلسة'), ('document', 'تقديم مستندات'), ('status_change', 'تغيير حالة القضية'),
+                 ('note', 'ملاحظة من المحامي'), ('hearing', 'تأجيل الجلسة')]
+APPOINTMENT_TYPES = ['hearing', 'meeting', 'deadline', 'consultation', 'court_visit']
+NOTIFICATION_TEXTS = [('reminder', 'تذكير بموعد', 'لديك موعد قادم بخصوص القضية'),
+                      ('update', 'تحديث على القضية', 'تمت إضافة تحديث جديد إلى قضيتك'),
+                      ('system', 'إشعار من النظام', 'تم تحديث بيانات حسابك')]
+PARAGRAPH = ('وحيث إن المدعي قد تقدم بطلبه وفقاً للقانون، وبعد الاطلاع على الأوراق والمستندات المقدمة '
+             'وسماع أقوال الطرفين، فقد تقرر ما يلي. ')
+
+# Rough bounding box of mainland Yemen
+LATITUDES = (12.6, 17.5)
+LONGITUDES = (43.0, 52.0)
+
+
+def _batches(count, size):
+    for start in range(0, count, size):
+        yield start, min(size, count - start)
+
+
+def _person(rng):
+    return rng.choice(FIRST_NAMES), f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+
+
+def _insert_returning_ids(model, rows):
+    return db.session.execute(insert(model).returning(model.id, sort_by_parameter_order=True), rows).scalars().all()
+
+
+def generate_courts(rng, per_governorate):
+    rows = []
+    for governorate in get_governorates():
+        for n in range(per_governorate):
+            latitude, longitude = rng.uniform(*LATITUDES), rng.uniform(*LONGITUDES)
+            grid_lat, grid_lon = grid_cell(latitude, longitude)
+            court_type = get_court_types()[n % len(get_court_types())]
+            rows.append({
+                'name': f'محكمة {governorate} {court_type} {n + 1}',
+                'court_type': court_type,
+                'governorate': governorate,
+                'city': CITIES.get(governorate, governorate),
+                'address': f'شارع {rng.choice(LAST_NAMES)}، {CITIES.get(governorate, governorate)}',
+                'phone': f'0{rng.randint(1, 7)}{rng.randint(100000, 999999)}',
+                'working_hours': 'السبت - الأربعاء 8:00 - 14:00',
+                'latitude': latitude,
+                'longitude': longitude,
+                'grid_lat': grid_lat,
+                'grid_lon': grid_lon,
+                'is_active': rng.random() > 0.05,
+            })
+    ids = _insert_returning_ids(Court, rows)
+    db.session.commit()
+    return ids
+
+
+def generate_users(rng, role, count, batch_size, password_hash):
+    """Insert count users of a role; returns their ids"""
+    offset = db.session.scalar(select(func.count(User.id)).where(User.username.like(f'syn\\_{role}\\_%', escape='\\')))
+    ids = []
+    for start, size in _batches(count, batch_size):
+        rows = []
+        for n in range(offset + start, offset + start + size):
+            first_name, last_name = _person(rng)
+            rows.append({
+                'username': f'syn_{role}_{n}',
+                'email': f'syn_{role}_{n}@example.ye',
+                'password_hash': password_hash,
+                'first_name': first_name,
+                'last_name': last_name,
+                'phone': f'77{rng.randint(1000000, 9999999)}',
+                'role': role,
+                'is_active': rng.random() > 0.02,
+            })
+        ids.extend(_insert_returning_ids(User, rows))
+        db.session.commit()
+    return ids
+
+
+def generate_lawyer_profiles(rng, lawyer_ids, batch_size):
+    prior = current_app.config['LAWYER_RATING_PRIOR_MEAN']
+    governorates = get_governorates()
+    for start, size in _batches(len(lawyer_ids), batch_size):
+        db.session.execute(insert(LawyerProfile), [{
+            'user_id': user_id,
+            'license_number': f'SYN-LIC-{user_id}',
+            'specialization': rng.choice(SPECIALIZATIONS),
+            'experience_years': rng.randint(0, 35),
+            'law_firm': f'مكتب {rng.choice(LAST_NAMES)} للمحاماة',
+            'consultation_fee': float(rng.randrange(5000, 50000, 500)),
+            'governorate': rng.choice(governorates),
+            'rating_sum': 0,
+            'ranking_score': prior,  # bulk inserts skip the before_insert listener
+            'is_verified': rng.random() < 0.8,
+        } for user_id in lawyer_ids[start:start + size]])
+        db.session.commit()
+
+
+def _case_row(rng, number, lawyer_id, client_id, court_id, today):
+    filed = today - timedelta(days=rng.randint(0, 365 * 6))
+    status = rng.choices(('active', 'pending', 'closed'), weights=(5, 2, 3))[0]
+    subject = rng.choice(CASE_SUBJECTS)
+    return {
+        'case_number': f'SYN-{number:09d}',
+        'title': f'{subject} - {rng.choice(LAST_NAMES)}',
+        'description': PARAGRAPH * rng.randint(1, 4),
+        'case_type': rng.choice(get_case_types()),
+        'status': status,
+        'priority': rng.choices(('high', 'medium', 'low'), weights=(2, 5, 3))[0],
+        'lawyer_id': lawyer_id,
+        'client_id': client_id,
+        'court_id': court_id,
+        'filed_date': filed,
+        'next_hearing_date': today + timedelta(days=rng.randint(1, 90)) if status == 'active' else None,
+        'closed_date': filed + timedelta(days=rng.randint(30, 700)) if status == 'closed' else None,
+        'created_at': datetime.combine(filed, datetime.min.time()) + timedelta(hours=rng.randint(8, 15)),
+    }
+
+
+def generate_cases(rng, count, lawyer_ids, client_ids, court_ids, batch_size,
+                   appointments_per_case, updates_per_case, progress=None):
+    """Cases with their appointments and updates, a batch per transaction"""
+    today = date.today()
+    offset = db.session.scalar(select(func.count(Case.id)).where(Case.case_number.like('SYN-%')))
+    for start, size in _batches(count, batch_size):
+        rows, owners = [], []
+        for number in range(offset + start, offset + start + size):
+            lawyer_id, client_id = rng.choice(lawyer_ids), rng.choice(client_ids)
+            rows.append(_case_row(rng, number, lawyer_id, client_id, rng.choice(court_ids), today))
+            owners.append(lawyer_id)
+        case_ids = _insert_returning_ids(Case, rows)
+
+        appointments, updates = [], []
+        for case_id, row, lawyer_id in zip(case_ids, rows, owners):
+            for _ in range(rng.randint(0, 2 * appointments_per_case)):
+                starts = datetime.combine(row['filed_date'], datetime.min.time()) + timedelta(
+                    days=rng.randint(0, 800), hours=rng.randint(8, 14))
+                appointments.append({
+                    'title': f'جلسة {row["title"][:150]}',
+                    'appointment_type': rng.choice(APPOINTMENT_TYPES),
+                    'start_datetime': starts,
+                    'end_datetime': starts + timedelta(hours=1),
+                    'user_id': lawyer_id,
+                    'case_id': case_id,
+                    'status': 'completed' if starts < datetime.now() else 'scheduled',
+                    'location': 'قاعة الجلسات',
+                })
+            for n in range(rng.randint(1, 2 * updates_per_case)):
+                update_type, title = UPDATE_TITLES[0] if n == 0 else rng.choice(UPDATE_TITLES)
+                updates.append({
+                    'case_id': case_id,
+                    'update_type': update_type,
+                    'title': title,
+                    'description': PARAGRAPH,
+                    'created_by': lawyer_id,
+                    'created_at': row['created_at'] + timedelta(days=n * rng.randint(1, 30)),
+                })
+        if appointments:
+            db.session.execute(insert(Appointment), appointments)
+        db.session.execute(insert(CaseUpdate), updates)
+        db.session.commit()
+        if progress:
+            progress(start + size)
+
+
+def generate_notifications(rng, user_ids, per_user, batch_size):
+    now = datetime.utcnow()
+    rows = []
+    for user_id in user_ids:
+        for _ in range(rng.randint(0, 2 * per_user)):
+            notification_type, title, message = rng.choice(NOTIFICATION_TEXTS)
+            rows.append({
+                'user_id': user_id,
+                'title': title,
+                'message': message,
+                'notification_type': notification_type,
+                'is_read': rng.random() < 0.6,
+                'created_at': now - timedelta(minutes=rng.randint(0, 60 * 24 * 180)),
+            })
+        if len(rows) >= batch_size:
+            db.session.execute(insert(Notification), rows)
+            db.session.commit()
+            rows = []
+    if rows:
+        db.session.execute(insert(Notification), rows)
+        db.session.commit()
+
+
+def generate_dataset(seed=1, batch_size=5000, courts_per_governorate=3, lawyers=200, clients=2000,
+                     judges=20, students=50, cases=5000, appointments_per_case=2, updates_per_case=3,
+                     notifications_per_user=3, progress=None):
+    """Generate a dataset; returns {table: rows added}"""
+    rng = random.Random(seed)
+    password_hash = generate_password_hash(SYNTHETIC_PASSWORD)  # hashing per user would dominate
+
+    court_ids = generate_courts(rng, courts_per_governorate)
+    lawyer_ids = generate_users(rng, 'lawyer', lawyers, batch_size, password_hash)
+    client_ids = generate_users(rng, 'client', clients, batch_size, password_hash)
+    judge_ids = generate_users(rng, 'judge', judges, batch_size, password_hash)
+    student_ids = generate_users(rng, 'student', students, batch_size, password_hash)
+    generate_lawyer_profiles(rng, lawyer_ids, batch_size)
+    generate_cases(rng, cases, lawyer_ids, client_ids, court_ids, batch_size,
+                   appointments_per_case, updates_per_case, progress)
+    generate_notifications(rng, lawyer_ids + client_ids, notifications_per_user, batch_size)
+
+    # Bulk inserts bypass the listeners that version the cached directories
+    touch_directories(db.session, {'courts', 'lawyers'})
+    db.session.commit()
+    if db.engine.dialect.name in ('sqlite', 'postgresql'):
+        # Fresh statistics, so the load test sees the plans production would
+        db.session.execute(text('ANALYZE'))
+        db.session.commit()
+    return {
+        'courts': len(court_ids),
+        'users': len(lawyer_ids) + len(client_ids) + len(judge_ids) + len(student_ids),
+        'cases': cases,
+    }
@@ -0,0 +1,123 @@
+"""Unified, keyset-paginated case timeline.
+
+Case updates, documents and appointments are each read as an ordered,
+bounded stream (newest first) and merged in one pass. A page is described by
+a cursor holding the (timestamp, kind, id) of its last item, so fetching the
+next page never scans the rows already shown.
+"""
+import base64
+import heapq
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload
+
+from models import (Appointment, ArchivedAppointment, ArchivedCaseUpdate, ArchivedDocument, CaseUpdate,
+                    Document)
+
+# Tie-break rank between streams with equal timestamps
+KIND_RANK = {'update': 2, 'document': 1, 'appointment': 0}
+
+
+def encode_cursor(key):
+    timestamp, rank, item_id = key
+    raw = f"{timestamp.isoformat()}|{rank}|{item_id}"
+    return base64.urlsafe_b64encode(raw.encode('ascii')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Return the (timestamp, rank, id) key of a cursor, or None if invalid"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('ascii')
+        timestamp, rank, item_id = raw.split('|')
+        return datetime.fromisoformat(timestamp), int(rank), int(item_id)
+    except (ValueError, UnicodeError):
+        return None
+
+
+def _after(column, id_column, rank, cursor):
+    """Keyset predicate: rows of this stream that sort after the cursor"""
+    c_ts, c_rank, c_id = cursor
+    if rank < c_rank:
+        return column <= c_ts
+    if rank > c_rank:
+        return column < c_ts
+    return or_(column < c_ts, and_(column == c_ts, id_column < c_id))
+
+
+def _stream(query, column, id_column, kind, cursor, limit):
+    rank = KIND_RANK[kind]
+    if cursor:
+        query = query.filter(_after(column, id_column, rank, cursor))
+    rows = query.order_by(column.desc(), id_column.desc()).limit(limit).all()
+    return [((getattr(row, column.key), rank, row.id), kind, row) for row in rows]
+
+
+def _models(archived):
+    if archived:
+        return ArchivedCaseUpdate, ArchivedDocument, ArchivedAppointment
+    return CaseUpdate, Document, Appointment
+
+
+def case_sections(case_id, archived=False):
+    """Return the full (updates, documents, appointments) lists of a case's page sections"""
+    update_model, document_model, appointment_model = _models(archived)
+    updates = update_model.query.options(joinedload(update_model.creator)).filter_by(case_id=case_id).order_by(
+        update_model.created_at.desc(), update_model.id.desc()).all()
+    documents = document_model.query.options(joinedload(document_model.uploaded_by_user)).filter_by(
+        case_id=case_id).order_by(document_model.created_at.desc(), document_model.id.desc()).all()
+    appointments = appointment_model.query.filter_by(case_id=case_id).order_by(
+        appointment_model.start_datetime, appointment_model.id).all()
+    return updates, documents, appointments
+
+
+def case_timeline(case_id, cursor=None, limit=20, archived=False):
+    """Return (entries, next_cursor); entries are (key, kind, row) newest first"""
+    fetch = limit + 1
+    update_model, document_model, appointment_model = _models(archived)
+    streams = [
+        _stream(update_model.query.options(joinedload(update_model.creator)).filter_by(case_id=case_id),
+                update_model.created_at, update_model.id, 'update', cursor, fetch),
+        _stream(document_model.query.options(joinedload(document_model.uploaded_by_user)).filter_by(case_id=case_id),
+                document_model.created_at, document_model.id, 'document', cursor, fetch),
+        _stream(appointment_model.query.filter_by(case_id=case_id),
+                appointment_model.start_datetime, appointment_model.id, 'appointment', cursor, fetch),
+    ]
+
+    entries = []
+    for entry in heapq.merge(*streams, key=lambda entry: entry[0], reverse=True):
+        entries.append(entry)
+        if len(entries) == fetch:
+            break
+
+    next_cursor = None
+    if len(entries) > limit:
+        entries = entries[:limit]
+        next_cursor = encode_cursor(entries[-1][0])
+    return entries, next_cursor
+
+
+def serialize_entry(entry):
+    """JSON-ready dict for one timeline entry"""
+    (timestamp, _, _), kind, row = entry
+    item = {
+        'kind': kind,
+        'id': row.id,
+        'timestamp': timestamp.isoformat(),
+        'title': row.title,
+        'description': row.description,
+    }
+    if kind == 'update':
+        item['update_type'] = row.update_type
+        item['created_by'] = row.creator.full_name if row.creator else None
+    elif kind == 'document':
+        item['document_type'] = row.document_type
+        item['file_name'] = row.file_name
+        item['file_size'] = row.file_size
+        item['uploaded_by'] = row.uploaded_by_user.full_name if row.uploaded_by_user else None
+    else:
+        item['appointment_type'] = row.appointment_type
+        item['status'] = row.status
+        item['location'] = row.location
+        item['end'] = row.end_datetime.isoformat() if row.end_datetime else None
+    return item
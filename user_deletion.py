@@ -0,0 +1,119 @@
+"""Deletion of a user and everything that depends on it, in the background.
+
+admin_delete_user only disables the account; a user_delete job then works
+through the rows that reference the user, one step at a time and at most
+USER_DELETE_BATCH_SIZE rows per transaction:
+
+- cases where the user is the lawyer go to the replacement lawyer, if the
+  admin chose one; the user's remaining cases (live and archived) are
+  deleted with their documents, appointments and updates;
+- the user's documents and updates in other cases, and the document
+  templates they created, are reassigned to the admin who deleted them;
+- appointments in other cases go to the replacement lawyer, or are deleted;
+- notifications are deleted; reviews and the lawyer profile are deleted
+  through the ORM so ratings and directory pages follow;
+- finally the user row itself.
+
+Every step selects what is left to do, so the job records the current
+step after each batch and can be resumed after a failure.
+"""
+import os
+
+from flask import current_app
+from sqlalchemy import delete, func, or_, select, update
+
+from app import db
+from jobs import create_job, save_job
+from models import (Appointment, ArchivedAppointment, ArchivedCase, ArchivedCaseUpdate, ArchivedDocument, Case,
+                    CaseUpdate, Document, DocumentTemplate, LawyerProfile, Notification, Review, User)
+
+CASE_FAMILIES = (
+    (Case, Document, Appointment, CaseUpdate),
+    (ArchivedCase, ArchivedDocument, ArchivedAppointment, ArchivedCaseUpdate),
+)
+
+
+def deletion_steps(job):
+    """[(action, model, where, argument)] for the job's user, in order"""
+    user_id, reassign_to, author_id = job['target_user_id'], job['reassign_to'], job['user_id']
+    steps = []
+    for case_model, document, appointment, case_update in CASE_FAMILIES:
+        if reassign_to:
+            steps.append(('update', case_model, case_model.lawyer_id == user_id, {'lawyer_id': reassign_to}))
+        steps.append(('delete_cases', case_model,
+                      or_(case_model.lawyer_id == user_id, case_model.client_id == user_id),
+                      (document, appointment, case_update)))
+        steps.append(('update', document, document.uploaded_by == user_id, {'uploaded_by': author_id}))
+        steps.append(('update', case_update, case_update.created_by == user_id, {'created_by': author_id}))
+        if reassign_to:
+            steps.append(('update', appointment, appointment.user_id == user_id, {'user_id': reassign_to}))
+        else:
+            steps.append(('delete', appointment, appointment.user_id == user_id, None))
+    steps += [
+        ('update', DocumentTemplate, DocumentTemplate.created_by == user_id, {'created_by': author_id}),
+        ('delete', Notification, Notification.user_id == user_id, None),
+        ('orm_delete', Review, or_(Review.lawyer_id == user_id, Review.client_id == user_id), None),
+        ('orm_delete', LawyerProfile, LawyerProfile.user_id == user_id, None),
+        ('orm_delete', User, User.id == user_id, None),
+    ]
+    return steps
+
+
+def _remove_files(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _run_batch(action, model, where, argument, batch_size):
+    """Handle up to batch_size rows of a step in one transaction; returns how many"""
+    ids = db.session.scalars(select(model.id).where(where).order_by(model.id).limit(batch_size)).all()
+    if not ids:
+        return 0
+    files = []
+    if action == 'update':
+        db.session.execute(update(model.__table__).where(model.id.in_(ids)).values(**argument))
+    elif action == 'delete':
+        db.session.execute(delete(model.__table__).where(model.id.in_(ids)))
+    elif action == 'delete_cases':
+        for child in argument:
+            if hasattr(child, 'file_path'):
+                files += db.session.scalars(select(child.file_path).where(child.case_id.in_(ids))).all()
+            db.session.execute(delete(child.__table__).where(child.case_id.in_(ids)))
+        db.session.execute(delete(model.__table__).where(model.id.in_(ids)))
+    else:
+        # Row by row so the rating and directory listeners run
+        for obj in model.query.filter(model.id.in_(ids)):
+            db.session.delete(obj)
+    db.session.commit()
+    _remove_files(files)
+    return len(ids)
+
+
+def run_user_deletion(job):
+    """Work through the deletion steps, resuming at the job's saved step"""
+    batch_size = job['batch_size']
+    steps = deletion_steps(job)
+    while job['step'] < len(steps):
+        handled = _run_batch(*steps[job['step']], batch_size)
+        if handled:
+            job['done'] = min(job['done'] + handled, job['total'])
+        else:
+            job['step'] += 1
+        save_job(job)
+    job['done'] = job['total']
+
+
+def create_user_deletion_job(user, admin_id, reassign_to=None, batch_size=None):
+    """Disable the user now and create the user_delete job for the rest; returns the job"""
+    user.is_active = False
+    db.session.commit()
+
+    job = {'target_user_id': user.id, 'reassign_to': reassign_to, 'user_id': admin_id}
+    total = sum(db.session.scalar(select(func.count()).select_from(model).where(where))
+                for _, model, where, _ in deletion_steps(job))
+    return create_job('user_delete', admin_id, total=total, target_user_id=user.id, reassign_to=reassign_to,
+                      user_name=user.full_name, step=0,
+                      batch_size=batch_size or current_app.config['USER_DELETE_BATCH_SIZE'])
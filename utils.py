@@ -1,5 +1,6 @@
 import os
 import uuid
+import sys
 from datetime import datetime, date
 from werkzeug.utils import secure_filename
 from flask import current_app
@@ -29,13 +30,21 @@ def save_uploaded_file(file, upload_folder='uploads'):
         return unique_filename, file_path
     return None, None
 
+# (upper bound, divisor, unit); dividing by powers of two is exact, so this
+# matches repeated division by 1024
+FILE_SIZE_UNITS = tuple((1024.0 ** (i + 1), 1024.0 ** i, unit) for i, unit in enumerate(['B', 'KB', 'MB', 'GB']))
+
 def format_file_size(bytes):
     """Convert bytes to human readable format"""
-    for unit in ['B', 'KB', 'MB', 'GB']:
-        if bytes < 1024.0:
-            return f"{bytes:.1f} {unit}"
-        bytes /= 1024.0
-    return f"{bytes:.1f} TB"
+    for limit, divisor, unit in FILE_SIZE_UNITS:
+        if bytes < limit:
+            return f"{bytes / divisor:.1f} {unit}"
+    return f"{bytes / 1024.0 ** 4:.1f} TB"
+
+ARABIC_MONTHS = (
+    None, 'يناير', 'فبراير', 'مارس', 'أبريل', 'مايو', 'يونيو',
+    'يوليو', 'أغسطس', 'سبتمبر', 'أكتوبر', 'نوفمبر', 'ديسمبر'
+)
 
 def arabic_date_format(date_obj):
     """Format date in Arabic"""
@@ -45,24 +54,15 @@ def arabic_date_format(date_obj):
     if isinstance(date_obj, str):
         return date_obj
     
-    months_arabic = {
-        1: 'يناير', 2: 'فبراير', 3: 'مارس', 4: 'أبريل',
-        5: 'مايو', 6: 'يونيو', 7: 'يوليو', 8: 'أغسطس',
-        9: 'سبتمبر', 10: 'أكتوبر', 11: 'نوفمبر', 12: 'ديسمبر'
-    }
-    
-    if isinstance(date_obj, datetime):
-        return f"{date_obj.day} {months_arabic[date_obj.month]} {date_obj.year}"
-    elif isinstance(date_obj, date):
-        return f"{date_obj.day} {months_arabic[date_obj.month]} {date_obj.year}"
+    if isinstance(date_obj, date):  # includes datetime
+        return f"{date_obj.day} {ARABIC_MONTHS[date_obj.month]} {date_obj.year}"
     
     return str(date_obj)
 
-def generate_case_number():
-    """Generate unique case number"""
-    timestamp = datetime.now().strftime("%Y%m%d")
-    random_suffix = uuid.uuid4().hex[:6].upper()
-    return f"CASE-{timestamp}-{random_suffix}"
+def generate_case_number(court_id=None):
+    """Allocate the next case number from the sequence-backed allocator"""
+    from case_numbers import allocate_case_number
+    return allocate_case_number(court_id)
 
 def get_governorates():
     """Get list of Yemeni governorates"""
@@ -88,52 +88,40 @@ def get_court_types():
 
 def process_template_fields(template_content):
     """Extract fillable fields from template content"""
-    import re
-    
-    # Find fields marked with {{field_name}}
-    pattern = r'\{\{([^}]+)\}\}'
-    fields = re.findall(pattern, template_content)
-    
-    field_definitions = []
-    for field in fields:
-        field_definitions.append({
-            'name': field.strip(),
-            'label': field.strip().replace('_', ' '),
-            'type': 'text',
-            'required': True
-        })
+    from template_engine import compiled_templates
     
-    return json.dumps(field_definitions)
+    # Fields are marked with {{field_name}}, {{field|date}}, {% if %} and {% for %} blocks
+    return json.dumps(compiled_templates.get_for_content(template_content).field_definitions())
 
 def fill_template(template_content, field_values):
     """Fill template with provided values"""
-    for field_name, value in field_values.items():
-        placeholder = f"{{{{{field_name}}}}}"
-        template_content = template_content.replace(placeholder, str(value))
+    from template_engine import compiled_templates
     
-    return template_content
+    return compiled_templates.get_for_content(template_content).render(field_values)
+
+ROLE_NAMES = {
+    'client': 'متقاض',
+    'lawyer': 'محامي',
+    'judge': 'قاضي',
+    'student': 'طالب قانون',
+    'admin': 'مدير النظام'
+}
 
 def get_role_display_name(role):
     """Get Arabic display name for user role"""
-    role_names = {
-        'client': 'متقاض',
-        'lawyer': 'محامي',
-        'judge': 'قاضي',
-        'student': 'طالب قانون',
-        'admin': 'مدير النظام'
-    }
-    return role_names.get(role, role)
+    return ROLE_NAMES.get(role, role)
+
+STATUS_NAMES = {
+    'active': 'نشطة',
+    'pending': 'معلقة',
+    'closed': 'مغلقة',
+    'on_hold': 'مؤجلة',
+    'appeal': 'استئناف'
+}
 
 def get_status_display_name(status):
     """Get Arabic display name for case status"""
-    status_names = {
-        'active': 'نشطة',
-        'pending': 'معلقة',
-        'closed': 'مغلقة',
-        'on_hold': 'مؤجلة',
-        'appeal': 'استئناف'
-    }
-    return status_names.get(status, status)
+    return STATUS_NAMES.get(status, status)
 
 def calculate_case_age_days(filed_date):
     """Calculate case age in days"""
@@ -146,14 +134,32 @@ def calculate_case_age_days(filed_date):
     today = date.today()
     return (today - filed_date).days
 
+PRIORITY_COLORS = {
+    'high': 'danger',
+    'medium': 'warning',
+    'low': 'success'
+}
+
 def get_priority_color(priority):
     """Get color class for priority"""
-    colors = {
-        'high': 'danger',
-        'medium': 'warning',
-        'low': 'success'
-    }
-    return colors.get(priority, 'secondary')
+    return PRIORITY_COLORS.get(priority, 'secondary')
+
+def prefix_filter(column, prefix):
+    """Index-friendly prefix match: a range scan instead of LIKE 'prefix%'
+
+    The upper bound is the prefix with its last character incremented, the
+    first string past every string starting with the prefix in code point
+    order (SQLite's BINARY collation; on PostgreSQL the column needs
+    COLLATE "C").
+    """
+    from sqlalchemy import and_
+    upper = prefix.rstrip(chr(sys.maxunicode))
+    if not upper:
+        return column >= prefix
+    following = ord(upper[-1]) + 1
+    if 0xD800 <= following <= 0xDFFF:
+        following = 0xE000  # surrogates are not valid text
+    return and_(column >= prefix, column < upper[:-1] + chr(following))
 
 def paginate_query(query, page=1, per_page=20):
     """Helper function for pagination"""
@@ -179,22 +185,11 @@ def admin_required(f):
 
 def get_system_stats():
     """Get system statistics for admin dashboard"""
-    from models import User, Case, Court, LawyerProfile, Appointment
-    
-    stats = {
-        'total_users': User.query.count(),
-        'active_users': User.query.filter_by(is_active=True).count(),
-        'total_cases': Case.query.count(),
-        'active_cases': Case.query.filter_by(status='active').count(),
-        'total_courts': Court.query.count(),
-        'active_courts': Court.query.filter_by(is_active=True).count(),
-        'total_lawyers': LawyerProfile.query.count(),
-        'verified_lawyers': LawyerProfile.query.filter_by(is_verified=True).count(),
-        'total_appointments': Appointment.query.count(),
-        'pending_appointments': Appointment.query.filter_by(status='scheduled').count()
-    }
+    from app import db
+    from feeds import system_stats_select
     
-    return stats
+    # One statement of scalar subqueries instead of a round trip per counter
+    return dict(db.session.execute(system_stats_select()).one()._mapping)
 
 def create_admin_user():
     """Create default admin user if none exists"""
@@ -231,6 +226,7 @@ def log_admin_activity(action, description, user_id=None):
         user_id = current_user.id if current_user.is_authenticated else None
     
     if user_id:
+        # Committed with whatever the caller has pending, so the entry is never lost on its own
         notification = Notification(
             user_id=user_id,
             title=f'إجراء إداري: {action}',